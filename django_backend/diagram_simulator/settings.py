@@ -3,6 +3,7 @@ Django settings for diagram_simulator project.
 """
 
 from pathlib import Path
+from datetime import timedelta
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -38,6 +39,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'simulator.routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -68,9 +70,144 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a persistent connection is reused; keep at 0 under ASGI
+        # unless all ORM access goes through the thread-sensitive executor
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Seconds to wait on a locked database before raising
+            'timeout': 20,
+        },
     }
 }
 
+# Read replicas for load/history/export traffic, as comma-separated database
+# names sharing the primary's settings (e.g. SQLite copies kept current with
+# the refresh_replicas command). Writes always go to 'default'.
+DB_REPLICAS = [name.strip() for name in os.environ.get('DB_REPLICAS', '').split(',') if name.strip()]
+for index, name in enumerate(DB_REPLICAS, start=1):
+    DATABASES[f'replica{index}'] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['simulator.routers.ReplicaRouter']
+
+DIAGRAM_DB_ROUTING = {
+    'REPLICAS': [f'replica{index}' for index in range(1, len(DB_REPLICAS) + 1)],
+    # Clients and diagrams read from the primary this long after a write
+    'STICKY_SECONDS': float(os.environ.get('DB_REPLICA_STICKY_SECONDS', '5')),
+}
+
+# SQLite connection tuning applied when each connection opens. WAL lets
+# readers proceed during a write; synchronous=NORMAL is durable across
+# application crashes in WAL mode and much cheaper than FULL.
+DIAGRAM_SQLITE = {
+    'WAL': os.environ.get('SQLITE_WAL', '1') == '1',
+    'BUSY_TIMEOUT_MS': 5000,
+    'SYNCHRONOUS': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+}
+
+# Serve load, list, save and history from the async views
+DIAGRAM_ASYNC_VIEWS = os.environ.get('DIAGRAM_ASYNC_VIEWS', '') == '1'
+
+# Cache settings
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'diagrams': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'diagram-bodies',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 500,
+            'CULL_FREQUENCY': 4,
+        },
+    },
+}
+
+# Parsed diagram cache, keyed by (diagram id, version, content hash). Keys
+# follow the row each request reads, so bodies stay correct with a
+# per-process locmem cache. Read-replica pins (DIAGRAM_DB_ROUTING) are kept
+# in this cache too and only reach other workers through a shared backend
+# such as Redis or Memcached; use one when running more than one process.
+DIAGRAM_CACHE = {
+    'ALIAS': 'diagrams',
+    'TIMEOUT': 300,
+    'MAX_BODY_BYTES': 1024 * 1024,
+}
+
+# Storage mode for new diagrams: 'blob' keeps one JSON document per diagram,
+# 'normalized' stores shapes and connections as individually addressable rows
+DIAGRAM_STORAGE_MODE = os.environ.get('DIAGRAM_STORAGE_MODE', 'blob')
+
+# Bodies of at least MIN_BYTES are stored once per content hash and shared
+# between diagrams and versions
+DIAGRAM_DEDUP = {
+    'ENABLED': True,
+    'MIN_BYTES': 1024,
+}
+
+# Content-addressed file store for very large shared bodies; rows keep
+# only the hash and size
+DIAGRAM_BODY_STORE = {
+    'ENABLED': os.environ.get('DIAGRAM_BODY_STORE', '') == '1',
+    'ROOT': BASE_DIR / 'diagram_bodies',
+    'MIN_BYTES': 64 * 1024,
+}
+
+# Version history retention, applied by the compact_history command.
+# Each tier keeps one version per interval (all versions when None) for
+# versions up to max_age old (forever when None).
+DIAGRAM_RETENTION = {
+    'TIERS': [
+        {'max_age': timedelta(hours=24), 'interval': None},
+        {'max_age': timedelta(days=7), 'interval': timedelta(hours=1)},
+        {'max_age': None, 'interval': timedelta(days=1)},
+    ],
+    'PURGE_DELETED_AFTER': timedelta(days=30),
+    'CHUNK_SIZE': 500,
+    'CHUNK_SLEEP': 0.05,
+}
+
+# Cold storage applied by the archive_diagrams command: diagrams untouched
+# for INACTIVE_AFTER have their body and history compressed into one row
+DIAGRAM_ARCHIVE = {
+    'INACTIVE_AFTER': timedelta(days=int(os.environ.get('DIAGRAM_ARCHIVE_AFTER_DAYS', '30'))),
+    'COMPRESSION_LEVEL': 6,
+    'BATCH_SIZE': 100,
+}
+
+# Opt-in recording of inbound WebSocket traffic (replay with replay_sessions).
+# Logs hold raw diagram contents; enable only where that is acceptable.
+COLLABORATION_RECORDING = {
+    'ENABLED': os.environ.get('COLLAB_RECORDING', '') == '1',
+    'ROOT': BASE_DIR / 'recordings',
+    # Comma-separated diagram ids to record; unset records every room
+    'ROOMS': [room.strip() for room in os.environ.get('COLLAB_RECORDING_ROOMS', '').split(',') if room.strip()] or None,
+}
+
+# Per-request bounds for the auto-layout endpoint. Force layout gets
+# FORCE_WORK_LIMIT // shapes iterations (within MIN/MAX_ITERATIONS) and stops
+# after TIME_BUDGET_SECONDS; diagrams above MAX_NODES are refused with 413
+DIAGRAM_LAYOUT = {
+    'MAX_NODES': 10000,
+    'MAX_ITERATIONS': 1000,
+    'MIN_ITERATIONS': 10,
+    'FORCE_WORK_LIMIT': 250000,
+    'TIME_BUDGET_SECONDS': 10.0,
+}
+
+# SVG previews for diagram listings, rendered after saves on a worker thread.
+# Not on SQLite (the default database above): a worker's commit would fail
+# concurrent request transactions, so there renders run inline on the
+# request thread after commit and BACKGROUND has no effect
+DIAGRAM_THUMBNAILS = {
+    'ENABLED': True,
+    'BACKGROUND': os.environ.get('DIAGRAM_THUMBNAILS_BACKGROUND', '1') == '1',
+    'WIDTH': 240,
+    'HEIGHT': 160,
+    'CACHE_SECONDS': 300,
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -125,6 +262,26 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             "hosts": [('127.0.0.1', 6379)],
+            # Consumers drain their inbox into bounded outbound queues, so
+            # the layer only needs headroom for short bursts
+            "capacity": 1000,
+            "expiry": 30,
         },
     },
 }
+
+# Per-connection outbound queue limits for WebSocket fan-out
+WEBSOCKET_BACKPRESSURE = {
+    'MAX_FRAMES': 256,
+    'MAX_BYTES': 1024 * 1024,
+    'MAX_LAG_SECONDS': 10.0,
+    'MAX_RESYNCS': 3,
+    'RESYNC_WINDOW_SECONDS': 60.0,
+    # Frames carry a seq; clients must ack with {"type": "ack", "seq": n}. At
+    # most this much unacknowledged data is handed to the server; clients
+    # that stop acking are dropped after MAX_LAG_SECONDS
+    'WINDOW_FRAMES': 64,
+    'WINDOW_BYTES': 256 * 1024,
+    # WEBSOCKET_REQUIRE_ACKS=0 lets legacy clients that never ack go unbounded
+    'REQUIRE_ACKS': os.environ.get('WEBSOCKET_REQUIRE_ACKS', '1') != '0',
+}
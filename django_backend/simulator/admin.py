@@ -1,27 +1,27 @@
 from django.contrib import admin
-from .models import Diagram, DiagramVersion, CollaborationSession
+from .models import Diagram, DiagramContent, DiagramVersion, DiagramElement, CollaborationSession
 
 
 @admin.register(Diagram)
 class DiagramAdmin(admin.ModelAdmin):
     """Admin interface for Diagram model"""
     
-    list_display = ['id', 'title', 'user', 'version', 'created_at', 'updated_at', 'is_active']
-    list_filter = ['is_active', 'created_at', 'updated_at', 'version']
+    list_display = ['id', 'title', 'user', 'version', 'storage_mode', 'created_at', 'updated_at', 'is_active']
+    list_filter = ['is_active', 'is_archived', 'storage_mode', 'created_at', 'updated_at', 'version']
     search_fields = ['title', 'user__username']
-    readonly_fields = ['id', 'created_at', 'updated_at']
+    readonly_fields = ['id', 'created_at', 'updated_at', 'rehydrated_at', 'is_archived', 'content_hash', 'content']
     ordering = ['-updated_at']
     
     fieldsets = (
         ('Basic Information', {
-            'fields': ('title', 'user', 'version', 'is_active')
+            'fields': ('title', 'user', 'version', 'storage_mode', 'is_active')
         }),
         ('Diagram Data', {
-            'fields': ('diagram_json',),
+            'fields': ('diagram_json', 'content_hash', 'content', 'is_archived'),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
-            'fields': ('created_at', 'updated_at'),
+            'fields': ('created_at', 'updated_at', 'rehydrated_at'),
             'classes': ('collapse',)
         }),
     )
@@ -41,7 +41,7 @@ class DiagramVersionAdmin(admin.ModelAdmin):
     list_display = ['id', 'diagram', 'version_number', 'created_at', 'comment']
     list_filter = ['created_at', 'version_number']
     search_fields = ['diagram__title', 'comment']
-    readonly_fields = ['id', 'created_at']
+    readonly_fields = ['id', 'created_at', 'content_hash', 'content']
     ordering = ['-created_at']
     
     fieldsets = (
@@ -49,7 +49,7 @@ class DiagramVersionAdmin(admin.ModelAdmin):
             'fields': ('diagram', 'version_number', 'comment')
         }),
         ('Version Data', {
-            'fields': ('diagram_json',),
+            'fields': ('diagram_json', 'content_hash', 'content'),
             'classes': ('collapse',)
         }),
         ('Timestamp', {
@@ -59,6 +59,51 @@ class DiagramVersionAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(DiagramContent)
+class DiagramContentAdmin(admin.ModelAdmin):
+    """Admin interface for DiagramContent model"""
+    
+    list_display = ['content_hash', 'size', 'created_at']
+    search_fields = ['content_hash']
+    readonly_fields = ['content_hash', 'size', 'created_at']
+    ordering = ['-created_at']
+    
+    fieldsets = (
+        ('Content Information', {
+            'fields': ('content_hash', 'size', 'created_at')
+        }),
+        ('Body', {
+            'fields': ('body',),
+            'classes': ('collapse',)
+        }),
+    )
+
+
+@admin.register(DiagramElement)
+class DiagramElementAdmin(admin.ModelAdmin):
+    """Admin interface for DiagramElement model"""
+    
+    list_display = ['id', 'diagram', 'kind', 'element_id', 'element_type', 'position', 'updated_at']
+    list_filter = ['kind', 'element_type']
+    search_fields = ['diagram__title', 'element_id']
+    readonly_fields = ['id', 'updated_at']
+    ordering = ['diagram', 'kind', 'position']
+    
+    fieldsets = (
+        ('Element Information', {
+            'fields': ('diagram', 'kind', 'element_id', 'element_type', 'position')
+        }),
+        ('Element Data', {
+            'fields': ('data',),
+            'classes': ('collapse',)
+        }),
+        ('Timestamp', {
+            'fields': ('updated_at',),
+            'classes': ('collapse',)
+        }),
+    )
+
+
 @admin.register(CollaborationSession)
 class CollaborationSessionAdmin(admin.ModelAdmin):
     """Admin interface for CollaborationSession model"""
@@ -8,4 +8,4 @@ class SimulatorConfig(AppConfig):
     
     def ready(self):
         """Initialize app when Django starts"""
-        pass
+        from . import signals  # noqa: F401
@@ -0,0 +1,226 @@
+"""
+Cold storage for diagrams nobody has touched in a while.
+
+``archive_inactive`` compresses the body and full version history of each
+inactive diagram into a single ``DiagramArchive`` row, then removes the
+hot copies (inline body, elements and ``DiagramVersion`` rows). The
+``Diagram`` row stays with its title, version, content hash, search
+document and thumbnail, so listings and search work as before, and its
+body can still be read straight from the archive.
+
+Anything that needs the hot tables, such as opening the diagram, joining
+a collaboration session, saving or browsing history, calls
+``ensure_hydrated`` first. That restores everything in one transaction and
+keeps the original ``updated_at``. Shared bodies freed by archiving are
+reclaimed by the ``compact_history`` job.
+"""
+
+import json
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Diagram, DiagramArchive, DiagramVersion, CollaborationSession
+from . import storage
+
+
+DEFAULT_CONFIG = {
+    'INACTIVE_AFTER': timedelta(days=30),
+    'COMPRESSION_LEVEL': 6,
+    'BATCH_SIZE': 100,
+}
+
+ARCHIVE_FORMAT = 1
+
+
+def get_config():
+    """Return archive configuration merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'DIAGRAM_ARCHIVE', {}))
+    return config
+
+
+def inactive_diagrams(cutoff):
+    """Active, unarchived diagrams neither edited nor rehydrated since ``cutoff``"""
+    sessions = CollaborationSession.objects.filter(is_active=True).values('diagram_id')
+    return Diagram.objects.filter(
+        is_active=True, is_archived=False, updated_at__lt=cutoff
+    ).filter(
+        Q(rehydrated_at__isnull=True) | Q(rehydrated_at__lt=cutoff)
+    ).exclude(pk__in=sessions)
+
+
+def build_payload(diagram, versions):
+    """Serialize a diagram body and its versions; identical bodies are stored once"""
+    body = diagram.get_document_json()
+    bodies = {}
+    entries = []
+    for version in versions:
+        text = version.get_body()
+        digest = version.content_hash or storage.content_hash(text)
+        bodies.setdefault(digest, text)
+        entries.append({
+            'version_number': version.version_number,
+            'content_hash': digest,
+            'comment': version.comment,
+            'created_at': version.created_at.isoformat() if version.created_at else None,
+        })
+    return {
+        'format': ARCHIVE_FORMAT,
+        'storage_mode': diagram.storage_mode,
+        'content_hash': diagram.content_hash,
+        'body': body,
+        'versions': entries,
+        'bodies': bodies,
+    }
+
+
+def compress(payload, level=None):
+    """Return ``(raw_size, compressed_bytes)`` for an archive payload"""
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    level = get_config()['COMPRESSION_LEVEL'] if level is None else level
+    return len(raw), zlib.compress(raw, level)
+
+
+def archive_diagram(diagram_id, cutoff, dry_run=False):
+    """
+    Move one diagram into cold storage. Returns ``(versions, raw_size,
+    compressed_size)``, or None when the diagram no longer qualifies.
+    """
+    using = router.db_for_write(Diagram)
+    with transaction.atomic(using=using):
+        diagram = inactive_diagrams(cutoff).using(using).select_for_update().filter(pk=diagram_id).first()
+        if diagram is None:
+            return None
+        versions = list(diagram.versions.using(using).select_related('content').order_by('version_number'))
+        size, data = compress(build_payload(diagram, versions))
+        if dry_run:
+            return len(versions), size, len(data)
+
+        DiagramArchive.objects.using(using).create(
+            diagram=diagram,
+            data=data,
+            size=size,
+            compressed_size=len(data),
+            version_count=len(versions)
+        )
+        diagram.versions.using(using).all().delete()
+        diagram.elements.using(using).all().delete()
+        # Queryset update keeps updated_at and skips save signals; the
+        # search document and thumbnail stay valid
+        Diagram.objects.using(using).filter(pk=diagram.pk).update(
+            is_archived=True, diagram_json='', content=None
+        )
+        storage.invalidate_on_commit(diagram)
+    return len(versions), size, len(data)
+
+
+def archive_inactive(inactive_after=None, dry_run=False, limit=None, batch_size=None, now=None):
+    """Archive every inactive diagram and return a report"""
+    config = get_config()
+    inactive_after = config['INACTIVE_AFTER'] if inactive_after is None else inactive_after
+    batch_size = max(batch_size or config['BATCH_SIZE'], 1)
+    cutoff = (now or timezone.now()) - inactive_after
+    report = {
+        'dry_run': dry_run,
+        'diagrams_archived': 0,
+        'versions_archived': 0,
+        'raw_bytes': 0,
+        'compressed_bytes': 0,
+    }
+
+    last_id = 0
+    while limit is None or report['diagrams_archived'] < limit:
+        ids = list(
+            inactive_diagrams(cutoff).filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+        for diagram_id in ids:
+            if limit is not None and report['diagrams_archived'] >= limit:
+                break
+            result = archive_diagram(diagram_id, cutoff, dry_run=dry_run)
+            if result is None:
+                continue
+            versions, size, compressed = result
+            report['diagrams_archived'] += 1
+            report['versions_archived'] += versions
+            report['raw_bytes'] += size
+            report['compressed_bytes'] += compressed
+    return report
+
+
+def rehydrate(diagram_id):
+    """
+    Restore an archived diagram's body and history to the hot tables and
+    return the diagram (None if it does not exist).
+    """
+    using = router.db_for_write(Diagram)
+    with transaction.atomic(using=using):
+        diagram = Diagram.objects.using(using).select_for_update().filter(pk=diagram_id).first()
+        if diagram is None or not diagram.is_archived:
+            return diagram
+        archive = DiagramArchive.objects.using(using).get(diagram=diagram)
+        payload = archive.read()
+
+        versions = []
+        for entry in payload['versions']:
+            inline, content = storage.store_body(payload['bodies'][entry['content_hash']], entry['content_hash'])
+            versions.append(DiagramVersion(
+                diagram=diagram,
+                version_number=entry['version_number'],
+                diagram_json=inline,
+                content=content,
+                content_hash=entry['content_hash'],
+                comment=entry['comment']
+            ))
+        DiagramVersion.objects.using(using).bulk_create(versions)
+        # auto_now_add stamped the rows with the current time; put the
+        # originals back. Backends that return no pks from bulk_create need
+        # the rows re-read, by version number
+        originals = {
+            entry['version_number']: parse_datetime(entry['created_at'])
+            for entry in payload['versions'] if entry['created_at']
+        }
+        restored = list(
+            DiagramVersion.objects.using(using)
+            .filter(diagram=diagram, version_number__in=originals)
+            .only('pk', 'version_number')
+        )
+        for version in restored:
+            version.created_at = originals[version.version_number]
+        if restored:
+            DiagramVersion.objects.using(using).bulk_update(restored, ['created_at'])
+
+        updated_at = diagram.updated_at
+        diagram.is_archived = False
+        diagram.rehydrated_at = timezone.now()
+        diagram.storage_mode = payload['storage_mode']
+        storage.save_document(diagram, payload['body'], payload['content_hash'] or None)
+        Diagram.objects.using(using).filter(pk=diagram.pk).update(updated_at=updated_at)
+        diagram.updated_at = updated_at
+        archive.delete()
+    return diagram
+
+
+def ensure_hydrated(diagram):
+    """Return ``diagram`` ready for use, rehydrating it first if it is archived"""
+    if not diagram.is_archived:
+        return diagram
+    return rehydrate(diagram.pk)
+
+
+def format_report(report):
+    """Return a human readable summary of an archive run"""
+    prefix = 'Would archive' if report['dry_run'] else 'Archived'
+    ratio = report['compressed_bytes'] / report['raw_bytes'] if report['raw_bytes'] else 0.0
+    return (
+        f"{prefix} {report['diagrams_archived']} diagram(s) with {report['versions_archived']} version(s): "
+        f"{report['raw_bytes']} bytes compressed to {report['compressed_bytes']} ({ratio:.0%})"
+    )
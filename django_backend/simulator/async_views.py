@@ -0,0 +1,177 @@
+"""
+Async versions of the hot read/save endpoints.
+
+These run directly on the ASGI event loop using Django's async ORM instead
+of being queued onto the single thread-sensitive executor that sync DRF
+views share. Responses match the DRF views field for field. Work that
+needs transactions (saves) or blocking I/O (body cache misses, element
+queries, external body store reads) is still delegated to a worker thread.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.authentication import CSRFCheck
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Diagram, DiagramVersion
+from .views import perform_save, saved_payload
+from . import cache as diagram_cache
+from . import storage
+from . import thumbnails
+from . import routers
+from . import archive
+
+
+def csrf_exempt(view):
+    """Async-safe csrf_exempt; Django 4.2's decorator wraps views in a sync function"""
+    view.csrf_exempt = True
+    return view
+
+
+def api_response(data, status_code=status.HTTP_200_OK):
+    """JSON response encoded the same way as DRF's JSONRenderer"""
+    return JsonResponse(data, status=status_code, encoder=JSONEncoder, safe=False)
+
+
+def method_not_allowed(request):
+    return api_response(
+        {'detail': f'Method "{request.method}" not allowed.'},
+        status.HTTP_405_METHOD_NOT_ALLOWED
+    )
+
+
+@sync_to_async
+def get_user(request):
+    """Resolve the session user off the event loop"""
+    user = request.user
+    return user if user.is_authenticated else None
+
+
+def csrf_failure(request):
+    """
+    Mirror DRF's SessionAuthentication: authenticated session requests must
+    pass the CSRF check, anonymous ones are exempt.
+    """
+    check = CSRFCheck(lambda req: None)
+    check.process_request(request)
+    return check.process_view(request, None, (), {})
+
+
+async def get_diagram_data(diagram):
+    """Return the parsed body; cache misses are read on a worker thread"""
+    return (await diagram_cache.aget_entry(diagram))['data']
+
+
+@csrf_exempt
+@routers.read_from_replica
+async def load_diagram(request, diagram_id=None):
+    """Load a specific diagram or list all diagrams"""
+    if request.method != 'GET':
+        return method_not_allowed(request)
+    try:
+        if diagram_id:
+            try:
+                diagram = await Diagram.objects.defer('diagram_json').aget(id=diagram_id, is_active=True)
+            except Diagram.DoesNotExist:
+                return api_response({'error': 'Diagram not found'}, status.HTTP_404_NOT_FOUND)
+            if diagram.is_archived:
+                diagram = await sync_to_async(archive.rehydrate)(diagram.pk)
+            return api_response({
+                'success': True,
+                'diagram': {
+                    'id': diagram.id,
+                    'title': diagram.title,
+                    'diagram_json': await get_diagram_data(diagram),
+                    'version': diagram.version,
+                    'created_at': diagram.created_at,
+                    'updated_at': diagram.updated_at
+                }
+            })
+
+        diagrams = Diagram.objects.filter(is_active=True)
+        user = await get_user(request)
+        if user is not None:
+            diagrams = diagrams.filter(user=user)
+
+        diagram_list = [
+            {
+                'id': d.id,
+                'title': d.title,
+                'version': d.version,
+                'thumbnail_url': thumbnails.thumbnail_url(d),
+                'created_at': d.created_at,
+                'updated_at': d.updated_at
+            }
+            async for d in diagrams.only('id', 'title', 'version', 'content_hash', 'created_at', 'updated_at')
+        ]
+        return api_response({'success': True, 'diagrams': diagram_list})
+
+    except Exception as e:
+        return api_response({'error': f'Failed to load diagram: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+@routers.read_from_replica
+async def diagram_history(request, diagram_id):
+    """Get version history for a diagram"""
+    if request.method != 'GET':
+        return method_not_allowed(request)
+    try:
+        current_version, is_archived = await Diagram.objects.filter(
+            id=diagram_id, is_active=True
+        ).values_list('version', 'is_archived').aget()
+        if is_archived:
+            await sync_to_async(archive.rehydrate)(diagram_id)
+        versions = DiagramVersion.objects.filter(diagram_id=diagram_id).values(
+            'version_number', 'created_at', 'comment'
+        )
+
+        return api_response({
+            'success': True,
+            'diagram_id': diagram_id,
+            'current_version': current_version,
+            'versions': [v async for v in versions]
+        })
+
+    except Diagram.DoesNotExist:
+        return api_response({'error': 'Diagram not found'}, status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return api_response({'error': f'Failed to get diagram history: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@csrf_exempt
+async def save_diagram(request):
+    """Save or update a diagram"""
+    if request.method != 'POST':
+        return method_not_allowed(request)
+    try:
+        try:
+            data = json.loads(request.body or b'{}')
+        except (ValueError, UnicodeDecodeError):
+            return api_response({'detail': 'JSON parse error'}, status.HTTP_400_BAD_REQUEST)
+        if not isinstance(data, dict):
+            return api_response({'detail': 'Expected a JSON object'}, status.HTTP_400_BAD_REQUEST)
+
+        user = await get_user(request)
+        if user is not None:
+            reason = await sync_to_async(csrf_failure)(request)
+            if reason:
+                return api_response({'detail': 'CSRF Failed'}, status.HTTP_403_FORBIDDEN)
+
+        diagram, unchanged = await sync_to_async(perform_save)(
+            data.get('id'),
+            data.get('title', 'Untitled Diagram'),
+            data.get('diagram_json', '{}'),
+            user=user
+        )
+        return api_response(saved_payload(diagram, unchanged))
+
+    except Diagram.DoesNotExist:
+        return api_response({'error': 'Diagram not found'}, status.HTTP_404_NOT_FOUND)
+    except storage.DuplicateElementError as e:
+        return api_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return api_response({'error': f'Failed to save diagram: {str(e)}'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
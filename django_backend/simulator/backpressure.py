@@ -0,0 +1,195 @@
+"""
+Bounded outbound queues for WebSocket connections.
+
+Each connection gets an ``OutboundQueue`` between the channel layer and the
+socket. Frames that carry state (cursor positions, selections, diagram
+updates) are keyed so a newer frame replaces an older one still waiting to
+be sent. When the queue passes its frame or byte limit, superseded state is
+dropped and the client is told to resync from a snapshot; a client that
+stays behind is disconnected.
+
+``send()`` cannot tell whether a frame reached the client: servers such as
+daphne accept it into the transport's write buffer at once, however slow
+the socket is. Each frame therefore carries a ``seq`` number and clients
+acknowledge what they have processed with ``{"type": "ack", "seq": n}``
+(cumulative). At most ``WINDOW_FRAMES`` / ``WINDOW_BYTES`` of
+unacknowledged frames are handed to the server; the rest wait here, where
+they are coalesced, shed and timed, so memory per connection stays within
+the configured limits and a client that stops acking is disconnected after
+``MAX_LAG_SECONDS``. Setting ``REQUIRE_ACKS`` to False is a compatibility
+mode for clients that cannot ack: the window then only applies after a
+client's first ack, and clients that never ack are sent to unthrottled.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+
+DEFAULT_CONFIG = {
+    'MAX_FRAMES': 256,
+    'MAX_BYTES': 1024 * 1024,
+    # Oldest queued frame may wait this long before the client counts as stalled
+    'MAX_LAG_SECONDS': 10.0,
+    # Resyncs allowed within RESYNC_WINDOW_SECONDS before disconnecting
+    'MAX_RESYNCS': 3,
+    'RESYNC_WINDOW_SECONDS': 60.0,
+    # Unacknowledged frames/bytes handed to the server before waiting for an ack
+    'WINDOW_FRAMES': 64,
+    'WINDOW_BYTES': 256 * 1024,
+    # False only windows clients once they ack; non-acking clients go unbounded
+    'REQUIRE_ACKS': True,
+}
+
+# put() outcomes
+QUEUED = 'queued'
+RESYNC = 'resync'
+DISCONNECT = 'disconnect'
+
+
+def stamp(text, seq):
+    """Add a ``seq`` field to a serialized, non-empty JSON object frame"""
+    return f'{{"seq": {seq}, {text[1:]}'
+
+
+def get_config():
+    """Return backpressure configuration merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'WEBSOCKET_BACKPRESSURE', {}))
+    return config
+
+
+class OutboundQueue:
+    """Per-connection queue that coalesces keyed frames and bounds memory"""
+
+    def __init__(self, config=None, clock=time.monotonic):
+        self.config = config or get_config()
+        self.clock = clock
+        self._frames = OrderedDict()
+        self._bytes = 0
+        self._sequence = 0
+        self._ready = asyncio.Event()
+        self._resyncs = []
+        # (seq, size, sent_at) of frames sent but not yet acknowledged
+        self._inflight = deque()
+        self._inflight_bytes = 0
+        self._sent_seq = 0
+        self.acks = bool(self.config['REQUIRE_ACKS'])
+        self.stats = {'sent': 0, 'coalesced': 0, 'dropped': 0, 'resyncs': 0}
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def pending_bytes(self):
+        return self._bytes
+
+    @property
+    def inflight(self):
+        return len(self._inflight)
+
+    def lag(self):
+        """Seconds the oldest queued or unacknowledged frame has been waiting"""
+        started = []
+        if self._frames:
+            _, (_, _, queued_at) = next(iter(self._frames.items()))
+            started.append(queued_at)
+        if self._inflight:
+            started.append(self._inflight[0][2])
+        if not started:
+            return 0.0
+        return self.clock() - min(started)
+
+    def stalled(self):
+        """Whether the client has fallen further behind than MAX_LAG_SECONDS"""
+        return self.lag() > self.config['MAX_LAG_SECONDS']
+
+    def ack(self, seq):
+        """Record that the client processed every frame up to ``seq``"""
+        self.acks = True
+        while self._inflight and self._inflight[0][0] <= seq:
+            _, size, _ = self._inflight.popleft()
+            self._inflight_bytes -= size
+        self._ready.set()
+
+    def _window_open(self):
+        if not self.acks:
+            return True
+        return (len(self._inflight) < self.config['WINDOW_FRAMES']
+                and self._inflight_bytes < self.config['WINDOW_BYTES'])
+
+    def put(self, text, key=None):
+        """
+        Queue a serialized frame. Keyed frames replace a queued frame with
+        the same key. Returns QUEUED, RESYNC (state was dropped and the
+        caller should queue a resync notice) or DISCONNECT.
+        """
+        if self.stalled():
+            return DISCONNECT
+
+        if key is not None and key in self._frames:
+            old_text, _, queued_at = self._frames[key]
+            self._bytes += len(text) - len(old_text)
+            # Keep the original timestamp so lag still reflects the wait
+            self._frames[key] = (text, True, queued_at)
+            self.stats['coalesced'] += 1
+        else:
+            if key is None:
+                self._sequence += 1
+                key = ('seq', self._sequence)
+                coalescible = False
+            else:
+                coalescible = True
+            self._frames[key] = (text, coalescible, self.clock())
+            self._bytes += len(text)
+        self._ready.set()
+
+        if not self._over_limit():
+            return QUEUED
+        return self._shed()
+
+    def _over_limit(self):
+        return len(self._frames) > self.config['MAX_FRAMES'] or self._bytes > self.config['MAX_BYTES']
+
+    def _shed(self):
+        """Drop queued state frames; the client will reload a snapshot instead"""
+        for key in [key for key, (_, coalescible, _) in self._frames.items() if coalescible]:
+            text, _, _ = self._frames.pop(key)
+            self._bytes -= len(text)
+            self.stats['dropped'] += 1
+
+        now = self.clock()
+        window = self.config['RESYNC_WINDOW_SECONDS']
+        self._resyncs = [at for at in self._resyncs if now - at <= window]
+        self._resyncs.append(now)
+        self.stats['resyncs'] += 1
+
+        if self._over_limit() or len(self._resyncs) > self.config['MAX_RESYNCS']:
+            return DISCONNECT
+        return RESYNC
+
+    def clear(self):
+        self._frames.clear()
+        self._bytes = 0
+        self._inflight.clear()
+        self._inflight_bytes = 0
+        self._ready.clear()
+
+    async def get(self):
+        """
+        Wait for the next frame and for room in the ack window, then remove
+        it and return ``(seq, text)``
+        """
+        while not (self._frames and self._window_open()):
+            self._ready.clear()
+            await self._ready.wait()
+        _, (text, _, _) = self._frames.popitem(last=False)
+        self._bytes -= len(text)
+        self._sent_seq += 1
+        if self.acks:
+            self._inflight.append((self._sent_seq, len(text), self.clock()))
+            self._inflight_bytes += len(text)
+        self.stats['sent'] += 1
+        return self._sent_seq, text
@@ -0,0 +1,98 @@
+"""
+Local content-addressed file store for large diagram bodies.
+
+Bodies are written once to ``<ROOT>/<aa>/<bb>/<sha256>.json`` and never
+modified, so they can be served straight from disk and shared freely.
+Database rows (``DiagramContent`` with ``external=True``) keep only the
+hash and size.
+"""
+
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+
+DEFAULT_CONFIG = {
+    'ENABLED': False,
+    'ROOT': None,
+    'MIN_BYTES': 64 * 1024,
+}
+
+
+def get_config():
+    """Return body store configuration merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'DIAGRAM_BODY_STORE', {}))
+    if config['ROOT'] is None:
+        config['ROOT'] = Path(settings.BASE_DIR) / 'diagram_bodies'
+    config['ROOT'] = Path(config['ROOT'])
+    return config
+
+
+def should_store(text):
+    """Whether a body is large enough to live in the file store"""
+    config = get_config()
+    return config['ENABLED'] and len(text) >= config['MIN_BYTES']
+
+
+def path_for(digest):
+    """Return the file path for a content hash"""
+    if len(digest) < 4 or not all(c in '0123456789abcdef' for c in digest):
+        raise ValueError(f"Invalid content hash: {digest!r}")
+    return get_config()['ROOT'] / digest[:2] / digest[2:4] / f"{digest}.json"
+
+
+def exists(digest):
+    return path_for(digest).exists()
+
+
+def write(digest, text):
+    """Store a body under its hash; existing files are left untouched"""
+    path = path_for(digest)
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file and rename so readers never see partial bodies
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            handle.write(text.encode('utf-8'))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return path
+
+
+def read(digest):
+    """Return a stored body as text"""
+    return path_for(digest).read_text(encoding='utf-8')
+
+
+def open_body(digest):
+    """Open a stored body for streaming"""
+    return path_for(digest).open('rb')
+
+
+def delete(digest):
+    """Remove a stored body if present"""
+    try:
+        path_for(digest).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def iter_stored(min_age=0):
+    """Yield ``(digest, size)`` for stored bodies at least ``min_age`` seconds old"""
+    root = get_config()['ROOT']
+    if not root.exists():
+        return
+    cutoff = time.time() - min_age
+    for path in root.glob('*/*/*.json'):
+        stat = path.stat()
+        if stat.st_mtime <= cutoff:
+            yield path.stem, stat.st_size
@@ -0,0 +1,169 @@
+"""
+Versioned cache of parsed diagram bodies.
+
+Entries are keyed by ``(diagram id, version, content hash)`` and hold
+both the parsed dictionary and its compact JSON serialization, so repeated
+loads of the same diagram skip ``json.loads`` entirely. Collaborative
+persists and element writes change a body without bumping its version, so
+the key also carries the content hash (or ``updated_at`` when the hash was
+cleared). A reader that loaded an older row can only ever fill the entry
+for that older content, and every process finds the current entry from the
+row it just read, so per-process backends such as locmem stay correct;
+invalidation only frees memory early. For that, each Diagram remembers the
+key of the body its row held when loaded (or last saved), and a write that
+replaces the body drops that entry once it commits. Storage goes through the Django
+cache framework; size bounds come from the backend (``MAX_ENTRIES``) plus
+a per-body byte limit so huge diagrams never crowd out the rest.
+"""
+
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
+
+DEFAULT_CONFIG = {
+    'ALIAS': 'diagrams',
+    'TIMEOUT': 300,
+    'MAX_BODY_BYTES': 1024 * 1024,
+    'KEY_PREFIX': 'diagram',
+}
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'sets': 0, 'skipped': 0, 'invalidations': 0}
+
+
+def get_config():
+    """Return cache configuration merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'DIAGRAM_CACHE', {}))
+    return config
+
+
+def get_cache():
+    """Return the Django cache backend used for diagram bodies"""
+    return caches[get_config()['ALIAS']]
+
+
+def content_token(diagram):
+    """Identify the body a diagram row currently holds"""
+    if diagram.content_hash:
+        return diagram.content_hash
+    return diagram.updated_at.timestamp() if diagram.updated_at else ''
+
+
+# Row fields the cache key is built from
+KEY_FIELDS = ('id', 'version', 'content_hash', 'updated_at')
+
+
+def remember_stored(diagram):
+    """
+    Note the key arguments of the body a diagram's row holds in the database.
+    Rows loaded without the key fields (e.g. through only()) are not tracked.
+    """
+    if diagram.pk is not None and all(field in diagram.__dict__ for field in KEY_FIELDS):
+        diagram._stored_cache_key = (diagram.pk, diagram.version, content_token(diagram))
+    else:
+        diagram._stored_cache_key = None
+
+
+def stored_key(diagram):
+    """Key arguments recorded by remember_stored, or None"""
+    return getattr(diagram, '_stored_cache_key', None)
+
+
+def make_key(diagram_id, version, token=''):
+    """Build the cache key for a diagram version and content"""
+    return f"{get_config()['KEY_PREFIX']}:{diagram_id}:{version}:{token}"
+
+
+def _record(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def parse_diagram_json(raw):
+    """Parse a stored diagram body, falling back to an empty dict"""
+    try:
+        return json.loads(raw)
+    except (TypeError, json.JSONDecodeError):
+        return {}
+
+
+def get_entry(diagram):
+    """
+    Return the cached ``{'data': ..., 'json': ...}`` entry for a diagram,
+    parsing and storing it on a miss.
+    """
+    if diagram.pk is None:
+        data = diagram.load_diagram_data()
+        return {'data': data, 'json': json.dumps(data, separators=(',', ':'))}
+
+    config = get_config()
+    cache = get_cache()
+    key = make_key(diagram.pk, diagram.version, content_token(diagram))
+
+    entry = cache.get(key)
+    if entry is not None:
+        _record('hits')
+        return entry
+
+    _record('misses')
+    data = diagram.load_diagram_data()
+    entry = {'data': data, 'json': json.dumps(data, separators=(',', ':'))}
+
+    if len(entry['json']) <= config['MAX_BODY_BYTES']:
+        cache.set(key, entry, config['TIMEOUT'])
+        _record('sets')
+    else:
+        _record('skipped')
+    return entry
+
+
+async def aget_entry(diagram):
+    """
+    Async ``get_entry``. Hits in an in-process cache are served on the event
+    loop; misses (body reads, element queries, external store files) and
+    network cache backends run on a worker thread.
+    """
+    if diagram.pk is not None and isinstance(get_cache(), LocMemCache):
+        entry = get_cache().get(make_key(diagram.pk, diagram.version, content_token(diagram)))
+        if entry is not None:
+            _record('hits')
+            return entry
+    return await sync_to_async(get_entry)(diagram)
+
+
+def get_diagram_data(diagram):
+    """Return the parsed diagram body"""
+    return get_entry(diagram)['data']
+
+
+def get_diagram_json(diagram):
+    """Return the pre-serialized diagram body"""
+    return get_entry(diagram)['json']
+
+
+def invalidate(diagram_id, version, token=''):
+    """Drop the cached entry for a diagram version and content"""
+    get_cache().delete(make_key(diagram_id, version, token))
+    _record('invalidations')
+
+
+def get_stats():
+    """Return hit/miss counters for this process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def reset_stats():
+    """Reset hit/miss counters"""
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
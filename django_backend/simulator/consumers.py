@@ -1,12 +1,22 @@
+import asyncio
 import json
 import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
 from .models import Diagram, CollaborationSession
+from . import storage
+from . import backpressure
+from . import thumbnails
+from . import archive
+from . import recorder
 from datetime import datetime
 
 
+# Diagram operations whose newer frame supersedes a queued one
+COALESCED_OPERATIONS = ('move', 'update')
+
+
 class DiagramConsumer(AsyncWebsocketConsumer):
     """WebSocket consumer for real-time diagram collaboration"""
     
@@ -16,6 +26,24 @@ class DiagramConsumer(AsyncWebsocketConsumer):
         self.room_group_name = f'diagram_{self.diagram_id}'
         self.session_id = str(uuid.uuid4())
         
+        # The route accepts any word, but only numeric ids name a diagram
+        if not self.diagram_id.isdecimal():
+            await self.close()
+            return
+        
+        # Archived diagrams move back to the hot tables before anyone edits them
+        await self.rehydrate_diagram()
+        
+        # Opt-in capture of inbound traffic for replay_sessions
+        self.recorder = await self.open_recording() if recorder.is_enabled(self.diagram_id) else None
+        self.record_event('connect')
+        
+        # Outbound frames go through a bounded queue drained by one task
+        self.outbound = backpressure.OutboundQueue()
+        self.shape_runs = {}
+        self.dropped = False
+        self.sender_task = asyncio.create_task(self.drain_outbound())
+        
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -40,6 +68,12 @@ class DiagramConsumer(AsyncWebsocketConsumer):
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if not getattr(self, 'sender_task', None):
+            # Rejected during the handshake; never joined the room
+            return
+        self.sender_task.cancel()
+        self.outbound.clear()
+        
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -58,6 +92,16 @@ class DiagramConsumer(AsyncWebsocketConsumer):
                 'message': 'A user left the collaboration'
             }
         )
+        
+        if getattr(self, 'recorder', None):
+            self.record_event('disconnect')
+            recorder.release_room(self.recorder)
+            self.recorder = None
+    
+    def record_event(self, event, data=None):
+        """Append an inbound event to the room recording, if one is running"""
+        if self.recorder:
+            self.recorder.record(self.session_id, event, data)
     
     async def receive(self, text_data):
         """Handle messages from WebSocket"""
@@ -65,6 +109,12 @@ class DiagramConsumer(AsyncWebsocketConsumer):
             text_data_json = json.loads(text_data)
             message_type = text_data_json.get('type', 'diagram_update')
             
+            # Flow-control acks belong to this connection only; they are not recorded
+            if message_type == 'ack':
+                self.outbound.ack(int(text_data_json.get('seq', 0)))
+                return
+            
+            self.record_event('message', text_data)
             if message_type == 'diagram_update':
                 await self.handle_diagram_update(text_data_json)
             elif message_type == 'cursor_position':
@@ -77,6 +127,7 @@ class DiagramConsumer(AsyncWebsocketConsumer):
                 await self.send_error('Unknown message type')
                 
         except json.JSONDecodeError:
+            self.record_event('message', text_data)
             await self.send_error('Invalid JSON format')
         except Exception as e:
             await self.send_error(f'Error processing message: {str(e)}')
@@ -90,7 +141,11 @@ class DiagramConsumer(AsyncWebsocketConsumer):
             
             # Update diagram in database if needed
             if operation in ['save', 'auto_save']:
-                await self.save_diagram_update(diagram_data)
+                error = await self.save_diagram_update(diagram_data)
+                if error is not None:
+                    # Peers must not see a document that was never stored
+                    await self.send_error(str(error), duplicates=[list(item) for item in error.duplicates])
+                    return
             
             # Broadcast update to all users in the room
             await self.channel_layer.group_send(
@@ -161,68 +216,150 @@ class DiagramConsumer(AsyncWebsocketConsumer):
     # Broadcast handlers
     async def diagram_update_broadcast(self, event):
         """Send diagram update to WebSocket"""
-        await self.send(text_data=json.dumps({
+        await self.queue_frame({
             'type': 'diagram_update',
             'diagram_data': event['diagram_data'],
             'operation': event['operation'],
             'shape_id': event.get('shape_id'),
             'session_id': event['session_id'],
             'timestamp': event['timestamp']
-        }))
+        }, key=self.diagram_frame_key(event))
+    
+    def diagram_frame_key(self, event):
+        """
+        Coalescing key for a diagram update. Only an uninterrupted run of
+        move/update frames from one author to one shape collapses into its
+        latest frame; any other operation on the shape (add, delete, save,
+        another author) starts a new run, so nothing is reordered past it.
+        """
+        shape_id = event.get('shape_id')
+        author = (event['session_id'], event['operation'])
+        run = self.shape_runs.get(shape_id)
+        if run is None or run[0] != author:
+            run = (author, run[1] + 1 if run else 0)
+            self.shape_runs[shape_id] = run
+        if event['operation'] not in COALESCED_OPERATIONS:
+            return None
+        return ('diagram', shape_id, *author, run[1])
     
     async def cursor_update_broadcast(self, event):
         """Send cursor update to WebSocket"""
         # Don't send cursor updates back to the sender
         if event['cursor_data']['session_id'] != self.session_id:
-            await self.send(text_data=json.dumps({
+            await self.queue_frame({
                 'type': 'cursor_update',
                 'cursor_data': event['cursor_data']
-            }))
+            }, key=('cursor', event['cursor_data']['session_id']))
     
     async def selection_change_broadcast(self, event):
         """Send selection change to WebSocket"""
         # Don't send selection updates back to the sender
         if event['selection_data']['session_id'] != self.session_id:
-            await self.send(text_data=json.dumps({
+            await self.queue_frame({
                 'type': 'selection_change',
                 'selection_data': event['selection_data']
-            }))
+            }, key=('selection', event['selection_data']['session_id']))
     
     async def chat_message_broadcast(self, event):
         """Send chat message to WebSocket"""
-        await self.send(text_data=json.dumps({
+        await self.queue_frame({
             'type': 'chat_message',
             'message': event['message'],
             'username': event['username'],
             'session_id': event['session_id'],
             'timestamp': event['timestamp']
-        }))
+        })
     
     async def user_joined(self, event):
         """Send user joined notification"""
         if event['session_id'] != self.session_id:
-            await self.send(text_data=json.dumps({
+            await self.queue_frame({
                 'type': 'user_joined',
                 'message': event['message'],
                 'session_id': event['session_id']
-            }))
+            })
     
     async def user_left(self, event):
         """Send user left notification"""
         if event['session_id'] != self.session_id:
-            await self.send(text_data=json.dumps({
+            await self.queue_frame({
                 'type': 'user_left',
                 'message': event['message'],
                 'session_id': event['session_id']
-            }))
+            })
     
-    async def send_error(self, error_message):
+    async def send_error(self, error_message, **details):
         """Send error message to WebSocket"""
-        await self.send(text_data=json.dumps({
+        await self.queue_frame({
             'type': 'error',
             'message': error_message,
+            **details,
             'timestamp': datetime.now().isoformat()
-        }))
+        })
+    
+    async def queue_frame(self, payload, key=None):
+        """Queue a frame for the sender task, shedding state if the client lags"""
+        if self.dropped:
+            return
+        outcome = self.outbound.put(json.dumps(payload), key=key)
+        if outcome == backpressure.RESYNC:
+            # Queued state was dropped; the client should reload the diagram
+            self.outbound.put(json.dumps({
+                'type': 'resync_required',
+                'diagram_id': self.diagram_id,
+                'message': 'Updates were dropped because the connection fell behind',
+                'timestamp': datetime.now().isoformat()
+            }), key=('resync',))
+        elif outcome == backpressure.DISCONNECT:
+            await self.drop_slow_client()
+    
+    async def drop_slow_client(self):
+        """Disconnect a client that cannot keep up"""
+        self.dropped = True
+        self.outbound.clear()
+        if self.sender_task is not asyncio.current_task():
+            self.sender_task.cancel()
+        await self.close(code=4008)
+    
+    async def drain_outbound(self):
+        """Send queued frames one at a time, in order, within the client's ack window"""
+        timeout = self.outbound.config['MAX_LAG_SECONDS']
+        try:
+            while True:
+                try:
+                    seq, text = await asyncio.wait_for(self.outbound.get(), timeout)
+                except asyncio.TimeoutError:
+                    # Nothing could be sent for a while; the client may have stopped acking
+                    if self.outbound.stalled():
+                        await self.drop_slow_client()
+                        return
+                    continue
+                await self.send(text_data=backpressure.stamp(text, seq))
+        except asyncio.CancelledError:
+            pass
+    
+    @database_sync_to_async
+    def rehydrate_diagram(self):
+        """Restore an archived diagram's body and history"""
+        if Diagram.objects.filter(id=self.diagram_id, is_archived=True).exists():
+            archive.rehydrate(self.diagram_id)
+    
+    @database_sync_to_async
+    def open_recording(self):
+        """Join the room's recording, snapshotting the diagram if this starts it"""
+        return recorder.open_room(self.diagram_id, snapshot=self.recording_snapshot)
+    
+    def recording_snapshot(self):
+        """Starting state a replay of this room seeds its diagram with"""
+        diagram = Diagram.objects.defer('diagram_json').filter(id=self.diagram_id, is_active=True).first()
+        if diagram is None:
+            return None
+        document = diagram.get_diagram_data()
+        return {
+            'version': diagram.version,
+            'content_hash': diagram.content_hash or storage.content_hash(document),
+            'document': document,
+        }
     
     @database_sync_to_async
     def create_collaboration_session(self):
@@ -256,12 +393,18 @@ class DiagramConsumer(AsyncWebsocketConsumer):
     
     @database_sync_to_async
     def save_diagram_update(self, diagram_data):
-        """Save diagram update to database"""
+        """Save diagram update to database; returns the DuplicateElementError if rejected"""
         try:
-            diagram = Diagram.objects.get(id=self.diagram_id)
-            diagram.diagram_json = json.dumps(diagram_data)
-            diagram.save()
+            # A room can be archived between connect and its first save
+            diagram = archive.ensure_hydrated(Diagram.objects.defer('diagram_json').get(id=self.diagram_id))
+            digest = storage.content_hash(diagram_data)
+            if not storage.is_unchanged(diagram, digest):
+                storage.save_document(diagram, diagram_data, digest)
+                thumbnails.schedule(diagram)
+        except storage.DuplicateElementError as e:
+            return e
         except Diagram.DoesNotExist:
             pass
         except Exception:
             pass
+        return None
@@ -0,0 +1,139 @@
+"""
+Version history helpers: structural diffs between versions and restores.
+
+Diffs key shapes and connections by id, so comparing two versions is a
+single pass over each side regardless of element order. Results are cached
+per version pair; historical versions are immutable, and the current
+version is additionally keyed by its ``updated_at`` stamp because in-place
+saves do not bump the version number.
+"""
+
+from django.db import transaction
+
+from .models import Diagram, DiagramVersion, DiagramElement
+from . import cache as diagram_cache
+from . import storage
+from . import thumbnails
+from . import archive
+
+
+def get_version_data(diagram, version_number):
+    """Return the parsed document for a version, or None if it does not exist"""
+    if version_number == diagram.version:
+        return diagram.get_diagram_data()
+    version = DiagramVersion.objects.select_related('content').filter(
+        diagram=diagram, version_number=version_number
+    ).first()
+    if version is None:
+        return None
+    return diagram_cache.parse_diagram_json(version.get_body())
+
+
+def _index_elements(kind, items):
+    indexed = {}
+    for position, element in enumerate(items or []):
+        indexed.setdefault(storage.element_id_for(kind, element, position), element)
+    return indexed
+
+
+def diff_fields(old, new):
+    """Return ``{field: {'from': ..., 'to': ...}}`` for fields that differ"""
+    if not isinstance(old, dict) or not isinstance(new, dict):
+        return {'value': {'from': old, 'to': new}} if old != new else {}
+    changes = {}
+    for key in old.keys() | new.keys():
+        before, after = old.get(key), new.get(key)
+        if before != after:
+            changes[key] = {'from': before, 'to': after}
+    return changes
+
+
+def diff_documents(old, new):
+    """
+    Return an id-keyed structural diff between two diagram documents.
+
+    The result has one entry per element kind (``shapes``, ``connections``)
+    with ``added``, ``removed`` and ``changed`` lists, plus ``document``
+    holding changes to the remaining top-level keys such as ``canvas``.
+    """
+    old = old if isinstance(old, dict) else {}
+    new = new if isinstance(new, dict) else {}
+    result = {}
+
+    for kind, key in DiagramElement.KIND_KEYS.items():
+        before = _index_elements(kind, old.get(key))
+        after = _index_elements(kind, new.get(key))
+        added, removed, changed = [], [], []
+        for element_id, element in after.items():
+            previous = before.get(element_id)
+            if previous is None:
+                added.append({'id': element_id, 'data': element})
+            elif previous != element:
+                changed.append({'id': element_id, 'fields': diff_fields(previous, element)})
+        for element_id, element in before.items():
+            if element_id not in after:
+                removed.append({'id': element_id, 'data': element})
+        result[key] = {'added': added, 'removed': removed, 'changed': changed}
+
+    element_keys = set(DiagramElement.KIND_KEYS.values())
+    result['document'] = diff_fields(
+        {k: v for k, v in old.items() if k not in element_keys},
+        {k: v for k, v in new.items() if k not in element_keys}
+    )
+    result['summary'] = {
+        key: {name: len(result[key][name]) for name in ('added', 'removed', 'changed')}
+        for key in DiagramElement.KIND_KEYS.values()
+    }
+    return result
+
+
+def _diff_cache_key(diagram, from_version, to_version):
+    stamp = ''
+    if diagram.version in (from_version, to_version):
+        stamp = diagram.updated_at.timestamp() if diagram.updated_at else ''
+    prefix = diagram_cache.get_config()['KEY_PREFIX']
+    return f"{prefix}:diff:{diagram.pk}:{from_version}:{to_version}:{diagram.version}:{stamp}"
+
+
+def diff_versions(diagram, from_version, to_version):
+    """
+    Return the cached structural diff between two versions of a diagram,
+    or None if either version does not exist.
+    """
+    cache = diagram_cache.get_cache()
+    key = _diff_cache_key(diagram, from_version, to_version)
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    old = get_version_data(diagram, from_version)
+    new = get_version_data(diagram, to_version)
+    if old is None or new is None:
+        return None
+
+    result = diff_documents(old, new)
+    cache.set(key, result, diagram_cache.get_config()['TIMEOUT'])
+    return result
+
+
+def restore_version(diagram_id, version_number, comment=None):
+    """
+    Make a stored version current again as a new version, snapshotting the
+    current body first. Returns the updated diagram, or None if the version
+    does not exist.
+    """
+    with transaction.atomic():
+        diagram = archive.ensure_hydrated(
+            Diagram.objects.select_for_update().get(id=diagram_id, is_active=True)
+        )
+        version = DiagramVersion.objects.select_related('content').filter(
+            diagram=diagram, version_number=version_number
+        ).first()
+        if version is None:
+            return None
+
+        storage.snapshot_version(diagram, comment or f"Before restoring version {version_number}")
+        diagram.version += 1
+        storage.save_document(diagram, version.get_body(), version.content_hash or None)
+        thumbnails.schedule(diagram)
+    return diagram
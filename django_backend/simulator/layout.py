@@ -0,0 +1,550 @@
+"""
+Server-side automatic layout for diagram graphs.
+
+Three algorithms work on the ``shapes``/``connections`` of a document:
+
+* ``layered`` - Sugiyama-style: cycle removal, longest-path layering,
+  barycenter crossing reduction and centered coordinate assignment.
+* ``tree`` - tidy tree (or radial tree for mind maps) over a BFS spanning
+  forest.
+* ``force`` - Fruchterman-Reingold with NumPy-vectorized forces. Large
+  graphs use a Barnes-Hut-style cell approximation: nodes in the same or
+  an adjacent grid cell repel exactly, other cells act as a single mass at
+  their center.
+
+Results are returned as a patch of shape positions (top-left corners, like
+the stored shapes) for only the shapes that moved. ``DIAGRAM_LAYOUT`` bounds
+the work one request can do: a node limit, a force-layout iteration cap
+that shrinks as graphs grow, and a wall-clock budget.
+"""
+
+import math
+import time
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+
+
+DEFAULT_CONFIG = {
+    'MAX_NODES': 10000,
+    'MAX_ITERATIONS': 1000,
+    'MIN_ITERATIONS': 10,
+    # Force layout node-iterations per request; bigger graphs get fewer iterations
+    'FORCE_WORK_LIMIT': 250000,
+    # Force layout stops iterating once a request has run this long
+    'TIME_BUDGET_SECONDS': 10.0,
+}
+
+DEFAULT_WIDTH = 120.0
+DEFAULT_HEIGHT = 60.0
+MARGIN = 40.0
+SOURCE_KEYS = ('from', 'source', 'sourceId', 'source_id', 'start', 'fromShape', 'startShapeId')
+TARGET_KEYS = ('to', 'target', 'targetId', 'target_id', 'end', 'toShape', 'endShapeId')
+ALGORITHMS = ('layered', 'tree', 'radial', 'force')
+DIRECTIONS = ('TB', 'BT', 'LR', 'RL')
+# Algorithms that honour a direction; the others reject an explicit one
+DIRECTED_ALGORITHMS = ('layered', 'tree')
+
+# Layout picked by 'auto' for each diagram type
+AUTO_ALGORITHMS = {
+    'flowchart': 'layered',
+    'bpmn': 'layered',
+    'uml': 'layered',
+    'orgchart': 'tree',
+    'mindmap': 'radial',
+    'network': 'force',
+    'er': 'force',
+}
+
+
+class LayoutTooLarge(ValueError):
+    """Raised when a diagram has more shapes than MAX_NODES"""
+
+
+def get_config():
+    """Return layout limits merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'DIAGRAM_LAYOUT', {}))
+    return config
+
+
+def iteration_limit(node_count, config=None):
+    """Force layout iterations allowed for a graph of ``node_count`` nodes"""
+    config = config or get_config()
+    scaled = config['FORCE_WORK_LIMIT'] // max(node_count, 1)
+    return int(min(config['MAX_ITERATIONS'], max(config['MIN_ITERATIONS'], scaled)))
+
+
+class Graph:
+    """Node ids, sizes, current positions and an edge array built from a document"""
+
+    def __init__(self, ids, sizes, positions, edges):
+        self.ids = ids
+        self.sizes = sizes
+        self.positions = positions
+        self.edges = edges
+
+    @property
+    def n(self):
+        return len(self.ids)
+
+
+def endpoint(connection, keys):
+    """Return the shape id a connection references under any of ``keys``"""
+    for key in keys:
+        value = connection.get(key)
+        if isinstance(value, dict):
+            value = value.get('id') or value.get('shapeId') or value.get('shape_id')
+        if value not in (None, ''):
+            return str(value)
+    return None
+
+
+def as_float(value, default):
+    """Parse a finite float, falling back to ``default``"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return default
+    return number if math.isfinite(number) else default
+
+
+def build_graph(document):
+    """Build a Graph from a diagram document, ignoring dangling connections"""
+    shapes = [s for s in (document.get('shapes') or []) if isinstance(s, dict) and s.get('id') is not None]
+    # Patches return ids as stored; connections are matched on their string form
+    ids = [s['id'] for s in shapes]
+    index = {str(shape_id): i for i, shape_id in enumerate(ids)}
+
+    sizes = np.array(
+        [[as_float(s.get('width'), DEFAULT_WIDTH), as_float(s.get('height'), DEFAULT_HEIGHT)] for s in shapes],
+        dtype=float
+    ).reshape(-1, 2)
+    positions = np.array(
+        [[as_float(s.get('x'), np.nan), as_float(s.get('y'), np.nan)] for s in shapes],
+        dtype=float
+    ).reshape(-1, 2)
+
+    pairs = set()
+    for connection in document.get('connections') or []:
+        if not isinstance(connection, dict):
+            continue
+        source = index.get(endpoint(connection, SOURCE_KEYS))
+        target = index.get(endpoint(connection, TARGET_KEYS))
+        if source is not None and target is not None and source != target:
+            pairs.add((source, target))
+    edges = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+    return Graph(ids, sizes, positions, edges)
+
+
+# Layered (Sugiyama) layout
+
+def _acyclic_edges(n, edges):
+    """Reverse DFS back edges so the graph becomes a DAG"""
+    adjacency = [[] for _ in range(n)]
+    for edge_index, (source, target) in enumerate(edges):
+        adjacency[source].append((target, edge_index))
+
+    state = np.zeros(n, dtype=np.int8)  # 0 new, 1 on stack, 2 done
+    reversed_mask = np.zeros(len(edges), dtype=bool)
+    for root in range(n):
+        if state[root]:
+            continue
+        stack = [(root, iter(adjacency[root]))]
+        state[root] = 1
+        while stack:
+            node, children = stack[-1]
+            for child, edge_index in children:
+                if state[child] == 1:
+                    reversed_mask[edge_index] = True
+                elif state[child] == 0:
+                    state[child] = 1
+                    stack.append((child, iter(adjacency[child])))
+                    break
+            else:
+                state[node] = 2
+                stack.pop()
+
+    dag = edges.copy()
+    dag[reversed_mask] = dag[reversed_mask][:, ::-1]
+    return dag
+
+
+def _longest_path_layers(n, dag):
+    """Assign each node the length of the longest path reaching it"""
+    layers = np.zeros(n, dtype=np.int64)
+    indegree = np.bincount(dag[:, 1], minlength=n) if len(dag) else np.zeros(n, dtype=np.int64)
+    successors = [[] for _ in range(n)]
+    for source, target in dag:
+        successors[source].append(target)
+
+    queue = deque(np.flatnonzero(indegree == 0).tolist())
+    while queue:
+        node = queue.popleft()
+        for child in successors[node]:
+            if layers[node] + 1 > layers[child]:
+                layers[child] = layers[node] + 1
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+    return layers
+
+
+def _ranks(layers, keys):
+    """Rank of each node within its layer when sorted by ``keys``"""
+    order = np.lexsort((keys, layers))
+    ranks = np.empty(len(layers), dtype=float)
+    sorted_layers = layers[order]
+    starts = np.flatnonzero(np.r_[True, sorted_layers[1:] != sorted_layers[:-1]])
+    offsets = np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    ranks[order] = np.arange(len(order)) - offsets
+    return ranks
+
+
+def _barycenters(n, ranks, neighbours, owners):
+    """Mean rank of each node's neighbours; nodes without any keep their rank"""
+    total = np.bincount(owners, weights=ranks[neighbours], minlength=n)
+    count = np.bincount(owners, minlength=n)
+    result = ranks.copy()
+    has = count > 0
+    result[has] = total[has] / count[has]
+    return result
+
+
+def layered_layout(graph, direction='TB', sweeps=8, layer_gap=80.0, node_gap=40.0):
+    """Return node centers for a layered layout"""
+    n = graph.n
+    dag = _acyclic_edges(n, graph.edges)
+    layers = _longest_path_layers(n, dag)
+    ranks = _ranks(layers, np.arange(n, dtype=float))
+
+    if len(dag):
+        sources, targets = dag[:, 0], dag[:, 1]
+        for sweep in range(sweeps):
+            # Alternate ordering by predecessors and by successors
+            if sweep % 2 == 0:
+                keys = _barycenters(n, ranks, sources, targets)
+            else:
+                keys = _barycenters(n, ranks, targets, sources)
+            ranks = _ranks(layers, keys + ranks * 1e-6)
+
+    horizontal = direction in ('LR', 'RL')
+    along = graph.sizes[:, 1] if not horizontal else graph.sizes[:, 0]
+    across = graph.sizes[:, 0] if not horizontal else graph.sizes[:, 1]
+    step_across = across.max(initial=DEFAULT_WIDTH) + node_gap
+    step_along = along.max(initial=DEFAULT_HEIGHT) + layer_gap
+
+    widths = np.bincount(layers, minlength=layers.max(initial=0) + 1)
+    across_pos = (ranks - (widths[layers] - 1) / 2.0) * step_across
+    along_pos = layers * step_along
+    if direction in ('BT', 'RL'):
+        along_pos = -along_pos
+    if horizontal:
+        return np.column_stack([along_pos, across_pos])
+    return np.column_stack([across_pos, along_pos])
+
+
+# Tree layouts
+
+def _spanning_forest(graph):
+    """Return ``(parent, children, roots)`` for a BFS spanning forest"""
+    n = graph.n
+    successors = [[] for _ in range(n)]
+    for source, target in graph.edges:
+        successors[source].append(target)
+    indegree = np.bincount(graph.edges[:, 1], minlength=n) if len(graph.edges) else np.zeros(n, dtype=np.int64)
+
+    parent = np.full(n, -1, dtype=np.int64)
+    children = [[] for _ in range(n)]
+    visited = np.zeros(n, dtype=bool)
+    roots = []
+    # Natural roots first, then anything left unreached (cycles, islands)
+    for root in list(np.flatnonzero(indegree == 0)) + list(range(n)):
+        if visited[root]:
+            continue
+        roots.append(root)
+        visited[root] = True
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for child in successors[node]:
+                if not visited[child]:
+                    visited[child] = True
+                    parent[child] = node
+                    children[node].append(child)
+                    queue.append(child)
+    return parent, children, roots
+
+
+def _tidy_positions(children, roots, n):
+    """Leaf slots left to right with parents centered over their children"""
+    slot = np.zeros(n, dtype=float)
+    depth = np.zeros(n, dtype=np.int64)
+    next_slot = 0.0
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                kids = children[node]
+                slot[node] = (slot[kids[0]] + slot[kids[-1]]) / 2.0 if kids else slot[node]
+                continue
+            kids = children[node]
+            if not kids:
+                slot[node] = next_slot
+                next_slot += 1.0
+                continue
+            stack.append((node, True))
+            for child in reversed(kids):
+                depth[child] = depth[node] + 1
+                stack.append((child, False))
+        next_slot += 1.0  # gap between trees
+    return slot, depth, max(next_slot - 1.0, 1.0)
+
+
+def tree_layout(graph, direction='TB', level_gap=80.0, node_gap=30.0):
+    """Return node centers for a tidy tree growing away from its roots in ``direction``"""
+    _, children, roots = _spanning_forest(graph)
+    slot, depth, _ = _tidy_positions(children, roots, graph.n)
+    horizontal = direction in ('LR', 'RL')
+    if horizontal:
+        step_across = graph.sizes[:, 1].max(initial=DEFAULT_HEIGHT) + node_gap
+        step_along = graph.sizes[:, 0].max(initial=DEFAULT_WIDTH) + level_gap
+    else:
+        step_across = graph.sizes[:, 0].max(initial=DEFAULT_WIDTH) + node_gap
+        step_along = graph.sizes[:, 1].max(initial=DEFAULT_HEIGHT) + level_gap
+    along_pos = depth * step_along
+    if direction in ('BT', 'RL'):
+        along_pos = -along_pos
+    if horizontal:
+        return np.column_stack([along_pos, slot * step_across])
+    return np.column_stack([slot * step_across, along_pos])
+
+
+def radial_layout(graph, ring_gap=160.0):
+    """Return node centers for a radial tree (root in the middle)"""
+    _, children, roots = _spanning_forest(graph)
+    slot, depth, total = _tidy_positions(children, roots, graph.n)
+    angle = slot / (total + 1.0) * 2.0 * np.pi
+    radius = depth * ring_gap
+    return np.column_stack([radius * np.cos(angle), radius * np.sin(angle)])
+
+
+# Force-directed layout
+
+def _exact_repulsion(pos, k2, chunk=512, sources=None):
+    """All-pairs repulsion of ``pos`` from ``sources`` (default: each other), chunked"""
+    sources = pos if sources is None else sources
+    disp = np.zeros_like(pos)
+    x, y = sources[:, 0], sources[:, 1]
+    for start in range(0, len(pos), chunk):
+        # A node's own entry has dx == dy == 0 and contributes nothing
+        dx = pos[start:start + chunk, 0, None] - x[None, :]
+        dy = pos[start:start + chunk, 1, None] - y[None, :]
+        weight = k2 / (dx * dx + dy * dy + 1e-9)
+        disp[start:start + chunk, 0] = (dx * weight).sum(axis=1)
+        disp[start:start + chunk, 1] = (dy * weight).sum(axis=1)
+    return disp
+
+
+NEIGHBOURHOOD = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def _approximate_repulsion(pos, k2, chunk=2048):
+    n = len(pos)
+    # About 3 * n ** 0.5 cells balances the far field (nodes x cells) with
+    # the near field (nodes x 9 cells' occupancy), both near O(n ** 1.5)
+    grid = max(int(round(math.sqrt(3.0) * n ** 0.25)), 1)
+    low = pos.min(axis=0)
+    span = np.maximum(pos.max(axis=0) - low, 1e-9)
+    cell_xy = np.minimum(((pos - low) / span * grid).astype(np.int64), grid - 1)
+    cell = cell_xy[:, 0] * grid + cell_xy[:, 1]
+    cells = grid * grid
+
+    counts = np.bincount(cell, minlength=cells).astype(float)
+    centers = np.column_stack([
+        np.bincount(cell, weights=pos[:, 0], minlength=cells),
+        np.bincount(cell, weights=pos[:, 1], minlength=cells),
+    ])
+    occupied = np.flatnonzero(counts)
+    centers = centers[occupied] / counts[occupied, None]
+    masses = counts[occupied]
+    # Occupied-cell index of each grid cell, -1 when empty
+    slot = np.full(cells, -1, dtype=np.int64)
+    slot[occupied] = np.arange(len(occupied))
+    occupied_xy = np.column_stack([occupied // grid, occupied % grid])
+
+    # The 3x3 block of cells around each occupied cell (-1 outside the grid or empty)
+    around = np.full((len(occupied), len(NEIGHBOURHOOD)), -1, dtype=np.int64)
+    for column, (dx, dy) in enumerate(NEIGHBOURHOOD):
+        gx, gy = occupied_xy[:, 0] + dx, occupied_xy[:, 1] + dy
+        inside = (gx >= 0) & (gx < grid) & (gy >= 0) & (gy < grid)
+        around[inside, column] = slot[gx[inside] * grid + gy[inside]]
+
+    # Far field: occupied cells outside a node's neighbourhood as point masses
+    own = slot[cell]
+    disp = np.zeros_like(pos)
+    for start in range(0, n, chunk):
+        block = slice(start, start + chunk)
+        dx = pos[block, 0, None] - centers[None, :, 0]
+        dy = pos[block, 1, None] - centers[None, :, 1]
+        weight = k2 * masses[None, :] / (dx * dx + dy * dy + 1e-9)
+        near = around[own[block]]
+        rows = np.broadcast_to(np.arange(weight.shape[0])[:, None], near.shape)
+        valid = near >= 0
+        weight[rows[valid], near[valid]] = 0.0
+        disp[block, 0] = (dx * weight).sum(axis=1)
+        disp[block, 1] = (dy * weight).sum(axis=1)
+
+    # Near field: exact pairs between each cell and its neighbourhood, so
+    # nodes on either side of a cell border still push apart
+    order = np.argsort(own, kind='stable')
+    bounds = np.searchsorted(own[order], np.arange(len(occupied) + 1))
+    for index in range(len(occupied)):
+        members = order[bounds[index]:bounds[index + 1]]
+        neighbours = np.concatenate([
+            order[bounds[other]:bounds[other + 1]] for other in around[index] if other >= 0
+        ])
+        if len(neighbours) > 1:
+            disp[members] += _exact_repulsion(pos[members], k2, chunk, sources=pos[neighbours])
+    return disp
+
+
+def force_layout(graph, iterations=100, seed=0, approximate=None, exact_limit=500, deadline=None, stats=None):
+    """
+    Return node centers for a Fruchterman-Reingold layout. Iteration stops
+    early once ``time.perf_counter()`` passes ``deadline``; ``stats`` (a
+    dict) receives the number of iterations run.
+    """
+    n = graph.n
+    if n == 0:
+        return np.zeros((0, 2))
+    k = float(np.max(graph.sizes, initial=DEFAULT_WIDTH)) * 1.5
+    k2 = k * k
+    side = math.sqrt(n) * k
+
+    rng = np.random.default_rng(seed)
+    pos = graph.positions.copy()
+    missing = np.isnan(pos).any(axis=1)
+    if (~missing).sum() > 1 and np.ptp(pos[~missing], axis=0).max() < k:
+        # Shapes stacked on one spot carry no useful starting layout
+        missing[:] = True
+    pos[missing] = rng.uniform(0, side, size=(int(missing.sum()), 2))
+    # Jitter so coincident starting points can separate
+    pos += rng.uniform(-1e-3, 1e-3, size=pos.shape) * k
+
+    if approximate is None:
+        approximate = n > exact_limit
+    repulsion = _approximate_repulsion if approximate else _exact_repulsion
+    sources, targets = graph.edges[:, 0], graph.edges[:, 1]
+
+    temperature = side / 10.0
+    cooling = temperature / max(iterations, 1)
+    done = 0
+    for done in range(1, iterations + 1):
+        disp = repulsion(pos, k2)
+        if len(graph.edges):
+            delta = pos[sources] - pos[targets]
+            dist = np.sqrt(np.einsum('ij,ij->i', delta, delta)) + 1e-9
+            pull = delta * (dist / k)[:, None]
+            np.add.at(disp, sources, -pull)
+            np.add.at(disp, targets, pull)
+        # Weak gravity keeps disconnected components together
+        disp -= (pos - pos.mean(axis=0)) * (0.01 * k / side)
+
+        length = np.sqrt(np.einsum('ij,ij->i', disp, disp)) + 1e-9
+        pos += disp * (np.minimum(length, temperature) / length)[:, None]
+        temperature = max(temperature - cooling, k * 0.01)
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+    if stats is not None:
+        stats['iterations'] = done
+    return pos
+
+
+def run_layout(graph, algorithm, **options):
+    """Dispatch to a layout algorithm and return node centers"""
+    if graph.n == 0:
+        return np.zeros((0, 2))
+    if algorithm == 'layered':
+        return layered_layout(graph, direction=options.get('direction', 'TB'))
+    if algorithm == 'tree':
+        return tree_layout(graph, direction=options.get('direction', 'TB'))
+    if algorithm == 'radial':
+        return radial_layout(graph)
+    if algorithm == 'force':
+        return force_layout(
+            graph,
+            iterations=options.get('iterations', 100),
+            seed=options.get('seed', 0),
+            approximate=options.get('approximate'),
+            deadline=options.get('deadline'),
+            stats=options.get('stats')
+        )
+    raise ValueError(f"Unknown layout algorithm: {algorithm}")
+
+
+def resolve_algorithm(algorithm, diagram_type):
+    """Map 'auto' to the layout suited to a diagram type"""
+    if algorithm in (None, '', 'auto'):
+        return AUTO_ALGORITHMS.get((diagram_type or '').lower(), 'layered')
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown layout algorithm: {algorithm}. Must be one of: auto, {', '.join(ALGORITHMS)}")
+    return algorithm
+
+
+def layout_patch(document, algorithm='auto', limits=True, **options):
+    """
+    Lay out a document and return a patch with the new top-left positions
+    of the shapes that moved. With ``limits`` the DIAGRAM_LAYOUT bounds
+    apply; LayoutTooLarge is raised above MAX_NODES.
+    """
+    started = time.perf_counter()
+    requested = algorithm
+    algorithm = resolve_algorithm(algorithm, document.get('type'))
+    direction = options.get('direction')
+    if direction is not None:
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of: {', '.join(DIRECTIONS)}")
+        if algorithm not in DIRECTED_ALGORITHMS:
+            if requested == algorithm:
+                raise ValueError(f"The {algorithm} layout does not take a direction")
+            # 'auto' picked an undirected layout; the direction does not apply
+            del options['direction']
+    graph = build_graph(document)
+    stats = {}
+    if limits:
+        config = get_config()
+        if graph.n > config['MAX_NODES']:
+            raise LayoutTooLarge(
+                f"Diagram has {graph.n} shapes; automatic layout is limited to {config['MAX_NODES']}"
+            )
+        options['iterations'] = min(options.get('iterations', 100), iteration_limit(graph.n, config))
+        options['deadline'] = started + config['TIME_BUDGET_SECONDS']
+    centers = run_layout(graph, algorithm, stats=stats, **options)
+
+    corners = centers - graph.sizes / 2.0
+    if graph.n:
+        corners -= corners.min(axis=0) - MARGIN
+    corners = np.round(corners, 1)
+    extent = (corners + graph.sizes).max(axis=0) + MARGIN if graph.n else np.array([0.0, 0.0])
+
+    moved = ~np.all(np.isclose(corners, graph.positions), axis=1)
+    shapes = [
+        {'id': graph.ids[i], 'x': float(corners[i, 0]), 'y': float(corners[i, 1])}
+        for i in np.flatnonzero(moved)
+    ]
+    patch = {
+        'algorithm': algorithm,
+        'shapes': shapes,
+        'bounds': {'width': float(extent[0]), 'height': float(extent[1])},
+        'node_count': graph.n,
+        'edge_count': int(len(graph.edges)),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000.0, 2),
+    }
+    if 'iterations' in stats:
+        patch['iterations'] = stats['iterations']
+        # Cut short by the time budget rather than run to the cap
+        patch['truncated'] = stats['iterations'] < options.get('iterations', 100)
+    return patch
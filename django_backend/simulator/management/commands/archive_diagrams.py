@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from simulator import archive
+
+
+class Command(BaseCommand):
+    """Move inactive diagrams into compressed cold storage"""
+    
+    help = 'Compress the body and history of diagrams untouched for DIAGRAM_ARCHIVE["INACTIVE_AFTER"]'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help='Archive diagrams untouched for this many days')
+        parser.add_argument('--limit', type=int, help='Archive at most this many diagrams')
+        parser.add_argument('--batch-size', type=int, help='Diagram ids fetched per query')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be archived')
+    
+    def handle(self, *args, **options):
+        report = archive.archive_inactive(
+            inactive_after=timedelta(days=options['days']) if options['days'] is not None else None,
+            dry_run=options['dry_run'],
+            limit=options['limit'],
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(archive.format_report(report)))
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient
+from simulator.models import Diagram
+
+
+ENDPOINTS = ('load', 'list', 'history', 'save')
+
+
+class Command(BaseCommand):
+    """Compare sync DRF and async view throughput through the ASGI handler"""
+    
+    help = 'Measure requests/s of the sync and async load, list, history and save endpoints'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and variant')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once')
+        parser.add_argument('--diagrams', type=int, default=50, help='Diagrams seeded for the run')
+        parser.add_argument('--shapes', type=int, default=100, help='Shapes per seeded diagram')
+        parser.add_argument(
+            '--endpoint', action='append', choices=ENDPOINTS,
+            help='Endpoint to benchmark (repeatable, default: all)'
+        )
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded diagrams afterwards')
+    
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING(
+            'Seeds diagrams into the configured database; point DATABASES at a scratch copy.'
+        ))
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.stdout.write(f"SQLite journal_mode={cursor.fetchone()[0]}")
+        
+        ids = self.seed(options['diagrams'], options['shapes'])
+        try:
+            results = asyncio.run(self.run_all(ids, options))
+        finally:
+            if not options['keep']:
+                Diagram.objects.filter(id__in=ids).delete()
+        
+        self.stdout.write(f"{'endpoint':<10}{'sync req/s':>14}{'async req/s':>14}{'speedup':>10}")
+        for endpoint, (sync_rps, async_rps) in results.items():
+            speedup = async_rps / sync_rps if sync_rps else 0.0
+            self.stdout.write(f"{endpoint:<10}{sync_rps:>14.1f}{async_rps:>14.1f}{speedup:>9.2f}x")
+    
+    def seed(self, count, shapes):
+        document = self.document(shapes, 0)
+        ids = []
+        for index in range(count):
+            diagram = Diagram.objects.create(title=f'Benchmark {index}', diagram_json=json.dumps(document))
+            ids.append(diagram.id)
+        return ids
+    
+    @staticmethod
+    def document(shapes, seed):
+        return {
+            'shapes': [
+                {'id': f's{i}', 'type': 'rect', 'x': i * 10 + seed, 'y': i * 5, 'label': f'Shape {i}'}
+                for i in range(shapes)
+            ],
+            'connections': [{'id': f'c{i}', 'from': f's{i}', 'to': f's{i + 1}'} for i in range(shapes - 1)],
+            'canvas': {'width': 1200, 'height': 800},
+        }
+    
+    async def run_all(self, ids, options):
+        results = {}
+        for endpoint in options['endpoint'] or ENDPOINTS:
+            results[endpoint] = (
+                await self.measure(endpoint, '/api', ids, options),
+                await self.measure(endpoint, '/api/async', ids, options),
+            )
+        return results
+    
+    async def measure(self, endpoint, prefix, ids, options):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(max(options['concurrency'], 1))
+        shapes = options['shapes']
+        failures = 0
+        
+        async def one(index):
+            nonlocal failures
+            diagram_id = ids[index % len(ids)]
+            async with semaphore:
+                if endpoint == 'load':
+                    response = await client.get(f'{prefix}/diagrams/load/{diagram_id}/')
+                elif endpoint == 'list':
+                    response = await client.get(f'{prefix}/diagrams/load/')
+                elif endpoint == 'history':
+                    response = await client.get(f'{prefix}/diagrams/history/{diagram_id}/')
+                else:
+                    response = await client.post(
+                        f'{prefix}/diagrams/save/',
+                        {'id': diagram_id, 'title': 'Benchmark', 'diagram_json': self.document(shapes, index)},
+                        content_type='application/json'
+                    )
+            if response.status_code != 200:
+                failures += 1
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        if failures:
+            self.stdout.write(self.style.ERROR(f"{prefix} {endpoint}: {failures} failed request(s)"))
+        return options['requests'] / elapsed if elapsed else 0.0
@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from simulator import layout
+
+
+class Command(BaseCommand):
+    """Time the auto-layout algorithms on random graphs of increasing size"""
+
+    help = 'Measure layout time for random diagrams across node counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='100,1000,5000,10000',
+            help='Comma-separated node counts (default: 100,1000,5000,10000)'
+        )
+        parser.add_argument(
+            '--algorithm', action='append', choices=layout.ALGORITHMS,
+            help='Algorithm to benchmark (repeatable, default: all)'
+        )
+        parser.add_argument('--edges-per-node', type=float, default=1.5, help='Average edges per node')
+        parser.add_argument('--iterations', type=int, default=50, help='Force layout iterations')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for generated graphs')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        algorithms = options['algorithm'] or list(layout.ALGORITHMS)
+
+        self.stdout.write(f"{'algorithm':<10}{'nodes':>8}{'edges':>8}{'ms':>12}{'moved':>8}")
+        for algorithm in algorithms:
+            for size in sizes:
+                document = self.document(size, options['edges_per_node'], options['seed'])
+                started = time.perf_counter()
+                patch = layout.layout_patch(
+                    document, algorithm=algorithm, limits=False, iterations=options['iterations']
+                )
+                elapsed = (time.perf_counter() - started) * 1000.0
+                self.stdout.write(
+                    f"{algorithm:<10}{patch['node_count']:>8}{patch['edge_count']:>8}"
+                    f"{elapsed:>12.1f}{len(patch['shapes']):>8}"
+                )
+
+    @staticmethod
+    def document(nodes, edges_per_node, seed):
+        """Random graph: a spanning tree plus extra random edges"""
+        rng = np.random.default_rng(seed)
+        shapes = [
+            {'id': f'shape_{i}', 'type': 'rectangle', 'x': 0, 'y': 0, 'width': 120, 'height': 60}
+            for i in range(nodes)
+        ]
+        parents = [int(rng.integers(0, i)) for i in range(1, nodes)]
+        pairs = [(parent, child) for child, parent in enumerate(parents, start=1)]
+        extra = max(int(nodes * edges_per_node) - len(pairs), 0)
+        if nodes > 1:
+            pairs += [tuple(int(v) for v in pair) for pair in rng.integers(0, nodes, size=(extra, 2))]
+        connections = [
+            {'id': f'conn_{i}', 'from': f'shape_{a}', 'to': f'shape_{b}'}
+            for i, (a, b) in enumerate(pairs)
+        ]
+        return {'shapes': shapes, 'connections': connections}
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from simulator import retention
+
+
+class Command(BaseCommand):
+    """Thin version history and purge soft-deleted diagrams"""
+    
+    help = 'Apply the DIAGRAM_RETENTION policy in small chunks (schedule via cron for background compaction)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report reclaimable space without deleting')
+        parser.add_argument('--chunk-size', type=int, help='Rows deleted per transaction')
+        parser.add_argument('--sleep', type=float, help='Seconds to pause between chunks')
+        parser.add_argument('--max-chunks', type=int, help='Stop after this many chunks; the next run continues')
+    
+    def handle(self, *args, **options):
+        retention.compact(
+            dry_run=options['dry_run'],
+            chunk_size=options['chunk_size'],
+            sleep=options['sleep'],
+            max_chunks=options['max_chunks'],
+            stdout=self.stdout
+        )
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from simulator.models import Diagram, DiagramVersion
+from simulator import storage
+
+
+class Command(BaseCommand):
+    """Backfill content hashes and move duplicate bodies into shared content"""
+    
+    help = 'Hash existing diagram and version bodies and share identical large bodies'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows processed per transaction')
+    
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        diagrams = self.backfill(
+            Diagram.objects.filter(storage_mode=Diagram.STORAGE_BLOB, content__isnull=True, is_archived=False), batch_size
+        )
+        versions = self.backfill(DiagramVersion.objects.filter(content__isnull=True), batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {diagrams} diagram(s) and {versions} version(s)"
+        ))
+    
+    def backfill(self, queryset, batch_size):
+        processed = 0
+        last_id = 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_id).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for row in batch:
+                    last_id = row.pk
+                    digest = row.content_hash or storage.content_hash(row.diagram_json)
+                    inline, content = storage.store_body(row.diagram_json, digest)
+                    # Queryset update keeps updated_at and skips save signals
+                    type(row).objects.filter(pk=row.pk).update(
+                        content_hash=digest, diagram_json=inline, content=content
+                    )
+            processed += len(batch)
+            self.stdout.write(f"{queryset.model.__name__}: {processed}")
+        return processed
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from simulator.models import DiagramContent
+from simulator import bodystore
+
+
+class Command(BaseCommand):
+    """Move shared diagram bodies between the database and the file store"""
+    
+    help = 'Move large DiagramContent bodies into the file store (run dedupe_bodies first for inline bodies)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--internalize', action='store_true',
+            help='Move bodies from the file store back into the database'
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows moved per transaction')
+    
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        config = bodystore.get_config()
+        
+        if options['internalize']:
+            rows = DiagramContent.objects.filter(external=True)
+        else:
+            if not config['ENABLED']:
+                raise CommandError('DIAGRAM_BODY_STORE is disabled; enable it before externalizing bodies')
+            rows = DiagramContent.objects.filter(external=False, size__gte=config['MIN_BYTES'])
+        
+        moved = 0
+        last_hash = ''
+        while True:
+            batch = list(rows.filter(content_hash__gt=last_hash).order_by('content_hash')[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                for content in batch:
+                    last_hash = content.content_hash
+                    if options['internalize']:
+                        body = bodystore.read(content.content_hash)
+                        DiagramContent.objects.filter(pk=content.pk).update(body=body, external=False)
+                    else:
+                        bodystore.write(content.content_hash, content.body)
+                        DiagramContent.objects.filter(pk=content.pk).update(body='', external=True)
+            if options['internalize']:
+                # Files are only removed once the rows no longer point at them
+                for content in batch:
+                    bodystore.delete(content.content_hash)
+            moved += len(batch)
+            self.stdout.write(f"Moved {moved} bodies")
+        
+        target = 'database' if options['internalize'] else 'file store'
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} bodies to the {target}"))
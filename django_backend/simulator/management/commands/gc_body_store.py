@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from simulator.models import DiagramContent
+from simulator import bodystore
+
+
+class Command(BaseCommand):
+    """Remove files in the body store that no row references"""
+    
+    help = 'Delete orphaned files from the diagram body store'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report orphaned files without deleting')
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Ignore files younger than this many seconds (they may belong to in-flight saves)'
+        )
+        parser.add_argument('--batch-size', type=int, default=500, help='Hashes checked per query')
+    
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        orphans, freed, batch = 0, 0, []
+        
+        def flush():
+            nonlocal orphans, freed
+            known = set(
+                DiagramContent.objects.filter(
+                    content_hash__in=[digest for digest, _ in batch], external=True
+                ).values_list('content_hash', flat=True)
+            )
+            for digest, size in batch:
+                if digest in known:
+                    continue
+                orphans += 1
+                freed += size
+                if not options['dry_run']:
+                    bodystore.delete(digest)
+            batch.clear()
+        
+        for item in bodystore.iter_stored(min_age=options['min_age']):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        
+        verb = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {orphans} orphaned file(s), {freed} bytes"))
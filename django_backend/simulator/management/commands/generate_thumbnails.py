@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from simulator.models import Diagram
+from simulator import thumbnails
+
+
+class Command(BaseCommand):
+    """Render missing or outdated diagram thumbnails"""
+    
+    help = 'Render SVG thumbnails for active diagrams whose preview is missing or out of date'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Re-render every thumbnail')
+        parser.add_argument('--batch-size', type=int, default=200, help='Diagrams loaded per query')
+    
+    def handle(self, *args, **options):
+        diagrams = Diagram.objects.filter(is_active=True).defer('diagram_json').select_related('thumbnail')
+        rendered = skipped = 0
+        for diagram in diagrams.iterator(chunk_size=max(options['batch_size'], 1)):
+            current = getattr(diagram, 'thumbnail', None)
+            if not options['force'] and thumbnails.is_current(current, diagram):
+                skipped += 1
+                continue
+            thumbnails.generate(diagram, force=True)
+            rendered += 1
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} thumbnail(s), {skipped} already current"))
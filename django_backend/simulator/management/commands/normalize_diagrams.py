@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from simulator.models import Diagram
+from simulator import storage
+
+
+class Command(BaseCommand):
+    """Move existing diagram bodies between blob and normalized storage"""
+    
+    help = 'Convert diagrams between single-document and normalized element storage'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Only convert these diagram ids')
+        parser.add_argument(
+            '--reverse', action='store_true',
+            help='Convert normalized diagrams back to a single JSON document'
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help='Diagrams converted per query batch')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be converted')
+    
+    def handle(self, *args, **options):
+        if options['reverse']:
+            source, target = Diagram.STORAGE_NORMALIZED, Diagram.STORAGE_BLOB
+        else:
+            source, target = Diagram.STORAGE_BLOB, Diagram.STORAGE_NORMALIZED
+        
+        diagrams = Diagram.objects.filter(storage_mode=source, is_archived=False).order_by('id')
+        if options['ids']:
+            diagrams = diagrams.filter(id__in=options['ids'])
+        
+        total = diagrams.count()
+        if options['dry_run']:
+            self.stdout.write(f"{total} diagram(s) would be converted to {target} storage")
+            return
+        
+        converted = 0
+        skipped = 0
+        last_id = 0
+        batch_size = max(options['batch_size'], 1)
+        while True:
+            # Page by primary key so converted rows never shift the window
+            batch = list(diagrams.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            for diagram in batch:
+                last_id = diagram.id
+                try:
+                    if storage.convert_storage(diagram, target):
+                        converted += 1
+                except storage.DuplicateElementError as e:
+                    # Left in blob storage rather than losing elements
+                    skipped += 1
+                    self.stdout.write(self.style.WARNING(f"Skipped diagram {diagram.id}: {e}"))
+            self.stdout.write(f"Converted {converted}/{total}")
+        
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} diagram(s) to {target} storage"))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"Skipped {skipped} diagram(s) with duplicate element ids"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from simulator import search
+
+
+class Command(BaseCommand):
+    """Rebuild the diagram full-text search index"""
+    
+    help = 'Re-extract titles and labels for every diagram and rebuild the search index'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Diagrams indexed per transaction')
+    
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        self.stdout.write(f"Rebuilding search index using the {backend} backend")
+        indexed = search.rebuild(batch_size=max(options['batch_size'], 1), stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} diagram(s)"))
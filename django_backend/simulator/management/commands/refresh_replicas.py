@@ -0,0 +1,34 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from simulator import routers
+
+
+class Command(BaseCommand):
+    """Copy the primary SQLite database onto its local replica files"""
+    
+    help = 'Refresh SQLite read replicas from the primary (server databases replicate on their own)'
+    
+    def handle(self, *args, **options):
+        replicas = routers.get_replicas()
+        if not replicas:
+            raise CommandError('No read replicas configured; set DB_REPLICAS')
+        
+        primary = connections[routers.PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError(f'The primary uses {primary.vendor}; use its native replication instead')
+        primary.ensure_connection()
+        
+        for alias in replicas:
+            replica = connections[alias]
+            if replica.vendor != 'sqlite':
+                raise CommandError(f'Replica {alias} is not an SQLite database')
+            replica.close()
+            # The backup API copies a consistent snapshot even while the primary is in use
+            target = sqlite3.connect(str(replica.settings_dict['NAME']))
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {alias} ({replica.settings_dict['NAME']})"))
@@ -0,0 +1,340 @@
+import asyncio
+import json
+import threading
+from collections import Counter, defaultdict, deque
+
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from diagram_simulator.asgi import application
+from simulator.models import Diagram
+from simulator import recorder, storage
+
+
+WRITE_VERBS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# Inbound message type -> (broadcast frame type, whether the sender gets it too)
+ECHOES = {
+    'diagram_update': ('diagram_update', True),
+    'cursor_position': ('cursor_update', False),
+    'selection_change': ('selection_change', False),
+    'chat_message': ('chat_message', True),
+}
+
+
+def sent_signature(text):
+    """Match key for an inbound message, or None if it produces no broadcast"""
+    try:
+        message = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(message, dict):
+        return None
+    kind = message.get('type', 'diagram_update')
+    if kind == 'diagram_update':
+        return (kind, message.get('operation', 'update'), message.get('shape_id'),
+                json.dumps(message.get('diagram_data', {}), sort_keys=True))
+    if kind == 'cursor_position':
+        return (kind, message.get('x', 0), message.get('y', 0))
+    if kind == 'selection_change':
+        return (kind, json.dumps(message.get('selected_shapes', []), sort_keys=True))
+    if kind == 'chat_message':
+        return (kind, message.get('message', ''), message.get('username', 'Anonymous'))
+    return None
+
+
+def frame_signature(frame):
+    """Match key for an outbound frame, mirroring sent_signature"""
+    kind = frame.get('type')
+    if kind == 'diagram_update':
+        return (kind, frame.get('operation'), frame.get('shape_id'),
+                json.dumps(frame.get('diagram_data', {}), sort_keys=True))
+    if kind == 'cursor_update':
+        cursor = frame.get('cursor_data', {})
+        return ('cursor_position', cursor.get('x'), cursor.get('y'))
+    if kind == 'selection_change':
+        selection = frame.get('selection_data', {})
+        return (kind, json.dumps(selection.get('selected_shapes', []), sort_keys=True))
+    if kind == 'chat_message':
+        return (kind, frame.get('message'), frame.get('username'))
+    return None
+
+
+class WriteCounter:
+    """Database execute wrapper counting write statements across threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.statements = Counter()
+        self.param_bytes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        verb = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+        if verb in WRITE_VERBS:
+            size = len(repr(params)) if params is not None else 0
+            with self.lock:
+                self.statements[verb] += 1
+                self.param_bytes += size
+        return execute(sql, params, many, context)
+
+    def attach(self, sender=None, connection=None, **kwargs):
+        if connection is not None and self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def detach(self):
+        for connection in connections.all(initialized_only=True):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class ReplayStats:
+    """Latency of broadcasts matched back to the messages that caused them"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.pending = defaultdict(deque)
+        self.latencies = defaultdict(list)
+        self.sent = Counter()
+        self.frames = 0
+        self.errors = 0
+        self.resyncs = 0
+
+    def on_sent(self, room, client, text):
+        signature = sent_signature(text)
+        kind = signature[0] if signature else 'other'
+        self.sent[kind] += 1
+        if signature:
+            self.pending[(room, signature)].append((self.clock(), client, ECHOES[kind][1]))
+
+    def on_frame(self, room, client, text):
+        """Match a received frame to the message that caused it; returns the parsed frame"""
+        self.frames += 1
+        try:
+            frame = json.loads(text)
+        except ValueError:
+            return None
+        if frame.get('type') == 'error':
+            self.errors += 1
+        elif frame.get('type') == 'resync_required':
+            self.resyncs += 1
+        signature = frame_signature(frame)
+        queue = self.pending.get((room, signature)) if signature else None
+        if not queue:
+            return frame
+        # First delivery to anyone allowed to see it settles the message
+        for index, (sent_at, sender, echoes) in enumerate(queue):
+            if echoes or sender != client:
+                del queue[index]
+                self.latencies[signature[0]].append((self.clock() - sent_at) * 1000.0)
+                break
+        return frame
+
+    def undelivered(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    """Replay recorded collaboration traffic against the in-process ASGI app"""
+
+    help = (
+        'Drive recorded WebSocket sessions back through DiagramConsumer with one simulated '
+        'client per recorded session, reporting broadcast latency and database writes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Recording files or directories')
+        parser.add_argument('--speed', type=float, default=1.0, help='Playback speed multiplier; 0 sends as fast as possible')
+        parser.add_argument('--copies', type=int, default=1, help='Replay the stream into this many rooms at once')
+        parser.add_argument('--diagram', type=int, help='Replay into this existing diagram instead of a scratch copy')
+        parser.add_argument('--settle', type=float, default=2.0, help='Seconds to wait for trailing broadcasts')
+        parser.add_argument('--max-events', type=int, help='Replay only the first N events')
+        parser.add_argument('--output', help='Also write the report as JSON to this file')
+        parser.add_argument('--keep', action='store_true', help='Keep the scratch diagrams afterwards')
+
+    def handle(self, *args, **options):
+        if options['speed'] < 0:
+            raise CommandError('--speed must be zero or positive')
+        if options['diagram'] and options['copies'] != 1:
+            raise CommandError('--diagram can only be combined with --copies 1')
+
+        events, snapshots = recorder.load_recordings(options['paths'])
+        if options['max_events']:
+            events = events[:options['max_events']]
+        if not events:
+            raise CommandError('No recorded events found')
+
+        self.stdout.write(self.style.WARNING(
+            'Replays write to the configured database and channel layer; point them at scratch copies.'
+        ))
+        targets = self.prepare_rooms(events, snapshots, options)
+
+        counter = WriteCounter()
+        connection_created.connect(counter.attach)
+        for connection in connections.all():
+            counter.attach(connection=connection)
+        try:
+            report = asyncio.run(self.replay(events, targets, counter, options))
+        finally:
+            connection_created.disconnect(counter.attach)
+            counter.detach()
+            if not options['keep'] and not options['diagram']:
+                Diagram.objects.filter(id__in=targets.values()).delete()
+
+        self.print_report(report)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(report, handle, indent=2)
+
+    def prepare_rooms(self, events, snapshots, options):
+        """
+        Map each (recorded room, copy) to the diagram the copy replays into.
+        Scratch copies start from the document recorded when the room's first
+        session connected, never from the source diagram's current body, so
+        every replay of a recording starts from the same state.
+        """
+        rooms = sorted({event['diagram_id'] for event in events})
+        if options['diagram']:
+            if len(rooms) != 1:
+                raise CommandError('--diagram needs recordings from a single room')
+            if not Diagram.objects.filter(id=options['diagram'], is_active=True).exists():
+                raise CommandError(f"Diagram {options['diagram']} not found")
+            return {(rooms[0], 0): options['diagram']}
+
+        targets = {}
+        for room in rooms:
+            snapshot = snapshots.get(room)
+            if snapshot is None:
+                self.stdout.write(self.style.WARNING(
+                    f'Recording of room {room} has no starting snapshot; replaying into an empty diagram.'
+                ))
+                document = {'shapes': [], 'connections': []}
+            else:
+                document = snapshot['document']
+            for copy in range(max(options['copies'], 1)):
+                diagram = storage.save_document(Diagram(title=f'Replay of {room} #{copy}'), document)
+                targets[(room, copy)] = diagram.id
+        return targets
+
+    async def replay(self, events, targets, counter, options):
+        loop = asyncio.get_running_loop()
+        stats = ReplayStats(loop.time)
+        clients = {}
+        opened = set()
+        readers = []
+
+        async def read_frames(key, communicator):
+            room = key[0]
+            while True:
+                message = await communicator.receive_output(timeout=86400)
+                if message['type'] == 'websocket.close':
+                    return
+                if message['type'] == 'websocket.send' and message.get('text') is not None:
+                    frame = stats.on_frame(room, key, message['text'])
+                    # Ack like a live client so the server's send window keeps moving
+                    if isinstance(frame, dict) and 'seq' in frame:
+                        await communicator.send_to(text_data=json.dumps({'type': 'ack', 'seq': frame['seq']}))
+
+        async def connect(key):
+            communicator = WebsocketCommunicator(application, f"/ws/diagrams/{targets[key[0]]}/")
+            connected, _ = await communicator.connect(timeout=10)
+            if not connected:
+                raise CommandError(f"Could not connect simulated client for {key}")
+            clients[key] = communicator
+            opened.add(key)
+            readers.append(asyncio.create_task(read_frames(key, communicator)))
+            return communicator
+
+        async def disconnect(key):
+            communicator = clients.pop(key, None)
+            if communicator is not None:
+                await communicator.disconnect()
+
+        writes_before = sum(counter.statements.values())
+        started = loop.time()
+        for event in events:
+            if options['speed'] > 0:
+                delay = started + event['t'] / options['speed'] - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            for (room, copy) in targets:
+                if room != event['diagram_id']:
+                    continue
+                key = ((room, copy), event['session'])
+                if event['event'] == 'connect':
+                    if key not in clients:
+                        await connect(key)
+                elif event['event'] == 'disconnect':
+                    await disconnect(key)
+                elif event['event'] == 'message':
+                    communicator = clients.get(key) or await connect(key)
+                    stats.on_sent((room, copy), key, event['data'])
+                    await communicator.send_to(text_data=event['data'])
+        replayed = loop.time() - started
+
+        await asyncio.sleep(options['settle'])
+        for key in list(clients):
+            await disconnect(key)
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        messages = sum(stats.sent.values())
+        writes = sum(counter.statements.values()) - writes_before
+        return {
+            'events': len(events),
+            'messages': messages,
+            'rooms': len(targets),
+            'clients': len(opened),
+            'recorded_seconds': round(events[-1]['t'] - events[0]['t'], 3),
+            'replayed_seconds': round(replayed, 3),
+            'speed': options['speed'],
+            'messages_per_second': round(messages / replayed, 1) if replayed else None,
+            'frames_received': stats.frames,
+            'errors': stats.errors,
+            'resyncs': stats.resyncs,
+            'undelivered': stats.undelivered(),
+            'latency_ms': {
+                kind: {
+                    'count': len(values),
+                    'p50': round(percentile(values, 0.50), 2),
+                    'p95': round(percentile(values, 0.95), 2),
+                    'p99': round(percentile(values, 0.99), 2),
+                    'max': round(max(values), 2),
+                }
+                for kind, values in sorted(stats.latencies.items()) if values
+            },
+            'db_writes': {
+                'statements': writes,
+                'by_verb': dict(counter.statements),
+                'per_message': round(writes / messages, 3) if messages else None,
+                'param_bytes': counter.param_bytes,
+            },
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"Replayed {report['events']} event(s), {report['messages']} message(s) from "
+            f"{report['clients']} client(s) in {report['rooms']} room(s): "
+            f"{report['replayed_seconds']}s (recorded {report['recorded_seconds']}s), "
+            f"{report['messages_per_second']} msg/s"
+        )
+        self.stdout.write(f"{'type':<18}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for kind, row in report['latency_ms'].items():
+            self.stdout.write(
+                f"{kind:<18}{row['count']:>8}{row['p50']:>10}{row['p95']:>10}{row['p99']:>10}{row['max']:>10}"
+            )
+        writes = report['db_writes']
+        self.stdout.write(
+            f"Frames received {report['frames_received']}, undelivered {report['undelivered']}, "
+            f"errors {report['errors']}, resyncs {report['resyncs']}"
+        )
+        self.stdout.write(
+            f"DB writes: {writes['statements']} statement(s) {writes['by_verb']}, "
+            f"{writes['per_message']} per message, ~{writes['param_bytes']} parameter bytes"
+        )
+
@@ -1,21 +1,73 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 import json
+import zlib
+from . import cache as diagram_cache
+from . import bodystore
+
+
+def default_storage_mode():
+    """Storage mode for newly created diagrams"""
+    return getattr(settings, 'DIAGRAM_STORAGE_MODE', Diagram.STORAGE_BLOB)
+
+
+class DiagramContent(models.Model):
+    """
+    Model to store diagram bodies once, addressed by their content hash
+    """
+    content_hash = models.CharField(max_length=64, primary_key=True)
+    body = models.TextField(blank=True)
+    size = models.IntegerField(default=0)
+    external = models.BooleanField(default=False, help_text="Body lives in the file store, not in this row")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.size} bytes)"
+    
+    def read(self):
+        """Return the body text from the row or the file store"""
+        if self.external:
+            return bodystore.read(self.content_hash)
+        return self.body
 
 
 class Diagram(models.Model):
     """
     Model to store diagram data with version control
     """
+    STORAGE_BLOB = 'blob'
+    STORAGE_NORMALIZED = 'normalized'
+    STORAGE_CHOICES = [
+        (STORAGE_BLOB, 'Single JSON document'),
+        (STORAGE_NORMALIZED, 'Shapes and connections stored as rows'),
+    ]
+    
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     title = models.CharField(max_length=255, default="Untitled Diagram")
-    diagram_json = models.TextField(help_text="JSON representation of the diagram")
+    diagram_json = models.TextField(blank=True, help_text="JSON representation of the diagram")
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    content = models.ForeignKey(
+        DiagramContent, on_delete=models.PROTECT, null=True, blank=True, related_name='diagrams',
+        help_text="Shared body used instead of diagram_json when set"
+    )
     version = models.IntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    is_archived = models.BooleanField(
+        default=False, db_index=True,
+        help_text="Body and history moved to DiagramArchive until next accessed"
+    )
+    rehydrated_at = models.DateTimeField(null=True, blank=True)
+    storage_mode = models.CharField(
+        max_length=20,
+        choices=STORAGE_CHOICES,
+        default=default_storage_mode,
+        help_text="Whether shapes and connections live in diagram_json or in DiagramElement rows"
+    )
     
     class Meta:
         ordering = ['-updated_at']
@@ -23,25 +75,102 @@ class Diagram(models.Model):
     def __str__(self):
         return f"{self.title} (v{self.version})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        diagram = super().from_db(db, field_names, values)
+        # Lets the save that replaces this body drop its cache entry
+        diagram_cache.remember_stored(diagram)
+        return diagram
+    
+    @property
+    def is_normalized(self):
+        return self.storage_mode == self.STORAGE_NORMALIZED
+    
+    def get_body(self):
+        """Return the stored JSON text, following shared content or the archive if used"""
+        if self.is_archived:
+            return self.archive.read()['body']
+        if self.content_id:
+            return self.content.read()
+        return self.diagram_json
+    
+    def load_diagram_data(self):
+        """Parse diagram JSON and attach stored elements, bypassing the cache"""
+        data = diagram_cache.parse_diagram_json(self.get_body())
+        # Archived bodies are stored whole, elements included
+        if self.is_normalized and self.pk and not self.is_archived and isinstance(data, dict):
+            for key in DiagramElement.KIND_KEYS.values():
+                data[key] = []
+            elements = self.elements.order_by('kind', 'position').values_list('kind', 'data')
+            for kind, element_data in elements:
+                data[DiagramElement.KIND_KEYS[kind]].append(element_data)
+        return data
+    
     def get_diagram_data(self):
-        """Parse and return diagram JSON data"""
-        try:
-            return json.loads(self.diagram_json)
-        except json.JSONDecodeError:
-            return {}
+        """Parse and return diagram JSON data (cached per version)"""
+        return diagram_cache.get_diagram_data(self)
+    
+    def get_diagram_json(self):
+        """Return compact serialized diagram JSON (cached per version)"""
+        return diagram_cache.get_diagram_json(self)
+    
+    def get_document_json(self):
+        """Return the full diagram JSON text regardless of storage mode"""
+        if self.is_normalized:
+            return self.get_diagram_json()
+        return self.get_body()
     
     def set_diagram_data(self, data):
         """Set diagram data from dictionary"""
         self.diagram_json = json.dumps(data)
 
 
+class DiagramElement(models.Model):
+    """
+    Model to store individual shapes and connections of normalized diagrams
+    """
+    KIND_SHAPE = 'shape'
+    KIND_CONNECTION = 'connection'
+    KIND_CHOICES = [
+        (KIND_SHAPE, 'Shape'),
+        (KIND_CONNECTION, 'Connection'),
+    ]
+    # Document key holding each kind of element
+    KIND_KEYS = {
+        KIND_SHAPE: 'shapes',
+        KIND_CONNECTION: 'connections',
+    }
+    
+    diagram = models.ForeignKey(Diagram, on_delete=models.CASCADE, related_name='elements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    element_id = models.CharField(max_length=255)
+    element_type = models.CharField(max_length=100, blank=True, default='')
+    position = models.IntegerField(default=0)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['kind', 'position']
+        unique_together = ['diagram', 'kind', 'element_id']
+        indexes = [
+            models.Index(fields=['diagram', 'kind', 'element_type']),
+        ]
+        
+    def __str__(self):
+        return f"{self.diagram_id} - {self.kind} {self.element_id}"
+
+
 class DiagramVersion(models.Model):
     """
     Model to track version history of diagrams
     """
     diagram = models.ForeignKey(Diagram, on_delete=models.CASCADE, related_name='versions')
     version_number = models.IntegerField()
-    diagram_json = models.TextField()
+    diagram_json = models.TextField(blank=True)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    content = models.ForeignKey(
+        DiagramContent, on_delete=models.PROTECT, null=True, blank=True, related_name='versions'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     comment = models.TextField(blank=True, null=True)
     
@@ -51,6 +180,65 @@ class DiagramVersion(models.Model):
         
     def __str__(self):
         return f"{self.diagram.title} - Version {self.version_number}"
+    
+    def get_body(self):
+        """Return the stored JSON text, following shared content if used"""
+        if self.content_id:
+            return self.content.read()
+        return self.diagram_json
+
+
+class DiagramArchive(models.Model):
+    """
+    Model to store the compressed body and version history of an archived diagram
+    """
+    diagram = models.OneToOneField(
+        Diagram, on_delete=models.CASCADE, primary_key=True, related_name='archive'
+    )
+    data = models.BinaryField(help_text="zlib-compressed JSON of the body and versions")
+    size = models.IntegerField(help_text="Uncompressed size in bytes")
+    compressed_size = models.IntegerField()
+    version_count = models.IntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Archive of {self.diagram_id} ({self.compressed_size} bytes)"
+    
+    def read(self):
+        """Return the decompressed archive payload"""
+        return json.loads(zlib.decompress(bytes(self.data)).decode('utf-8'))
+
+
+class DiagramSearchDocument(models.Model):
+    """
+    Model to store the searchable text extracted from a diagram
+    """
+    diagram = models.OneToOneField(
+        Diagram, on_delete=models.CASCADE, primary_key=True, related_name='search_document'
+    )
+    title = models.CharField(max_length=255)
+    content = models.TextField(blank=True, default='', help_text="Shape and connection labels")
+    indexed_version = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Search document for {self.diagram_id}"
+
+
+class DiagramThumbnail(models.Model):
+    """
+    Model to store a small SVG preview of a diagram's current version
+    """
+    diagram = models.OneToOneField(
+        Diagram, on_delete=models.CASCADE, primary_key=True, related_name='thumbnail'
+    )
+    svg = models.TextField()
+    version = models.IntegerField(help_text="Diagram version the preview was rendered from")
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Thumbnail for {self.diagram_id} v{self.version}"
 
 
 class CollaborationSession(models.Model):
@@ -0,0 +1,242 @@
+"""
+Opt-in recording of inbound collaboration traffic for replay.
+
+When ``COLLABORATION_RECORDING['ENABLED']`` is set, every message a
+``DiagramConsumer`` receives, together with connects and disconnects, is
+appended to a gzip-compressed JSON-lines log per room:
+``<ROOT>/diagram_<id>/<started>-<pid>-<tag>.jsonl.gz``. The first line is a
+header with the wall-clock start; each event after it records its offset in
+seconds from that start, the server-side session id and the raw message
+text. The header also carries a snapshot of the diagram (version, content
+hash and document) taken when the room's first session connected, so a
+replay starts from the same state every time.
+
+Recording must not block the event loop: ``record`` only appends to an
+in-memory buffer. A single background writer thread flushes buffers every
+``FLUSH_SECONDS`` (sooner once ``FLUSH_RECORDS`` are waiting), when the
+last session leaves a room, and at interpreter exit. Each flush is written
+as a separate gzip member, so a log is only ever appended to and stays
+readable if the process dies.
+
+The ``replay_sessions`` command reads these logs back with ``load_events``.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+
+
+DEFAULT_CONFIG = {
+    'ENABLED': False,
+    'ROOT': None,
+    # Diagram ids to record, or None for every room
+    'ROOMS': None,
+    'FLUSH_RECORDS': 100,
+    'FLUSH_SECONDS': 1.0,
+}
+
+LOG_FORMAT = 1
+
+logger = logging.getLogger(__name__)
+
+# Room recorders shared by the connections of this process
+_rooms = {}
+# Recorders the writer still has to flush, including closed ones
+_recorders = set()
+_wake = threading.Condition()
+_writer = None
+
+
+def get_config():
+    """Return recording configuration merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'COLLABORATION_RECORDING', {}))
+    if config['ROOT'] is None:
+        config['ROOT'] = Path(settings.BASE_DIR) / 'recordings'
+    config['ROOT'] = Path(config['ROOT'])
+    return config
+
+
+def is_enabled(diagram_id, config=None):
+    """Whether traffic for a room should be recorded"""
+    config = config or get_config()
+    if not config['ENABLED']:
+        return False
+    return config['ROOMS'] is None or str(diagram_id) in {str(room) for room in config['ROOMS']}
+
+
+class RoomRecorder:
+    """Buffered, append-only event log for one room"""
+
+    def __init__(self, diagram_id, config, clock=time.monotonic, snapshot=None):
+        self.diagram_id = str(diagram_id)
+        self.config = config
+        self.clock = clock
+        started = datetime.now(timezone.utc)
+        name = f"{started.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:6]}.jsonl.gz"
+        self.path = config['ROOT'] / f"diagram_{self.diagram_id}" / name
+        self.started = clock()
+        self.connections = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        header = {
+            'format': LOG_FORMAT,
+            'diagram_id': self.diagram_id,
+            'started_at': started.isoformat(),
+        }
+        if snapshot is not None:
+            header['snapshot'] = snapshot
+        self.buffer = [json.dumps(header)]
+
+    def record(self, session_id, event, data=None):
+        """Append an event; ``data`` is the raw inbound message text. Never touches disk."""
+        entry = {'t': round(self.clock() - self.started, 6), 'session': session_id, 'event': event}
+        if data is not None:
+            entry['data'] = data
+        line = json.dumps(entry, separators=(',', ':'))
+        with self.lock:
+            self.buffer.append(line)
+            waiting = len(self.buffer)
+        if waiting >= self.config['FLUSH_RECORDS']:
+            _notify()
+
+    def flush(self):
+        """Write buffered events as one more gzip member"""
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+        if not lines:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self.path, 'at', encoding='utf-8') as handle:
+            handle.write('\n'.join(lines) + '\n')
+
+
+def _notify():
+    with _wake:
+        _wake.notify()
+
+
+def flush_all():
+    """Flush every buffered recording now and forget the closed ones"""
+    with _wake:
+        recorders = list(_recorders)
+    for recorder in recorders:
+        try:
+            recorder.flush()
+        except OSError:
+            logger.exception("Failed to write collaboration recording %s", recorder.path)
+        if recorder.closed:
+            with _wake:
+                _recorders.discard(recorder)
+
+
+def _write_loop(interval):
+    while True:
+        with _wake:
+            _wake.wait(interval)
+        flush_all()
+
+
+def _start_writer(config):
+    global _writer
+    with _wake:
+        if _writer is None:
+            _writer = threading.Thread(
+                target=_write_loop, args=(config['FLUSH_SECONDS'],),
+                name='collaboration-recorder', daemon=True
+            )
+            _writer.start()
+            atexit.register(flush_all)
+
+
+def open_room(diagram_id, snapshot=None):
+    """
+    Return the recorder for a room (creating it), or None when not recording.
+    ``snapshot`` is a callable returning the diagram's starting state; it is
+    only called when this connection starts a new recording, and may block.
+    """
+    config = get_config()
+    if not is_enabled(diagram_id, config):
+        return None
+    key = str(diagram_id)
+    with _wake:
+        recorder = _rooms.get(key)
+        if recorder is not None:
+            recorder.connections += 1
+            return recorder
+    recorder = RoomRecorder(diagram_id, config, snapshot=snapshot() if snapshot else None)
+    with _wake:
+        # Another connection may have started the room while we snapshotted
+        recorder = _rooms.setdefault(key, recorder)
+        recorder.connections += 1
+        _recorders.add(recorder)
+    _start_writer(config)
+    return recorder
+
+
+def release_room(recorder):
+    """Drop a connection's reference; the last one out closes the log and wakes the writer"""
+    with _wake:
+        recorder.connections -= 1
+        if recorder.connections > 0:
+            return
+        recorder.closed = True
+        if _rooms.get(recorder.diagram_id) is recorder:
+            del _rooms[recorder.diagram_id]
+        _wake.notify()
+
+
+def read_log(path):
+    """Return ``(header, events)`` from a recording"""
+    with gzip.open(path, 'rt', encoding='utf-8') as handle:
+        lines = [json.loads(line) for line in handle if line.strip()]
+    if not lines or lines[0].get('format') != LOG_FORMAT:
+        raise ValueError(f"{path} is not a collaboration recording")
+    return lines[0], lines[1:]
+
+
+def iter_log_paths(paths):
+    """Expand files and directories into recording paths"""
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(path.rglob('*.jsonl.gz'))
+        else:
+            yield path
+
+
+def load_recordings(paths):
+    """
+    Merge recordings into one timeline. Returns ``(events, snapshots)``:
+    events sorted by ``t`` (seconds since the earliest recording started),
+    each tagged with its recorded ``diagram_id``, and the starting snapshot
+    of each room from its earliest recording that has one.
+    """
+    logs = [read_log(path) for path in iter_log_paths(paths)]
+    if not logs:
+        return [], {}
+    starts = [datetime.fromisoformat(header['started_at']) for header, _ in logs]
+    origin = min(starts)
+    events = []
+    snapshots = {}
+    for (header, entries), started in sorted(zip(logs, starts), key=lambda log: log[1]):
+        if header.get('snapshot') is not None:
+            snapshots.setdefault(header['diagram_id'], header['snapshot'])
+        offset = (started - origin).total_seconds()
+        for entry in entries:
+            events.append(dict(entry, t=entry['t'] + offset, diagram_id=header['diagram_id']))
+    events.sort(key=lambda event: event['t'])
+    return events, snapshots
+
+
+def load_events(paths):
+    """Merged event timeline of recordings; see ``load_recordings``"""
+    return load_recordings(paths)[0]
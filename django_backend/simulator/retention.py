@@ -0,0 +1,284 @@
+"""
+Retention policy for version history and soft-deleted diagrams.
+
+Versions are thinned by age using ``DIAGRAM_RETENTION['TIERS']``: each tier
+covers versions up to ``max_age`` old and keeps at most one version per
+``interval`` bucket (every version when ``interval`` is None). Soft-deleted
+diagrams are purged once they have been inactive for ``PURGE_DELETED_AFTER``,
+and shared ``DiagramContent`` bodies are collected once nothing references
+them.
+
+All work happens in small chunks, each in its own short transaction, so the
+job can run alongside live traffic.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from .models import Diagram, DiagramContent, DiagramVersion
+
+
+DEFAULT_RETENTION = {
+    'TIERS': [
+        {'max_age': timedelta(hours=24), 'interval': None},
+        {'max_age': timedelta(days=7), 'interval': timedelta(hours=1)},
+        {'max_age': None, 'interval': timedelta(days=1)},
+    ],
+    'PURGE_DELETED_AFTER': timedelta(days=30),
+    'CHUNK_SIZE': 500,
+    'CHUNK_SLEEP': 0.0,
+}
+
+
+def get_config():
+    """Return retention configuration merged with defaults"""
+    config = dict(DEFAULT_RETENTION)
+    config.update(getattr(settings, 'DIAGRAM_RETENTION', {}))
+    return config
+
+
+def _tier_for(age, tiers):
+    for index, tier in enumerate(tiers):
+        if tier['max_age'] is None or age <= tier['max_age']:
+            return index, tier
+    return None, None
+
+
+def select_expired_versions(versions, now, tiers):
+    """
+    Given ``(pk, created_at)`` pairs for one diagram, return the pks that the
+    tiers no longer retain. The newest version in each bucket is kept.
+    """
+    kept_buckets = set()
+    expired = []
+    for pk, created_at in sorted(versions, key=lambda item: item[1], reverse=True):
+        index, tier = _tier_for(now - created_at, tiers)
+        if tier is None:
+            expired.append(pk)
+            continue
+        if tier['interval'] is None:
+            continue
+        bucket = (index, int(created_at.timestamp() // tier['interval'].total_seconds()))
+        if bucket in kept_buckets:
+            expired.append(pk)
+        else:
+            kept_buckets.add(bucket)
+    return expired
+
+
+def _body_bytes(queryset):
+    return queryset.aggregate(total=Sum(Length('diagram_json')))['total'] or 0
+
+
+def _count_freed_contents(version_pks, diagram_ids, removed, report):
+    """
+    Dry run: count the shared bodies whose last references are among the
+    versions and diagrams removed so far, as the real run would collect
+    them once they become orphans. ``removed`` accumulates across chunks.
+    """
+    removed['versions'].update(version_pks)
+    removed['diagrams'].update(diagram_ids)
+    candidates = set(
+        DiagramVersion.objects.filter(pk__in=version_pks, content__isnull=False).values_list('content_id', flat=True)
+    )
+    candidates.update(
+        Diagram.objects.filter(pk__in=diagram_ids, content__isnull=False).values_list('content_id', flat=True)
+    )
+    candidates -= removed['contents']
+    if not candidates:
+        return
+
+    # A body shared with anything that survives is not freed (yet)
+    live = {
+        content_id for content_id, pk in
+        DiagramVersion.objects.filter(content_id__in=candidates).values_list('content_id', 'pk')
+        if pk not in removed['versions']
+    }
+    live.update(
+        content_id for content_id, pk in
+        Diagram.objects.filter(content_id__in=candidates).values_list('content_id', 'pk')
+        if pk not in removed['diagrams']
+    )
+    freed = list(DiagramContent.objects.filter(pk__in=candidates - live).values_list('content_hash', 'size'))
+    removed['contents'].update(digest for digest, _ in freed)
+    report['contents_collected'] += len(freed)
+    report['content_bytes'] += sum(size for _, size in freed)
+
+
+def iter_expired_versions(diagrams, now, tiers, chunk_size):
+    """Yield lists of expired version pks, scanning ``diagrams`` in id order"""
+    pending = []
+    last_id = 0
+    while True:
+        diagram_ids = list(
+            diagrams.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not diagram_ids:
+            break
+        last_id = diagram_ids[-1]
+
+        by_diagram = {}
+        rows = DiagramVersion.objects.filter(diagram_id__in=diagram_ids).values_list('diagram_id', 'pk', 'created_at')
+        for diagram_id, pk, created_at in rows:
+            by_diagram.setdefault(diagram_id, []).append((pk, created_at))
+
+        for versions in by_diagram.values():
+            pending.extend(select_expired_versions(versions, now, tiers))
+            while len(pending) >= chunk_size:
+                yield pending[:chunk_size]
+                pending = pending[chunk_size:]
+    if pending:
+        yield pending
+
+
+def compact(dry_run=False, chunk_size=None, sleep=None, max_chunks=None, now=None, stdout=None):
+    """
+    Apply the retention policy and return a report of what was (or, with
+    ``dry_run``, would be) removed and how many body bytes that reclaims.
+    """
+    config = get_config()
+    chunk_size = max(chunk_size or config['CHUNK_SIZE'], 1)
+    sleep = config['CHUNK_SLEEP'] if sleep is None else sleep
+    now = now or timezone.now()
+    report = {
+        'dry_run': dry_run,
+        'versions_removed': 0,
+        'version_bytes': 0,
+        'diagrams_purged': 0,
+        'diagram_bytes': 0,
+        'contents_collected': 0,
+        'content_bytes': 0,
+        'chunks': 0,
+        'complete': True,
+    }
+
+    def budget_left():
+        if max_chunks is not None and report['chunks'] >= max_chunks:
+            report['complete'] = False
+            return False
+        return True
+
+    # Dry runs track what would already be gone to predict freed shared bodies
+    removed = {'versions': set(), 'diagrams': set(), 'contents': set()}
+
+    def pause():
+        report['chunks'] += 1
+        if sleep and not dry_run:
+            time.sleep(sleep)
+
+    grace = config['PURGE_DELETED_AFTER']
+    purgeable = Diagram.objects.none()
+    if grace is not None:
+        purgeable = Diagram.objects.filter(is_active=False, updated_at__lt=now - grace)
+
+    # Diagrams about to be purged are skipped here so nothing is counted twice
+    retained = Diagram.objects.exclude(pk__in=purgeable.values('pk'))
+    for chunk in iter_expired_versions(retained, now, config['TIERS'], chunk_size):
+        if not budget_left():
+            break
+        versions = DiagramVersion.objects.filter(pk__in=chunk)
+        report['version_bytes'] += _body_bytes(versions)
+        if dry_run:
+            report['versions_removed'] += len(chunk)
+            _count_freed_contents(chunk, [], removed, report)
+        else:
+            with transaction.atomic():
+                report['versions_removed'] += versions.delete()[1].get(DiagramVersion._meta.label, 0)
+        pause()
+
+    if grace is not None and budget_left():
+        last_id = 0
+        while budget_left():
+            doomed = list(
+                purgeable.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not doomed:
+                break
+            last_id = doomed[-1]
+            for diagram_id in doomed:
+                if not budget_left():
+                    break
+                purged = _purge_diagram(diagram_id, chunk_size, dry_run, report, removed)
+                if not purged:
+                    continue
+                report['diagrams_purged'] += 1
+                pause()
+
+    if budget_left():
+        collect_unreferenced_content(chunk_size, dry_run, report, budget_left, pause)
+
+    if stdout:
+        stdout.write(format_report(report))
+    return report
+
+
+def collect_unreferenced_content(chunk_size, dry_run, report, budget_left, pause):
+    """Delete shared bodies no longer referenced by any diagram or version"""
+    orphans = DiagramContent.objects.filter(diagrams__isnull=True, versions__isnull=True)
+    last_hash = ''
+    while budget_left():
+        chunk = list(
+            orphans.filter(content_hash__gt=last_hash).order_by('content_hash')
+            .values_list('content_hash', 'size')[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_hash = chunk[-1][0]
+        if dry_run:
+            report['contents_collected'] += len(chunk)
+            report['content_bytes'] += sum(size for _, size in chunk)
+        else:
+            with transaction.atomic():
+                # Re-apply the orphan filter so rows referenced meanwhile survive
+                doomed = orphans.filter(content_hash__in=[digest for digest, _ in chunk])
+                freed = list(doomed.values_list('size', flat=True))
+                doomed.delete()
+            report['contents_collected'] += len(freed)
+            report['content_bytes'] += sum(freed)
+        pause()
+
+
+def _purge_diagram(diagram_id, chunk_size, dry_run, report, removed):
+    diagram = Diagram.objects.filter(pk=diagram_id)
+    versions = DiagramVersion.objects.filter(diagram_id=diagram_id)
+    report['diagram_bytes'] += _body_bytes(diagram) + _body_bytes(versions)
+    if dry_run:
+        version_pks = list(versions.values_list('pk', flat=True))
+        report['versions_removed'] += len(version_pks)
+        _count_freed_contents(version_pks, [diagram_id], removed, report)
+        return True
+
+    # Drain history in chunks so the final cascade delete stays small,
+    # re-checking each time in case the diagram was reactivated meanwhile
+    still_deleted = Diagram.objects.filter(pk=diagram_id, is_active=False)
+    while True:
+        with transaction.atomic():
+            if not still_deleted.exists():
+                return False
+            pks = list(versions.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                deleted, _ = still_deleted.delete()
+                return bool(deleted)
+            report['versions_removed'] += DiagramVersion.objects.filter(pk__in=pks).delete()[1].get(
+                DiagramVersion._meta.label, 0
+            )
+
+
+def format_report(report):
+    """Return a human readable summary of a compaction report"""
+    prefix = 'Would remove' if report['dry_run'] else 'Removed'
+    total = report['version_bytes'] + report['diagram_bytes'] + report['content_bytes']
+    lines = [
+        f"{prefix} {report['versions_removed']} version(s), {report['diagrams_purged']} deleted diagram(s) "
+        f"and {report['contents_collected']} unreferenced shared bodies",
+        f"Reclaimable body bytes: {total} (versions {report['version_bytes']}, "
+        f"purged diagrams {report['diagram_bytes']}, shared bodies {report['content_bytes']})",
+        f"Chunks processed: {report['chunks']}{'' if report['complete'] else ' (stopped early; run again to continue)'}",
+    ]
+    return '\n'.join(lines)
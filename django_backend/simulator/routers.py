@@ -0,0 +1,192 @@
+"""
+Read-replica routing for diagram reads.
+
+Views decorated with ``read_from_replica`` (load, history, export) send
+their queries for the configured apps to a randomly chosen replica alias;
+every write and every other read goes to the primary. Two mechanisms give
+read-your-writes consistency while replicas catch up:
+
+* ``ReplicaPinMiddleware`` sets a short-lived cookie on responses to
+  requests that wrote to the database, and pinned clients read from the
+  primary until it expires.
+* Every diagram save pins that diagram (in the diagram cache) for the same
+  window, covering writes that did not come through HTTP, such as
+  WebSocket persists.
+
+A replica that still returns 404 for a diagram is retried on the primary.
+"""
+
+import contextvars
+import functools
+import math
+import random
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from . import cache as diagram_cache
+
+
+PRIMARY = 'default'
+
+DEFAULT_CONFIG = {
+    'REPLICAS': [],
+    # Only these apps' models are read from replicas; auth and sessions
+    # always come from the primary
+    'APPS': ['simulator'],
+    'STICKY_SECONDS': 5.0,
+    'COOKIE_NAME': 'diagram_db_pin',
+    'RETRY_NOT_FOUND': True,
+}
+
+_routing_state = contextvars.ContextVar('diagram_routing_state', default=None)
+_request_state = contextvars.ContextVar('diagram_request_state', default=None)
+
+
+def get_config():
+    """Return replica routing configuration merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'DIAGRAM_DB_ROUTING', {}))
+    return config
+
+
+def get_replicas():
+    """Replica aliases that are configured in DATABASES"""
+    return [alias for alias in get_config()['REPLICAS'] if alias in settings.DATABASES and alias != PRIMARY]
+
+
+def _pin_key(diagram_id):
+    return f"{diagram_cache.get_config()['KEY_PREFIX']}:pin:{diagram_id}"
+
+
+def pin_diagram(diagram_id):
+    """Serve a diagram from the primary for the sticky window after a write"""
+    config = get_config()
+    if config['STICKY_SECONDS'] > 0 and get_replicas():
+        diagram_cache.get_cache().set(_pin_key(diagram_id), True, config['STICKY_SECONDS'])
+
+
+def is_diagram_pinned(diagram_id):
+    return bool(diagram_cache.get_cache().get(_pin_key(diagram_id)))
+
+
+def select_replica(request, diagram_id=None):
+    """Return the replica alias a read should use, or None for the primary"""
+    replicas = get_replicas()
+    if not replicas:
+        return None
+    if get_config()['COOKIE_NAME'] in request.COOKIES:
+        return None
+    if diagram_id is not None and is_diagram_pinned(diagram_id):
+        return None
+    return random.choice(replicas)
+
+
+class ReplicaRouter:
+    """Send writes to the primary and reads to the replica chosen for the current view"""
+
+    def db_for_read(self, model, **hints):
+        routing = _routing_state.get()
+        if routing and routing['alias'] and model._meta.app_label in get_config()['APPS']:
+            return routing['alias']
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        routing = _routing_state.get()
+        if routing is not None:
+            # A view that writes (e.g. rehydrating an archived diagram)
+            # must read its own writes for the rest of the request
+            routing['alias'] = None
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows, so objects may be related across them
+        pool = {PRIMARY, *get_replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive their schema from the primary
+        if db in get_replicas():
+            return False
+        return None
+
+
+def _should_retry(response):
+    return get_config()['RETRY_NOT_FOUND'] and getattr(response, 'status_code', None) == 404
+
+
+def read_from_replica(view):
+    """Run a read-only view against a replica unless the client or diagram is pinned"""
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            alias = select_replica(request, kwargs.get('diagram_id'))
+            if alias is None:
+                return await view(request, *args, **kwargs)
+            token = _routing_state.set({'alias': alias})
+            try:
+                response = await view(request, *args, **kwargs)
+            finally:
+                _routing_state.reset(token)
+            # The replica may not have caught up with a new diagram yet
+            if _should_retry(response):
+                response = await view(request, *args, **kwargs)
+            return response
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = select_replica(request, kwargs.get('diagram_id'))
+        if alias is None:
+            return view(request, *args, **kwargs)
+        token = _routing_state.set({'alias': alias})
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _routing_state.reset(token)
+        if _should_retry(response):
+            response = view(request, *args, **kwargs)
+        return response
+    return wrapper
+
+
+def _pin_client(response, state):
+    config = get_config()
+    if state['wrote'] and config['STICKY_SECONDS'] > 0 and get_replicas():
+        response.set_cookie(
+            config['COOKIE_NAME'], '1',
+            max_age=math.ceil(config['STICKY_SECONDS']),
+            httponly=True,
+            samesite='Lax'
+        )
+    return response
+
+
+@sync_and_async_middleware
+def ReplicaPinMiddleware(get_response):
+    """Pin clients to the primary for a short window after a request that wrote"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            state = {'wrote': False}
+            token = _request_state.set(state)
+            try:
+                response = await get_response(request)
+            finally:
+                _request_state.reset(token)
+            return _pin_client(response, state)
+    else:
+        def middleware(request):
+            state = {'wrote': False}
+            token = _request_state.set(state)
+            try:
+                response = get_response(request)
+            finally:
+                _request_state.reset(token)
+            return _pin_client(response, state)
+    return middleware
@@ -0,0 +1,242 @@
+"""
+Full-text search over diagram titles and shape/connection labels.
+
+Every persisted diagram gets a ``DiagramSearchDocument`` row holding its
+title and extracted label text. Ranking is delegated to the database:
+SQLite mirrors the documents into an FTS5 table, PostgreSQL uses a GIN
+index over a weighted ``tsvector`` expression, and any other backend falls
+back to substring matching.
+"""
+
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Diagram, DiagramElement, DiagramSearchDocument
+
+
+# Element fields whose string values are indexed
+TEXT_KEYS = ('label', 'text', 'name', 'title', 'description')
+MAX_DEPTH = 4
+FTS_TABLE = 'simulator_diagram_fts'
+PG_INDEX = 'simulator_search_tsv_idx'
+PG_VECTOR = (
+    "setweight(to_tsvector('simple', {table}.title), 'A') || "
+    "setweight(to_tsvector('simple', {table}.content), 'B')"
+)
+
+_prepared = set()
+
+
+def _collect_text(value, out, depth=0):
+    if depth > MAX_DEPTH:
+        return
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in TEXT_KEYS and isinstance(item, str):
+                out.append(item)
+            elif isinstance(item, (dict, list)):
+                _collect_text(item, out, depth + 1)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_text(item, out, depth + 1)
+
+
+def extract_text(document):
+    """Return the searchable label text of a diagram document"""
+    out = []
+    if isinstance(document, dict):
+        for key in DiagramElement.KIND_KEYS.values():
+            _collect_text(document.get(key) or [], out)
+    return ' '.join(out)
+
+
+def tokenize(query):
+    """Split a user query into safe search terms"""
+    return re.findall(r'\w+', query or '', flags=re.UNICODE)[:16]
+
+
+def get_backend():
+    """Return the name of the search backend for the default database"""
+    if connection.vendor == 'sqlite':
+        return 'fts5' if ensure_index() else 'like'
+    if connection.vendor == 'postgresql':
+        ensure_index()
+        return 'tsvector'
+    return 'like'
+
+
+def ensure_index():
+    """Create backend-specific index structures, returning False if unavailable"""
+    key = (connection.alias, connection.vendor)
+    if key in _prepared:
+        return True
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                    f"USING fts5(title, content, tokenize='unicode61 remove_diacritics 2')"
+                )
+            elif connection.vendor == 'postgresql':
+                table = DiagramSearchDocument._meta.db_table
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON {table} "
+                    f"USING gin (({PG_VECTOR.format(table=table)}))"
+                )
+    except Exception:
+        return False
+    # DDL inside a transaction is undone by a rollback, so only remember it outside one
+    if not connection.in_atomic_block:
+        _prepared.add(key)
+    return True
+
+
+def index_diagram(diagram):
+    """Refresh the search document for one diagram"""
+    text = extract_text(diagram.load_diagram_data())
+    DiagramSearchDocument.objects.update_or_create(
+        diagram_id=diagram.pk,
+        defaults={'title': diagram.title, 'content': text, 'indexed_version': diagram.version}
+    )
+    if get_backend() == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [diagram.pk])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)",
+                [diagram.pk, diagram.title, text]
+            )
+
+
+def index_diagram_by_id(diagram_id):
+    """Refresh the search document for a diagram id, ignoring missing rows"""
+    try:
+        diagram = Diagram.objects.get(pk=diagram_id)
+    except Diagram.DoesNotExist:
+        remove_diagram(diagram_id)
+        return
+    index_diagram(diagram)
+
+
+def schedule_index(diagram):
+    """Re-index a diagram once the current transaction commits"""
+    diagram_id = diagram.pk
+    transaction.on_commit(lambda: index_diagram_by_id(diagram_id))
+
+
+def remove_diagram(diagram_id):
+    """Drop a diagram from the search index"""
+    DiagramSearchDocument.objects.filter(diagram_id=diagram_id).delete()
+    if get_backend() == 'fts5':
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [diagram_id])
+
+
+def rebuild(batch_size=200, stdout=None):
+    """Rebuild the search index from scratch, returning the number of diagrams indexed"""
+    backend = get_backend()
+    with transaction.atomic():
+        DiagramSearchDocument.objects.all().delete()
+        if backend == 'fts5':
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    indexed = 0
+    last_id = 0
+    while True:
+        batch = list(Diagram.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            for diagram in batch:
+                index_diagram(diagram)
+                last_id = diagram.id
+        indexed += len(batch)
+        if stdout:
+            stdout.write(f"Indexed {indexed} diagram(s)")
+    return indexed
+
+
+def search(query, user=None, page=1, page_size=20):
+    """
+    Return ``(total, results)`` for a ranked search over active diagrams.
+    Each result is a dict with ``id``, ``title``, ``version``,
+    ``updated_at`` and ``rank`` (higher is better).
+    """
+    terms = tokenize(query)
+    if not terms:
+        return 0, []
+
+    backend = get_backend()
+    offset = (page - 1) * page_size
+    diagrams = Diagram._meta.db_table
+    user_clause, user_params = '', []
+    if user is not None:
+        user_clause = 'AND d.user_id = %s'
+        user_params = [user.pk]
+
+    if backend == 'fts5':
+        match = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        base = (
+            f"FROM {FTS_TABLE} JOIN {diagrams} d ON d.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND d.is_active = %s {user_clause}"
+        )
+        params = [match, True] + user_params
+        rank = f"-bm25({FTS_TABLE}, 10.0, 1.0)"
+        rank_params = []
+    elif backend == 'tsvector':
+        table = DiagramSearchDocument._meta.db_table
+        vector = PG_VECTOR.format(table='s')
+        tsquery = ' & '.join(f"{term}:*" for term in terms)
+        base = (
+            f"FROM {table} s JOIN {diagrams} d ON d.id = s.diagram_id "
+            f"WHERE ({vector}) @@ to_tsquery('simple', %s) AND d.is_active = %s {user_clause}"
+        )
+        params = [tsquery, True] + user_params
+        rank = f"ts_rank({vector}, to_tsquery('simple', %s))"
+        rank_params = [tsquery]
+    else:
+        return _search_like(terms, user, offset, page_size)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) {base}", params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT d.id, {rank} AS score {base} ORDER BY score DESC, d.updated_at DESC LIMIT %s OFFSET %s",
+            rank_params + params + [page_size, offset]
+        )
+        ranked = cursor.fetchall()
+
+    return total, _hydrate(ranked)
+
+
+def _search_like(terms, user, offset, limit):
+    documents = DiagramSearchDocument.objects.filter(diagram__is_active=True)
+    if user is not None:
+        documents = documents.filter(diagram__user=user)
+    for term in terms:
+        documents = documents.filter(Q(title__icontains=term) | Q(content__icontains=term))
+    total = documents.count()
+    ranked = [
+        (diagram_id, 0.0)
+        for diagram_id in documents.order_by('-diagram__updated_at').values_list('diagram_id', flat=True)[offset:offset + limit]
+    ]
+    return total, _hydrate(ranked)
+
+
+def _hydrate(ranked):
+    diagrams = Diagram.objects.defer('diagram_json').in_bulk([diagram_id for diagram_id, _ in ranked])
+    results = []
+    for diagram_id, score in ranked:
+        diagram = diagrams.get(diagram_id)
+        if diagram is None:
+            continue
+        results.append({
+            'id': diagram.id,
+            'title': diagram.title,
+            'version': diagram.version,
+            'updated_at': diagram.updated_at,
+            'rank': round(float(score or 0.0), 6)
+        })
+    return results
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Diagram, DiagramContent
+from . import cache
+from . import bodystore
+from . import search
+from . import routers
+
+
+@receiver(post_save, sender=Diagram)
+def invalidate_diagram_cache(sender, instance, **kwargs):
+    """Drop the cached body a save replaced, refresh search and pin reads to the primary"""
+    stored = cache.stored_key(instance)
+    cache.remember_stored(instance)
+    # Saves that leave the body alone (title, flags) keep their entry
+    if stored and stored != cache.stored_key(instance):
+        transaction.on_commit(lambda: cache.invalidate(*stored))
+    search.schedule_index(instance)
+    routers.pin_diagram(instance.pk)
+
+
+@receiver(post_delete, sender=Diagram)
+def drop_diagram_cache(sender, instance, **kwargs):
+    """Drop cached bodies and search entries when a diagram is removed"""
+    cache.invalidate(instance.pk, instance.version, cache.content_token(instance))
+    search.remove_diagram(instance.pk)
+
+
+@receiver(post_delete, sender=DiagramContent)
+def delete_stored_body(sender, instance, **kwargs):
+    """Remove externally stored bodies once their row is gone"""
+    if instance.external:
+        digest = instance.content_hash
+        transaction.on_commit(lambda: _delete_if_unreferenced(digest))
+
+
+def _delete_if_unreferenced(digest):
+    # A concurrent save may have re-created the row for the same content
+    if not DiagramContent.objects.filter(content_hash=digest).exists():
+        bodystore.delete(digest)
+
+
+SQLITE_SYNCHRONOUS_LEVELS = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply DIAGRAM_SQLITE pragmas to new SQLite connections"""
+    if connection.vendor != 'sqlite':
+        return
+    config = getattr(settings, 'DIAGRAM_SQLITE', {})
+    with connection.cursor() as cursor:
+        if config.get('WAL'):
+            cursor.execute('PRAGMA journal_mode=WAL')
+        if config.get('BUSY_TIMEOUT_MS') is not None:
+            cursor.execute(f"PRAGMA busy_timeout={int(config['BUSY_TIMEOUT_MS'])}")
+        level = str(config.get('SYNCHRONOUS', '')).upper()
+        if level in SQLITE_SYNCHRONOUS_LEVELS:
+            cursor.execute(f'PRAGMA synchronous={level}')
@@ -0,0 +1,358 @@
+"""
+Diagram body persistence for both storage modes.
+
+Blob diagrams keep the whole document in ``Diagram.diagram_json``.
+Normalized diagrams keep everything except ``shapes`` and ``connections``
+there, and store each element as a ``DiagramElement`` row so a single
+element can be read or written without touching the rest of the document.
+"""
+
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Diagram, DiagramContent, DiagramElement, DiagramVersion
+from . import cache as diagram_cache
+from . import bodystore
+from . import search
+from . import thumbnails
+
+
+class DuplicateElementError(ValueError):
+    """Raised when a normalized document repeats an element id within a kind"""
+
+    def __init__(self, duplicates):
+        self.duplicates = duplicates
+        listed = ', '.join(f"{kind}/{element_id}" for kind, element_id in duplicates)
+        super().__init__(f"Duplicate element ids: {listed}")
+
+
+def coerce_document(document):
+    """Return a diagram document as a dictionary"""
+    if isinstance(document, dict):
+        return document
+    return diagram_cache.parse_diagram_json(document)
+
+
+def content_hash(document):
+    """
+    Return the SHA-256 of a document's canonical JSON form, so bodies that
+    differ only in key order or whitespace hash the same.
+    """
+    if not isinstance(document, dict):
+        parsed = diagram_cache.parse_diagram_json(document)
+        if parsed == {} and (document or '').strip() not in ('', '{}'):
+            # Unparseable text is hashed verbatim rather than as an empty document
+            return hashlib.sha256((document or '').encode('utf-8')).hexdigest()
+        document = parsed
+    canonical = json.dumps(document, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def get_dedup_min_bytes():
+    """Bodies at least this large are stored once in DiagramContent; None disables sharing"""
+    config = getattr(settings, 'DIAGRAM_DEDUP', {})
+    if not config.get('ENABLED', True):
+        return None
+    return config.get('MIN_BYTES', 1024)
+
+
+def store_body(text, digest):
+    """
+    Return ``(inline_text, content)`` for a body: large bodies are stored
+    once per hash and referenced, small ones stay inline. The largest go
+    to the external file store when it is enabled.
+    """
+    min_bytes = get_dedup_min_bytes()
+    external = bodystore.should_store(text)
+    if not external and (min_bytes is None or len(text) < min_bytes):
+        return text, None
+    content = DiagramContent.objects.filter(content_hash=digest).first()
+    if content is None:
+        if external:
+            bodystore.write(digest, text)
+        content, _ = DiagramContent.objects.get_or_create(
+            content_hash=digest,
+            defaults={'body': '' if external else text, 'size': len(text), 'external': external}
+        )
+    return '', content
+
+
+def is_unchanged(diagram, digest, title=None):
+    """Whether saving ``digest`` (and ``title``) would leave the diagram as it is"""
+    if not diagram.content_hash or diagram.content_hash != digest:
+        return False
+    return title is None or title == diagram.title
+
+
+def snapshot_version(diagram, comment):
+    """
+    Record the diagram's current body as a DiagramVersion, reusing its
+    shared content row when it has one instead of copying the text.
+    """
+    if diagram.content_id and not diagram.is_normalized:
+        inline, content = '', diagram.content
+        digest = diagram.content_hash
+    else:
+        text = diagram.get_document_json()
+        digest = diagram.content_hash or content_hash(text)
+        inline, content = store_body(text, digest)
+    return DiagramVersion.objects.create(
+        diagram=diagram,
+        version_number=diagram.version,
+        diagram_json=inline,
+        content=content,
+        content_hash=digest,
+        comment=comment
+    )
+
+
+def element_id_for(kind, element, index):
+    """Return the stable id for an element, falling back to its position"""
+    element_id = element.get('id') if isinstance(element, dict) else None
+    if element_id in (None, ''):
+        return f"{kind}-{index}"
+    return str(element_id)
+
+
+def element_type_for(element):
+    """Return the indexed type of an element"""
+    if isinstance(element, dict):
+        return str(element.get('type') or '')[:100]
+    return ''
+
+
+def split_document(document):
+    """Split a document into its skeleton and per-kind element lists"""
+    skeleton = dict(document)
+    elements = {}
+    for kind, key in DiagramElement.KIND_KEYS.items():
+        elements[kind] = skeleton.pop(key, None) or []
+    return skeleton, elements
+
+
+def invalidate_on_commit(diagram):
+    """
+    Drop the cached body a diagram's row held when loaded once the current
+    transaction commits. For writes that bypass Diagram.save(); saves are
+    handled by the post_save signal.
+    """
+    stored = diagram_cache.stored_key(diagram)
+    if stored:
+        transaction.on_commit(lambda: diagram_cache.invalidate(*stored))
+    diagram_cache.remember_stored(diagram)
+
+
+def find_duplicate_ids(elements):
+    """Return ``(kind, element_id)`` pairs that occur more than once, in order"""
+    seen, duplicates = set(), []
+    for kind, items in elements.items():
+        for position, element in enumerate(items):
+            key = (kind, element_id_for(kind, element, position))
+            if key in seen and key not in duplicates:
+                duplicates.append(key)
+            seen.add(key)
+    return duplicates
+
+
+def sync_elements(diagram, elements):
+    """
+    Bring a diagram's element rows in line with ``elements``, writing only
+    rows that were added, changed or removed. Raises DuplicateElementError
+    rather than dropping elements that share an id.
+    """
+    duplicates = find_duplicate_ids(elements)
+    if duplicates:
+        raise DuplicateElementError(duplicates)
+    existing = {
+        (row.kind, row.element_id): row
+        for row in DiagramElement.objects.filter(diagram=diagram)
+    }
+    to_create, to_update, seen = [], [], set()
+
+    for kind, items in elements.items():
+        for position, element in enumerate(items):
+            key = (kind, element_id_for(kind, element, position))
+            seen.add(key)
+            element_type = element_type_for(element)
+            row = existing.get(key)
+            if row is None:
+                to_create.append(DiagramElement(
+                    diagram=diagram,
+                    kind=kind,
+                    element_id=key[1],
+                    element_type=element_type,
+                    position=position,
+                    data=element
+                ))
+            elif row.data != element or row.position != position or row.element_type != element_type:
+                row.data = element
+                row.position = position
+                row.element_type = element_type
+                row.updated_at = timezone.now()
+                to_update.append(row)
+
+    stale = [row.pk for key, row in existing.items() if key not in seen]
+    if stale:
+        DiagramElement.objects.filter(pk__in=stale).delete()
+    if to_update:
+        DiagramElement.objects.bulk_update(
+            to_update, ['data', 'position', 'element_type', 'updated_at'], batch_size=500
+        )
+    if to_create:
+        DiagramElement.objects.bulk_create(to_create, batch_size=500)
+
+    return {'created': len(to_create), 'updated': len(to_update), 'deleted': len(stale)}
+
+
+def save_document(diagram, document, digest=None):
+    """
+    Persist a full diagram document (dict or JSON text) along with any
+    pending field changes on ``diagram``. ``digest`` may be passed when the
+    caller already computed the content hash. Normalized documents that
+    repeat an element id raise DuplicateElementError before anything is
+    written.
+    """
+    digest = digest or content_hash(document)
+    if diagram.is_normalized:
+        skeleton, elements = split_document(coerce_document(document))
+        duplicates = find_duplicate_ids(elements)
+        if duplicates:
+            raise DuplicateElementError(duplicates)
+    with transaction.atomic():
+        diagram.content_hash = digest
+        if diagram.is_normalized:
+            diagram.diagram_json = json.dumps(skeleton)
+            diagram.content = None
+            diagram.save()
+            sync_elements(diagram, elements)
+        else:
+            text = json.dumps(document) if isinstance(document, dict) else document
+            diagram.diagram_json, diagram.content = store_body(text, digest)
+            diagram.save()
+    return diagram
+
+
+def touch_diagram(diagram):
+    """Mark a diagram as modified without rewriting its body"""
+    diagram.updated_at = timezone.now()
+    # The body changed outside save_document, so the stored hash is stale
+    diagram.content_hash = ''
+    Diagram.objects.filter(pk=diagram.pk).update(updated_at=diagram.updated_at, content_hash='')
+    invalidate_on_commit(diagram)
+    search.schedule_index(diagram)
+    thumbnails.schedule(diagram)
+
+
+def get_elements(diagram, kind=None, element_type=None, element_ids=None):
+    """Return element dictionaries filtered by kind, type and/or ids"""
+    if diagram.is_normalized:
+        rows = DiagramElement.objects.filter(diagram=diagram)
+        if kind:
+            rows = rows.filter(kind=kind)
+        if element_type:
+            rows = rows.filter(element_type=element_type)
+        if element_ids:
+            rows = rows.filter(element_id__in=element_ids)
+        return [
+            {'kind': row_kind, 'id': row_id, 'data': data}
+            for row_kind, row_id, data in rows.order_by('kind', 'position').values_list('kind', 'element_id', 'data')
+        ]
+
+    data = coerce_document(diagram.get_diagram_data())
+    results = []
+    for row_kind, key in DiagramElement.KIND_KEYS.items():
+        if kind and row_kind != kind:
+            continue
+        for position, element in enumerate(data.get(key) or []):
+            row_id = element_id_for(row_kind, element, position)
+            if element_type and element_type_for(element) != element_type:
+                continue
+            if element_ids and row_id not in element_ids:
+                continue
+            results.append({'kind': row_kind, 'id': row_id, 'data': element})
+    return results
+
+
+def put_element(diagram, kind, element_id, element):
+    """
+    Create or replace a single element. Normalized diagrams write one row;
+    blob diagrams fall back to rewriting the document.
+    """
+    if isinstance(element, dict) and 'id' not in element:
+        element = dict(element, id=element_id)
+
+    if diagram.is_normalized:
+        with transaction.atomic():
+            row = DiagramElement.objects.filter(diagram=diagram, kind=kind, element_id=element_id).first()
+            if row is None:
+                last = DiagramElement.objects.filter(diagram=diagram, kind=kind).aggregate(Max('position'))
+                DiagramElement.objects.create(
+                    diagram=diagram,
+                    kind=kind,
+                    element_id=element_id,
+                    element_type=element_type_for(element),
+                    position=(last['position__max'] if last['position__max'] is not None else -1) + 1,
+                    data=element
+                )
+            else:
+                row.data = element
+                row.element_type = element_type_for(element)
+                row.save(update_fields=['data', 'element_type', 'updated_at'])
+            touch_diagram(diagram)
+        return element
+
+    document = dict(coerce_document(diagram.get_diagram_data()))
+    key = DiagramElement.KIND_KEYS[kind]
+    items = list(document.get(key) or [])
+    for position, existing in enumerate(items):
+        if element_id_for(kind, existing, position) == element_id:
+            items[position] = element
+            break
+    else:
+        items.append(element)
+    document[key] = items
+    save_document(diagram, document)
+    return element
+
+
+def delete_element(diagram, kind, element_id):
+    """Remove a single element, returning whether it existed"""
+    if diagram.is_normalized:
+        with transaction.atomic():
+            deleted, _ = DiagramElement.objects.filter(
+                diagram=diagram, kind=kind, element_id=element_id
+            ).delete()
+            if deleted:
+                touch_diagram(diagram)
+        return bool(deleted)
+
+    document = dict(coerce_document(diagram.get_diagram_data()))
+    key = DiagramElement.KIND_KEYS[kind]
+    items = list(document.get(key) or [])
+    remaining = [
+        element for position, element in enumerate(items)
+        if element_id_for(kind, element, position) != element_id
+    ]
+    if len(remaining) == len(items):
+        return False
+    document[key] = remaining
+    save_document(diagram, document)
+    return True
+
+
+def convert_storage(diagram, storage_mode):
+    """Switch a diagram between blob and normalized storage in place"""
+    if diagram.storage_mode == storage_mode:
+        return False
+    with transaction.atomic():
+        document = coerce_document(diagram.load_diagram_data())
+        diagram.storage_mode = storage_mode
+        if storage_mode == Diagram.STORAGE_BLOB:
+            DiagramElement.objects.filter(diagram=diagram).delete()
+        save_document(diagram, document)
+    return True
@@ -0,0 +1,528 @@
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from channels.testing import WebsocketCommunicator
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from diagram_simulator.asgi import application
+from simulator.models import Diagram, DiagramArchive, DiagramContent, DiagramVersion
+from simulator import archive, backpressure, bodystore, cache, layout, recorder, retention, storage
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_queue(**overrides):
+    config = dict(backpressure.DEFAULT_CONFIG, **overrides)
+    clock = FakeClock()
+    return backpressure.OutboundQueue(config=config, clock=clock), clock
+
+
+async def drain(queue):
+    """Frames get() hands out without waiting"""
+    frames = []
+    while True:
+        try:
+            frames.append(await asyncio.wait_for(queue.get(), 0.01))
+        except asyncio.TimeoutError:
+            return frames
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """Coalescing, shedding and lag detection of the per-connection queue"""
+
+    async def test_keyed_frame_replaces_queued_frame_in_place(self):
+        queue, _ = make_queue()
+        queue.put('{"n": "a1"}', key='a')
+        queue.put('{"n": "b"}')
+        queue.put('{"n": "a2"}', key='a')
+        self.assertEqual([text for _, text in await drain(queue)], ['{"n": "a2"}', '{"n": "b"}'])
+        self.assertEqual(queue.stats['coalesced'], 1)
+        self.assertEqual(queue.pending_bytes, 0)
+
+    def test_unkeyed_frames_are_never_coalesced(self):
+        queue, _ = make_queue()
+        for n in range(3):
+            queue.put(f'{{"n": {n}}}')
+        self.assertEqual(len(queue), 3)
+
+    async def test_over_limit_sheds_state_frames_and_requests_resync(self):
+        queue, _ = make_queue(MAX_FRAMES=3)
+        queue.put('{"chat": 1}')
+        queue.put('{"cursor": 1}', key='cursor-1')
+        queue.put('{"cursor": 2}', key='cursor-2')
+        self.assertEqual(queue.put('{"cursor": 3}', key='cursor-3'), backpressure.RESYNC)
+        # Chat messages carry no state a snapshot could restore, so they stay
+        self.assertEqual([text for _, text in await drain(queue)], ['{"chat": 1}'])
+        self.assertEqual(queue.stats['dropped'], 3)
+
+    def test_repeated_resyncs_disconnect(self):
+        queue, clock = make_queue(MAX_FRAMES=1, MAX_RESYNCS=2)
+        outcomes = []
+        for n in range(3):
+            clock.now += 1
+            queue.put('{"s": 1}', key=('first', n))
+            outcomes.append(queue.put('{"s": 2}', key=('second', n)))
+        self.assertEqual(outcomes, [backpressure.RESYNC, backpressure.RESYNC, backpressure.DISCONNECT])
+
+    def test_resyncs_outside_window_are_forgotten(self):
+        queue, clock = make_queue(MAX_FRAMES=1, MAX_RESYNCS=1, RESYNC_WINDOW_SECONDS=60.0)
+        queue.put('{"s": 1}', key='first')
+        self.assertEqual(queue.put('{"s": 2}', key='second'), backpressure.RESYNC)
+        clock.now = 61.0
+        queue.put('{"s": 1}', key='first')
+        self.assertEqual(queue.put('{"s": 2}', key='second'), backpressure.RESYNC)
+
+    def test_lag_threshold_disconnects_on_next_put(self):
+        queue, clock = make_queue(MAX_LAG_SECONDS=10.0)
+        self.assertEqual(queue.put('{"n": 1}'), backpressure.QUEUED)
+        clock.now = 10.0
+        self.assertFalse(queue.stalled())
+        self.assertEqual(queue.put('{"n": 2}'), backpressure.QUEUED)
+        clock.now = 10.5
+        self.assertTrue(queue.stalled())
+        self.assertEqual(queue.put('{"n": 3}'), backpressure.DISCONNECT)
+
+    async def test_ack_window_holds_frames_until_acknowledged(self):
+        queue, clock = make_queue(WINDOW_FRAMES=2, MAX_LAG_SECONDS=5.0)
+        for n in range(4):
+            queue.put(f'{{"n": {n}}}')
+        self.assertEqual([seq for seq, _ in await drain(queue)], [1, 2])
+        self.assertEqual((len(queue), queue.inflight), (2, 2))
+
+        # An unacknowledged frame counts as lag even with nothing new queued
+        clock.now = 6.0
+        self.assertTrue(queue.stalled())
+        queue.ack(1)
+        self.assertEqual([seq for seq, _ in await drain(queue)], [3])
+        queue.ack(3)
+        self.assertEqual([seq for seq, _ in await drain(queue)], [4])
+
+    async def test_window_is_enforced_before_the_first_ack(self):
+        queue, clock = make_queue(WINDOW_FRAMES=2, MAX_LAG_SECONDS=5.0)
+        for n in range(3):
+            queue.put(f'{{"n": {n}}}')
+        self.assertEqual(len(await drain(queue)), 2)
+        # A client that never acks is detected without anything new being queued
+        clock.now = 6.0
+        self.assertTrue(queue.stalled())
+
+    async def test_legacy_mode_windows_clients_once_they_ack(self):
+        queue, _ = make_queue(REQUIRE_ACKS=False, WINDOW_FRAMES=1)
+        for n in range(3):
+            queue.put(f'{{"n": {n}}}')
+        self.assertEqual(len(await drain(queue)), 3)
+        self.assertEqual(queue.inflight, 0)
+        queue.ack(3)
+        queue.put('{"n": 4}')
+        queue.put('{"n": 5}')
+        self.assertEqual(len(await drain(queue)), 1)
+
+    def test_stamp_adds_sequence_number(self):
+        self.assertEqual(json.loads(backpressure.stamp('{"type": "x"}', 7)), {'seq': 7, 'type': 'x'})
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    WEBSOCKET_BACKPRESSURE=dict(backpressure.DEFAULT_CONFIG, WINDOW_FRAMES=1)
+)
+class ConsumerCoalescingTests(TransactionTestCase):
+    """Diagram updates queued behind a slow (non-acking) peer"""
+
+    async def receive_frames(self, client, count):
+        frames = []
+        for _ in range(count):
+            frames.append(json.loads(await client.receive_from(timeout=2)))
+            await client.send_to(text_data=json.dumps({'type': 'ack', 'seq': frames[-1]['seq']}))
+        return frames
+
+    async def test_later_move_does_not_replace_queued_add(self):
+        diagram = await Diagram.objects.acreate(title='Coalescing', diagram_json='{}')
+        path = f'/ws/diagrams/{diagram.id}/'
+        peer = WebsocketCommunicator(application, path)
+        author = WebsocketCommunicator(application, path)
+        await peer.connect()
+        await author.connect()
+        await asyncio.sleep(0.1)
+
+        # The peer has not acked the user_joined frame yet, so these queue up
+        for operation, x in (('add', 0), ('move', 1), ('move', 2), ('delete', 2), ('add', 3), ('move', 4)):
+            await author.send_to(text_data=json.dumps({
+                'type': 'diagram_update', 'operation': operation, 'shape_id': 's1',
+                'diagram_data': {'x': x}
+            }))
+        await asyncio.sleep(0.2)
+
+        frames = await self.receive_frames(peer, 6)
+        self.assertEqual(frames[0]['type'], 'user_joined')
+        self.assertEqual(
+            [(frame['operation'], frame['diagram_data']['x']) for frame in frames[1:]],
+            [('add', 0), ('move', 2), ('delete', 2), ('add', 3), ('move', 4)]
+        )
+        await peer.disconnect()
+        await author.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ConsumerSaveTests(TransactionTestCase):
+    """Collaborative saves that the storage layer rejects"""
+
+    async def test_duplicate_ids_are_reported_and_not_broadcast(self):
+        diagram = await Diagram.objects.acreate(
+            title='Duplicates', diagram_json='{}', storage_mode=Diagram.STORAGE_NORMALIZED
+        )
+        path = f'/ws/diagrams/{diagram.id}/'
+        peer = WebsocketCommunicator(application, path)
+        author = WebsocketCommunicator(application, path)
+        await peer.connect()
+        await author.connect()
+        self.assertEqual(json.loads(await peer.receive_from(timeout=2))['type'], 'user_joined')
+
+        shapes = [{'id': 's1', 'x': 0}, {'id': 's1', 'x': 1}]
+        await author.send_to(text_data=json.dumps({
+            'type': 'diagram_update', 'operation': 'save', 'diagram_data': {'shapes': shapes}
+        }))
+        error = json.loads(await author.receive_from(timeout=2))
+        self.assertEqual(error['type'], 'error')
+        self.assertEqual(error['duplicates'], [['shape', 's1']])
+        self.assertTrue(await peer.receive_nothing(timeout=0.2))
+        await diagram.arefresh_from_db()
+        self.assertEqual(diagram.diagram_json, '{}')
+        await peer.disconnect()
+        await author.disconnect()
+
+
+class RecorderTests(SimpleTestCase):
+    """Room recordings are buffered in memory and written by the background writer"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def wait_for_log(self, room, events):
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            paths = list(recorder.iter_log_paths([self.root]))
+            if paths and len(recorder.read_log(paths[0])[1]) >= events:
+                return recorder.read_log(paths[0])
+            time.sleep(0.01)
+        self.fail(f'Recording of room {room} was not flushed')
+
+    def test_quiet_room_is_flushed_on_the_writer_thread(self):
+        config = {'ENABLED': True, 'ROOT': self.root, 'FLUSH_RECORDS': 1000, 'FLUSH_SECONDS': 0.05}
+        with override_settings(COLLABORATION_RECORDING=config):
+            snapshot = {'version': 3, 'content_hash': 'abc', 'document': {'shapes': []}}
+            room = recorder.open_room('quiet', snapshot=lambda: snapshot)
+            # The second connection joins the running recording without a new snapshot
+            self.assertIs(recorder.open_room('quiet', snapshot=self.fail), room)
+            room.record('s1', 'connect')
+            header, events = self.wait_for_log('quiet', 1)
+            self.assertEqual(header['snapshot'], snapshot)
+
+            room.record('s1', 'message', '{"type": "chat_message"}')
+            recorder.release_room(room)
+            recorder.release_room(room)
+            _, events = self.wait_for_log('quiet', 2)
+            self.assertEqual([event['event'] for event in events], ['connect', 'message'])
+            self.assertIsNone(recorder._rooms.get('quiet'))
+
+    def test_load_recordings_returns_each_rooms_earliest_snapshot(self):
+        config = {'ENABLED': True, 'ROOT': self.root, 'FLUSH_SECONDS': 0.05}
+        with override_settings(COLLABORATION_RECORDING=config):
+            for version in (1, 2):
+                room = recorder.open_room('7', snapshot=lambda: {'version': version, 'document': {}})
+                room.record('s', 'connect')
+                recorder.release_room(room)
+                recorder.flush_all()
+        events, snapshots = recorder.load_recordings([self.root])
+        self.assertEqual(len(events), 2)
+        self.assertEqual(snapshots['7']['version'], 1)
+
+
+class LayoutPatchTests(SimpleTestCase):
+    """Direction handling and id round-tripping of layout patches"""
+
+    document = {
+        'shapes': [{'id': 1}, {'id': 2}, {'id': 3}],
+        'connections': [{'from': 1, 'to': 2}, {'from': '1', 'to': 3}],
+    }
+
+    def positions(self, **options):
+        patch = layout.layout_patch(self.document, **options)
+        return {shape['id']: (shape['x'], shape['y']) for shape in patch['shapes']}
+
+    def test_tree_mirrors_for_bottom_up_and_right_left(self):
+        for forward, backward, axis in (('TB', 'BT', 1), ('LR', 'RL', 0)):
+            ahead = self.positions(algorithm='tree', direction=forward)
+            behind = self.positions(algorithm='tree', direction=backward)
+            self.assertLess(ahead[1][axis], ahead[2][axis])
+            self.assertGreater(behind[1][axis], behind[2][axis])
+            self.assertEqual(ahead[2][1 - axis], behind[2][1 - axis])
+
+    def test_undirected_algorithms_reject_an_explicit_direction(self):
+        with self.assertRaisesMessage(ValueError, 'does not take a direction'):
+            layout.layout_patch(self.document, algorithm='radial', direction='LR')
+        # 'auto' may pick an undirected layout; the direction is then ignored
+        patch = layout.layout_patch(dict(self.document, type='mindmap'), direction='LR')
+        self.assertEqual(patch['algorithm'], 'radial')
+
+    def test_patch_keeps_numeric_ids(self):
+        self.assertEqual(sorted(self.positions(algorithm='layered')), [1, 2, 3])
+
+
+class DiagramCacheInvalidationTests(TransactionTestCase):
+    """Writes drop the cache entry of the body they replace"""
+
+    def setUp(self):
+        cache.get_cache().clear()
+        cache.reset_stats()
+
+    def cached_key(self, diagram):
+        return cache.make_key(diagram.pk, diagram.version, cache.content_token(diagram))
+
+    def test_save_drops_the_replaced_entry_once(self):
+        diagram = storage.save_document(Diagram(title='Cached'), {'shapes': [{'id': 'a'}]})
+        loaded = Diagram.objects.get(pk=diagram.pk)
+        loaded.get_diagram_data()
+        old_key = self.cached_key(loaded)
+        self.assertIsNotNone(cache.get_cache().get(old_key))
+
+        storage.save_document(loaded, {'shapes': [{'id': 'b'}]})
+        self.assertIsNone(cache.get_cache().get(old_key))
+        self.assertEqual(cache.get_stats()['invalidations'], 1)
+        self.assertEqual(Diagram.objects.get(pk=diagram.pk).get_diagram_data(), {'shapes': [{'id': 'b'}]})
+
+    def test_saves_that_keep_the_body_keep_the_entry(self):
+        diagram = storage.save_document(Diagram(title='Cached'), {'shapes': []})
+        loaded = Diagram.objects.get(pk=diagram.pk)
+        loaded.get_diagram_data()
+        loaded.title = 'Renamed'
+        loaded.save()
+        self.assertIsNotNone(cache.get_cache().get(self.cached_key(loaded)))
+        self.assertEqual(cache.get_stats()['invalidations'], 0)
+
+    def test_touch_drops_the_entry_it_made_stale(self):
+        diagram = storage.save_document(Diagram(title='Cached'), {'shapes': []})
+        loaded = Diagram.objects.get(pk=diagram.pk)
+        loaded.get_diagram_data()
+        old_key = self.cached_key(loaded)
+        storage.touch_diagram(loaded)
+        self.assertIsNone(cache.get_cache().get(old_key))
+        self.assertEqual(cache.get_stats()['invalidations'], 1)
+
+
+NOW = datetime(2026, 1, 10, 12, 0, tzinfo=timezone.utc)
+
+
+def add_version(diagram, number, age, body='{}', content=None):
+    """A DiagramVersion created ``age`` before NOW"""
+    version = DiagramVersion.objects.create(
+        diagram=diagram, version_number=number, diagram_json='' if content else body,
+        content=content, content_hash=storage.content_hash(body)
+    )
+    DiagramVersion.objects.filter(pk=version.pk).update(created_at=NOW - age)
+    return version.pk
+
+
+class RetentionTierTests(SimpleTestCase):
+    """Which versions each retention tier keeps"""
+
+    tiers = retention.DEFAULT_RETENTION['TIERS']
+
+    def expired(self, ages, tiers=None):
+        versions = [(name, NOW - age) for name, age in ages.items()]
+        return set(retention.select_expired_versions(versions, NOW, tiers or self.tiers))
+
+    def test_tier_boundaries(self):
+        self.assertEqual(self.expired({
+            # First 24 hours, boundary included: everything is kept
+            'recent': timedelta(hours=1),
+            'recent-2': timedelta(hours=2),
+            'day-edge': timedelta(hours=24),
+            # Up to a week: one per clock hour, the newest wins
+            'hour-newest': timedelta(hours=24, minutes=30),
+            'hour-older': timedelta(hours=25),
+            'next-hour': timedelta(hours=25, minutes=1),
+            'week-edge': timedelta(days=7),
+            # Beyond: one per calendar day
+            'day-newest': timedelta(days=8),
+            'day-older': timedelta(days=8, hours=1),
+        }), {'hour-older', 'day-older'})
+
+    def test_versions_past_a_bounded_last_tier_expire(self):
+        tiers = [{'max_age': timedelta(days=30), 'interval': None}]
+        self.assertEqual(self.expired({'kept': timedelta(days=30), 'old': timedelta(days=31)}, tiers), {'old'})
+
+
+@override_settings(DIAGRAM_DEDUP={'ENABLED': True, 'MIN_BYTES': 100})
+class RetentionCompactTests(TransactionTestCase):
+    """compact() thins history, purges deleted diagrams and collects shared bodies"""
+
+    def setUp(self):
+        self.live = Diagram.objects.create(title='Live', diagram_json='{}')
+        for number, hours in enumerate((1, 30, 29.5, 24 * 9), start=1):
+            add_version(self.live, number, timedelta(hours=hours))
+
+        shared_body = '{"shapes": [%s]}' % ','.join(['{"id": 1}'] * 20)
+        _, self.shared = storage.store_body(shared_body, storage.content_hash(shared_body))
+        own_body = '{"shapes": [%s]}' % ','.join(['{"id": 2}'] * 20)
+        _, self.own = storage.store_body(own_body, storage.content_hash(own_body))
+        add_version(self.live, 5, timedelta(hours=2), shared_body, self.shared)
+
+        # Deleted long enough ago to purge, and deleted too recently to purge
+        self.doomed = Diagram.objects.create(title='Doomed', diagram_json='{}', is_active=False)
+        add_version(self.doomed, 1, timedelta(days=60), shared_body, self.shared)
+        add_version(self.doomed, 2, timedelta(days=60), own_body, self.own)
+        self.recent = Diagram.objects.create(title='Recent', diagram_json='{}', is_active=False)
+        Diagram.objects.filter(pk=self.doomed.pk).update(updated_at=NOW - timedelta(days=31))
+        Diagram.objects.filter(pk=self.recent.pk).update(updated_at=NOW - timedelta(days=29))
+
+    def test_dry_run_reports_what_the_real_run_removes(self):
+        dry = retention.compact(dry_run=True, now=NOW, sleep=0)
+        self.assertEqual(DiagramVersion.objects.count(), 7)
+        real = retention.compact(now=NOW, sleep=0)
+        for field in ('versions_removed', 'diagrams_purged', 'contents_collected', 'content_bytes'):
+            self.assertEqual(dry[field], real[field], field)
+
+    def test_compact_keeps_tiers_and_unpurgeable_rows(self):
+        report = retention.compact(now=NOW, sleep=0, chunk_size=1)
+        # Version 2 shares an hour with the newer version 3
+        self.assertEqual(
+            sorted(DiagramVersion.objects.filter(diagram=self.live).values_list('version_number', flat=True)),
+            [1, 3, 4, 5]
+        )
+        self.assertEqual(
+            sorted(Diagram.objects.values_list('title', flat=True)), ['Live', 'Recent']
+        )
+        self.assertEqual((report['versions_removed'], report['diagrams_purged']), (3, 1))
+        # Only the body nothing else referenced is collected
+        self.assertEqual(list(DiagramContent.objects.values_list('pk', flat=True)), [self.shared.pk])
+        self.assertEqual(report['contents_collected'], 1)
+
+
+@override_settings(DIAGRAM_DEDUP={'ENABLED': True, 'MIN_BYTES': 100})
+class ArchiveRoundTripTests(TransactionTestCase):
+    """Archiving and rehydrating keep a diagram's body, history and dates"""
+
+    def setUp(self):
+        self.document = {'shapes': [{'id': n, 'x': n} for n in range(20)], 'connections': []}
+        diagram = storage.save_document(Diagram(title='Cold'), self.document)
+        large = json.dumps(self.document)
+        _, shared = storage.store_body(large, storage.content_hash(large))
+        add_version(diagram, 1, timedelta(days=90), '{"shapes": []}')
+        add_version(diagram, 2, timedelta(days=60), large, shared)
+        DiagramVersion.objects.filter(diagram=diagram, version_number=2).update(comment='Second')
+        Diagram.objects.filter(pk=diagram.pk).update(updated_at=NOW - timedelta(days=45))
+        self.diagram = Diagram.objects.get(pk=diagram.pk)
+        self.versions = list(
+            DiagramVersion.objects.filter(diagram=diagram).order_by('version_number')
+            .values_list('version_number', 'content_hash', 'comment', 'created_at')
+        )
+
+    def test_archive_then_rehydrate(self):
+        report = archive.archive_inactive(inactive_after=timedelta(days=30), now=NOW)
+        self.assertEqual((report['diagrams_archived'], report['versions_archived']), (1, 2))
+        archived = Diagram.objects.get(pk=self.diagram.pk)
+        self.assertTrue(archived.is_archived)
+        self.assertTrue(DiagramArchive.objects.filter(diagram=archived).exists())
+        self.assertEqual(archived.diagram_json, '')
+        self.assertFalse(DiagramVersion.objects.filter(diagram=archived).exists())
+        # Still readable straight from the archive
+        self.assertEqual(archived.load_diagram_data(), self.document)
+
+        restored = archive.rehydrate(self.diagram.pk)
+        restored = Diagram.objects.get(pk=restored.pk)
+        self.assertFalse(restored.is_archived)
+        self.assertFalse(DiagramArchive.objects.filter(diagram=restored).exists())
+        self.assertEqual(restored.load_diagram_data(), self.document)
+        self.assertEqual(restored.content_hash, self.diagram.content_hash)
+        self.assertEqual(restored.updated_at, self.diagram.updated_at)
+        self.assertEqual(
+            list(DiagramVersion.objects.filter(diagram=restored).order_by('version_number')
+                 .values_list('version_number', 'content_hash', 'comment', 'created_at')),
+            self.versions
+        )
+        self.assertEqual(
+            [version.get_body() for version in DiagramVersion.objects.filter(diagram=restored).order_by('version_number')],
+            ['{"shapes": []}', json.dumps(self.document)]
+        )
+
+    def test_recently_touched_diagrams_stay_hot(self):
+        report = archive.archive_inactive(inactive_after=timedelta(days=60), now=NOW)
+        self.assertEqual(report['diagrams_archived'], 0)
+        self.assertEqual(DiagramVersion.objects.filter(diagram=self.diagram).count(), 2)
+
+
+class BodyStoreGarbageCollectionTests(TransactionTestCase):
+    """gc_body_store only deletes files no DiagramContent row references"""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        store = override_settings(DIAGRAM_BODY_STORE={'ENABLED': True, 'ROOT': root, 'MIN_BYTES': 100})
+        store.enable()
+        self.addCleanup(store.disable)
+
+        self.document = {'shapes': [{'id': n} for n in range(20)]}
+        self.diagram = storage.save_document(Diagram(title='External'), self.document)
+        self.referenced = self.diagram.content_hash
+        self.orphan = storage.content_hash('orphan')
+        bodystore.write(self.orphan, 'orphan')
+
+    def gc(self, **options):
+        call_command('gc_body_store', min_age=0, stdout=io.StringIO(), **options)
+
+    def test_dry_run_deletes_nothing(self):
+        self.gc(dry_run=True)
+        self.assertTrue(bodystore.exists(self.referenced))
+        self.assertTrue(bodystore.exists(self.orphan))
+
+    def test_referenced_files_survive(self):
+        self.assertTrue(DiagramContent.objects.get(pk=self.referenced).external)
+        self.gc(batch_size=1)
+        self.assertFalse(bodystore.exists(self.orphan))
+        self.assertTrue(bodystore.exists(self.referenced))
+        self.assertEqual(Diagram.objects.get(pk=self.diagram.pk).load_diagram_data(), self.document)
+
+    def test_young_files_are_left_for_in_flight_saves(self):
+        call_command('gc_body_store', stdout=io.StringIO())
+        self.assertTrue(bodystore.exists(self.orphan))
+
+
+@override_settings(DIAGRAM_DEDUP={'ENABLED': True, 'MIN_BYTES': 100})
+class DedupeBodiesTests(TransactionTestCase):
+    """dedupe_bodies moves identical inline bodies into one shared row"""
+
+    def test_identical_bodies_share_one_row(self):
+        body = json.dumps({'shapes': [{'id': n} for n in range(20)]})
+        # Rows written before hashing existed: inline bodies, no hash
+        first = Diagram.objects.create(title='One', diagram_json=body)
+        second = Diagram.objects.create(title='Two', diagram_json=body)
+        small = Diagram.objects.create(title='Small', diagram_json='{"shapes": []}')
+        version = DiagramVersion.objects.create(diagram=first, version_number=1, diagram_json=body)
+        Diagram.objects.update(updated_at=NOW)
+
+        call_command('dedupe_bodies', batch_size=1, stdout=io.StringIO())
+
+        digest = storage.content_hash(body)
+        self.assertEqual(list(DiagramContent.objects.values_list('pk', flat=True)), [digest])
+        for row in (Diagram.objects.get(pk=first.pk), Diagram.objects.get(pk=second.pk),
+                    DiagramVersion.objects.get(pk=version.pk)):
+            self.assertEqual((row.diagram_json, row.content_id, row.content_hash), ('', digest, digest))
+            self.assertEqual(row.get_body(), body)
+        small = Diagram.objects.get(pk=small.pk)
+        # Small bodies stay inline but get their hash backfilled
+        self.assertEqual((small.diagram_json, small.content_id), ('{"shapes": []}', None))
+        self.assertEqual(small.content_hash, storage.content_hash('{"shapes": []}'))
+        self.assertEqual(set(Diagram.objects.values_list('updated_at', flat=True)), {NOW})
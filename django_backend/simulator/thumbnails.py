@@ -0,0 +1,262 @@
+"""
+Precomputed SVG thumbnails for diagram listings.
+
+Thumbnails are rendered from a document's ``shapes`` and ``connections``
+(scaled to fit, labels omitted) into a ``DiagramThumbnail`` row beside the
+diagram. Saves and element writes schedule a render once their transaction
+commits, on a background worker where the database allows concurrent
+writers. SQLite does not: a worker commit makes the snapshot of any
+request transaction that read before it stale, and that transaction then
+fails on its next write instead of waiting. On SQLite renders therefore
+run on the request thread after commit, which adds the render time to the
+saving request. Renders are skipped when the thumbnail already matches the
+current version and content, so redundant persists never re-render.
+"""
+
+import logging
+import math
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import quoteattr
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.urls import reverse
+
+from .models import Diagram, DiagramThumbnail
+from . import cache as diagram_cache
+from . import layout
+from . import storage
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    # Render on a worker thread (not on SQLite); False renders inline after commit
+    'BACKGROUND': True,
+    'WORKERS': 1,
+    'WIDTH': 240,
+    'HEIGHT': 160,
+    'PADDING': 8,
+    'MAX_SHAPES': 500,
+    'CACHE_SECONDS': 300,
+}
+
+DEFAULT_FILL = '#ffffff'
+DEFAULT_STROKE = '#334155'
+FILL_KEYS = ('fill', 'fillColor', 'backgroundColor', 'color')
+STROKE_KEYS = ('stroke', 'strokeColor', 'borderColor')
+COLOR_PATTERN = re.compile(r'^(#[0-9a-fA-F]{3,8}|[a-zA-Z]{3,20}|rgba?\([0-9.,%\s]+\))$')
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def get_config():
+    """Return thumbnail configuration merged with defaults"""
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'DIAGRAM_THUMBNAILS', {}))
+    return config
+
+
+def _color(element, keys, default):
+    style = element.get('style') if isinstance(element.get('style'), dict) else {}
+    for key in keys:
+        value = element.get(key, style.get(key))
+        if isinstance(value, str) and COLOR_PATTERN.match(value.strip()):
+            return value.strip()
+    return default
+
+
+def _fmt(value):
+    return f"{value:.1f}".rstrip('0').rstrip('.')
+
+
+def _shape_svg(shape_type, x, y, w, h, attrs):
+    shape_type = (shape_type or '').lower()
+    if shape_type in ('circle', 'ellipse', 'oval'):
+        return (f'<ellipse cx="{_fmt(x + w / 2)}" cy="{_fmt(y + h / 2)}" '
+                f'rx="{_fmt(w / 2)}" ry="{_fmt(h / 2)}"{attrs}/>')
+    if shape_type in ('diamond', 'decision', 'rhombus'):
+        points = [(x + w / 2, y), (x + w, y + h / 2), (x + w / 2, y + h), (x, y + h / 2)]
+        return f'<polygon points="{" ".join(f"{_fmt(px)},{_fmt(py)}" for px, py in points)}"{attrs}/>'
+    if shape_type in ('rounded', 'process', 'terminator', 'start', 'end'):
+        attrs = f' rx="{_fmt(min(w, h) * 0.15)}"{attrs}'
+    return f'<rect x="{_fmt(x)}" y="{_fmt(y)}" width="{_fmt(w)}" height="{_fmt(h)}"{attrs}/>'
+
+
+def render_svg(document, width=None, height=None):
+    """Render a scaled-down SVG preview of a diagram document"""
+    config = get_config()
+    width = width or config['WIDTH']
+    height = height or config['HEIGHT']
+    padding = config['PADDING']
+    document = document if isinstance(document, dict) else {}
+    canvas = document.get('canvas') if isinstance(document.get('canvas'), dict) else {}
+    background = _color(canvas, ('background', 'backgroundColor'), DEFAULT_FILL)
+
+    shapes = []
+    for shape in (document.get('shapes') or [])[:config['MAX_SHAPES']]:
+        if not isinstance(shape, dict):
+            continue
+        x = layout.as_float(shape.get('x'), 0.0)
+        y = layout.as_float(shape.get('y'), 0.0)
+        w = max(layout.as_float(shape.get('width'), layout.DEFAULT_WIDTH), 1.0)
+        h = max(layout.as_float(shape.get('height'), layout.DEFAULT_HEIGHT), 1.0)
+        shapes.append((shape, x, y, w, h))
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}">',
+        f'<rect width="100%" height="100%" fill={quoteattr(background)}/>',
+    ]
+    if shapes:
+        left = min(x for _, x, _, _, _ in shapes)
+        top = min(y for _, _, y, _, _ in shapes)
+        right = max(x + w for _, x, _, w, _ in shapes)
+        bottom = max(y + h for _, _, y, _, h in shapes)
+        scale = min((width - 2 * padding) / max(right - left, 1.0), (height - 2 * padding) / max(bottom - top, 1.0))
+        scale = min(scale, 1.0) if math.isfinite(scale) else 1.0
+        offset_x = (width - (right - left) * scale) / 2 - left * scale
+        offset_y = (height - (bottom - top) * scale) / 2 - top * scale
+
+        centers = {}
+        boxes = []
+        for shape, x, y, w, h in shapes:
+            box = (x * scale + offset_x, y * scale + offset_y, w * scale, h * scale)
+            boxes.append((shape, box))
+            if shape.get('id') is not None:
+                centers[str(shape['id'])] = (box[0] + box[2] / 2, box[1] + box[3] / 2)
+
+        lines = []
+        for connection in document.get('connections') or []:
+            if not isinstance(connection, dict):
+                continue
+            start = centers.get(layout.endpoint(connection, layout.SOURCE_KEYS))
+            end = centers.get(layout.endpoint(connection, layout.TARGET_KEYS))
+            if start and end:
+                lines.append(f'M{_fmt(start[0])} {_fmt(start[1])}L{_fmt(end[0])} {_fmt(end[1])}')
+        if lines:
+            parts.append(f'<path d="{"".join(lines)}" fill="none" stroke="#94a3b8" stroke-width="1"/>')
+
+        for shape, (x, y, w, h) in boxes:
+            attrs = (f' fill={quoteattr(_color(shape, FILL_KEYS, DEFAULT_FILL))}'
+                     f' stroke={quoteattr(_color(shape, STROKE_KEYS, DEFAULT_STROKE))}')
+            parts.append(_shape_svg(shape.get('type'), x, y, w, h, attrs))
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def is_current(thumbnail, diagram):
+    """
+    Whether a thumbnail was rendered from the diagram's current content.
+    Collaborative persists and element writes edit a version in place, so
+    the content hashes must match too.
+    """
+    if thumbnail is None or thumbnail.version != diagram.version:
+        return False
+    # Element writes clear the diagram's hash, so a missing hash means unknown content
+    if not diagram.content_hash or not thumbnail.content_hash:
+        return False
+    return thumbnail.content_hash == diagram.content_hash
+
+
+def generate(diagram, force=False):
+    """Render and store the thumbnail for a diagram unless it is already current"""
+    thumbnail = DiagramThumbnail.objects.filter(diagram_id=diagram.pk).first()
+    if not force and is_current(thumbnail, diagram):
+        return thumbnail
+    document = diagram.get_diagram_data()
+    digest = diagram.content_hash
+    if not digest:
+        digest = storage.content_hash(document)
+        # Restore the hash an element write cleared, unless the diagram changed again since
+        Diagram.objects.filter(pk=diagram.pk, content_hash='', updated_at=diagram.updated_at).update(
+            content_hash=digest
+        )
+    thumbnail, _ = DiagramThumbnail.objects.update_or_create(
+        diagram_id=diagram.pk,
+        defaults={
+            'svg': render_svg(document),
+            'version': diagram.version,
+            'content_hash': digest,
+        }
+    )
+    return thumbnail
+
+
+def generate_by_id(diagram_id, force=False):
+    """Render the thumbnail for a diagram id, ignoring missing or deleted rows"""
+    diagram = Diagram.objects.defer('diagram_json').filter(pk=diagram_id, is_active=True).first()
+    if diagram is None:
+        return None
+    return generate(diagram, force=force)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_config()['WORKERS'], thread_name_prefix='diagram-thumbnails'
+            )
+        return _executor
+
+
+def _render(diagram_id):
+    try:
+        generate_by_id(diagram_id)
+    except Exception:
+        # A failed preview must never fail the save that scheduled it
+        logger.exception("Failed to render thumbnail for diagram %s", diagram_id)
+
+
+def _run_job(diagram_id):
+    with _lock:
+        _pending.discard(diagram_id)
+    try:
+        _render(diagram_id)
+    finally:
+        # Worker threads hold their own connections; don't leak them
+        connections.close_all()
+
+
+def _submit(diagram_id):
+    # SQLite has a single writer and fails (rather than waits for) any
+    # transaction whose read snapshot a worker commit made stale, so renders
+    # stay on the request thread there
+    if not get_config()['BACKGROUND'] or connections['default'].vendor == 'sqlite':
+        _render(diagram_id)
+        return
+    with _lock:
+        # A render already queued for this diagram will pick up the latest version
+        if diagram_id in _pending:
+            return
+        _pending.add(diagram_id)
+    _get_executor().submit(_run_job, diagram_id)
+
+
+def schedule(diagram):
+    """Render a diagram's thumbnail after the current transaction commits"""
+    if not get_config()['ENABLED']:
+        return
+    diagram_id = diagram.pk
+    transaction.on_commit(lambda: _submit(diagram_id))
+
+
+def get_thumbnail(diagram):
+    """Return a current thumbnail, rendering it now if the worker has not yet"""
+    return generate(diagram)
+
+
+def thumbnail_url(diagram):
+    """
+    URL keyed on the diagram's content, so browsers can cache each rendering.
+    Collaborative persists and element writes re-render without bumping the
+    version, so the version alone would leave stale previews cached.
+    """
+    token = diagram_cache.content_token(diagram)
+    return f"{reverse('diagram_thumbnail', args=[diagram.pk])}?v={token}"
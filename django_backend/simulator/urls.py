@@ -1,15 +1,35 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
+
+# Hot read/save endpoints can be served by the async implementations
+hot_views = async_views if getattr(settings, 'DIAGRAM_ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     # Diagram CRUD operations
     path('diagrams/create/', views.create_new_diagram, name='create_diagram'),
-    path('diagrams/save/', views.save_diagram, name='save_diagram'),
-    path('diagrams/load/', views.load_diagram, name='list_diagrams'),
-    path('diagrams/load/<int:diagram_id>/', views.load_diagram, name='load_diagram'),
-    path('diagrams/history/<int:diagram_id>/', views.diagram_history, name='diagram_history'),
+    path('diagrams/save/', hot_views.save_diagram, name='save_diagram'),
+    path('diagrams/load/', hot_views.load_diagram, name='list_diagrams'),
+    path('diagrams/load/<int:diagram_id>/', hot_views.load_diagram, name='load_diagram'),
+    path('diagrams/body/<int:diagram_id>/', views.diagram_body, name='diagram_body'),
+    path('diagrams/thumbnail/<int:diagram_id>/', views.diagram_thumbnail, name='diagram_thumbnail'),
+    path('diagrams/search/', views.search_diagrams, name='search_diagrams'),
+    path('diagrams/history/<int:diagram_id>/', hot_views.diagram_history, name='diagram_history'),
+    path('diagrams/history/<int:diagram_id>/diff/', views.diagram_diff, name='diagram_diff'),
+    path('diagrams/history/<int:diagram_id>/restore/', views.restore_diagram_version, name='restore_diagram_version'),
     path('diagrams/delete/<int:diagram_id>/', views.delete_diagram, name='delete_diagram'),
     
+    # Element-level access
+    path('diagrams/<int:diagram_id>/elements/', views.diagram_elements, name='diagram_elements'),
+    path('diagrams/<int:diagram_id>/elements/<str:kind>/<str:element_id>/', views.diagram_element, name='diagram_element'),
+    path('diagrams/<int:diagram_id>/layout/', views.diagram_layout, name='diagram_layout'),
+    
+    # Async implementations, always reachable for side-by-side comparison
+    path('async/diagrams/save/', async_views.save_diagram, name='async_save_diagram'),
+    path('async/diagrams/load/', async_views.load_diagram, name='async_list_diagrams'),
+    path('async/diagrams/load/<int:diagram_id>/', async_views.load_diagram, name='async_load_diagram'),
+    path('async/diagrams/history/<int:diagram_id>/', async_views.diagram_history, name='async_diagram_history'),
+    
     # Export functionality
     path('diagrams/export/<int:diagram_id>/<str:format_type>/', views.export_diagram, name='export_diagram'),
     
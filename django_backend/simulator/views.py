@@ -1,70 +1,97 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, FileResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.contrib.auth.models import User
-from .models import Diagram, DiagramVersion, CollaborationSession
+from django.db import transaction
+from .models import Diagram, DiagramVersion, DiagramElement, CollaborationSession
+from . import cache as diagram_cache
+from . import storage
+from . import search
+from . import history
+from . import bodystore
+from . import layout
+from . import thumbnails
+from . import routers
+from . import archive
 import json
 import uuid
 from datetime import datetime
 
 
+def perform_save(diagram_id, title, diagram_json, user=None):
+    """
+    Apply a save request and return ``(diagram, unchanged)``.
+    Raises Diagram.DoesNotExist for unknown ids.
+    """
+    digest = storage.content_hash(diagram_json)
+    
+    if not diagram_id:
+        diagram = storage.save_document(Diagram(user=user, title=title, version=1), diagram_json, digest)
+        thumbnails.schedule(diagram)
+        return diagram, False
+    
+    with transaction.atomic():
+        diagram = archive.ensure_hydrated(Diagram.objects.defer('diagram_json').get(id=diagram_id))
+        if storage.is_unchanged(diagram, digest, title):
+            # Timer-driven saves of identical content don't create versions
+            return diagram, True
+        storage.snapshot_version(diagram, f"Auto-saved version {diagram.version}")
+        diagram.title = title
+        diagram.version += 1
+        storage.save_document(diagram, diagram_json, digest)
+    thumbnails.schedule(diagram)
+    return diagram, False
+
+
+def saved_payload(diagram, unchanged):
+    """Response body for a save request"""
+    return {
+        'success': True,
+        'unchanged': unchanged,
+        'diagram': {
+            'id': diagram.id,
+            'title': diagram.title,
+            'version': diagram.version,
+            'updated_at': diagram.updated_at
+        },
+        'message': 'Diagram unchanged' if unchanged else 'Diagram saved successfully'
+    }
+
+
 @api_view(['POST'])
 def save_diagram(request):
     """Save or update a diagram"""
     try:
         data = request.data
-        diagram_id = data.get('id')
-        title = data.get('title', 'Untitled Diagram')
-        diagram_json = data.get('diagram_json', '{}')
-        
-        if diagram_id:
-            try:
-                diagram = Diagram.objects.get(id=diagram_id)
-                DiagramVersion.objects.create(
-                    diagram=diagram,
-                    version_number=diagram.version,
-                    diagram_json=diagram.diagram_json,
-                    comment=f"Auto-saved version {diagram.version}"
-                )
-                diagram.title = title
-                diagram.diagram_json = json.dumps(diagram_json) if isinstance(diagram_json, dict) else diagram_json
-                diagram.version += 1
-                diagram.save()
-            except Diagram.DoesNotExist:
-                return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            diagram = Diagram.objects.create(
-                user=request.user if request.user.is_authenticated else None,
-                title=title,
-                diagram_json=json.dumps(diagram_json) if isinstance(diagram_json, dict) else diagram_json,
-                version=1
-            )
-        
-        return Response({
-            'success': True,
-            'diagram': {
-                'id': diagram.id,
-                'title': diagram.title,
-                'version': diagram.version,
-                'updated_at': diagram.updated_at
-            },
-            'message': 'Diagram saved successfully'
-        }, status=status.HTTP_200_OK)
+        diagram, unchanged = perform_save(
+            data.get('id'),
+            data.get('title', 'Untitled Diagram'),
+            data.get('diagram_json', '{}'),
+            user=request.user if request.user.is_authenticated else None
+        )
+        return Response(saved_payload(diagram, unchanged), status=status.HTTP_200_OK)
         
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except storage.DuplicateElementError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({'error': f'Failed to save diagram: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @api_view(['GET'])
+@routers.read_from_replica
 def load_diagram(request, diagram_id=None):
     """Load a specific diagram or list all diagrams"""
     try:
         if diagram_id:
             try:
-                diagram = Diagram.objects.get(id=diagram_id, is_active=True)
+                diagram = archive.ensure_hydrated(
+                    Diagram.objects.defer('diagram_json').get(id=diagram_id, is_active=True)
+                )
                 return Response({
                     'success': True,
                     'diagram': {
@@ -87,6 +114,7 @@ def load_diagram(request, diagram_id=None):
                 'id': d.id,
                 'title': d.title,
                 'version': d.version,
+                'thumbnail_url': thumbnails.thumbnail_url(d),
                 'created_at': d.created_at,
                 'updated_at': d.updated_at
             } for d in diagrams]
@@ -98,10 +126,89 @@ def load_diagram(request, diagram_id=None):
 
 
 @api_view(['GET'])
+def search_diagrams(request):
+    """Ranked full-text search over diagram titles and labels"""
+    try:
+        query = request.query_params.get('q', '').strip()
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+            page_size = min(max(int(request.query_params.get('page_size', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'page and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        total, results = search.search(
+            query,
+            user=request.user if request.user.is_authenticated else None,
+            page=page,
+            page_size=page_size
+        )
+        
+        return Response({
+            'success': True,
+            'query': query,
+            'count': total,
+            'page': page,
+            'page_size': page_size,
+            'results': results
+        }, status=status.HTTP_200_OK)
+        
+    except Exception as e:
+        return Response({'error': f'Failed to search diagrams: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def diagram_body(request, diagram_id):
+    """Return the raw diagram JSON, streamed from the body store when possible"""
+    try:
+        diagram = Diagram.objects.defer('diagram_json').select_related('content').get(id=diagram_id, is_active=True)
+        etag = f'"{diagram.content_hash}"' if diagram.content_hash else None
+        if etag and etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif diagram.content_id and diagram.content.external and not diagram.is_normalized:
+            # Stored bodies are immutable, so hand the file to the server as-is
+            response = FileResponse(bodystore.open_body(diagram.content_hash), content_type='application/json')
+        else:
+            response = HttpResponse(diagram.get_document_json(), content_type='application/json')
+        if etag:
+            response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+        
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': f'Failed to load diagram body: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def diagram_thumbnail(request, diagram_id):
+    """Return the SVG preview of a diagram's current version"""
+    try:
+        diagram = Diagram.objects.defer('diagram_json').get(id=diagram_id, is_active=True)
+        thumbnail = thumbnails.get_thumbnail(diagram)
+        etag = f'"{diagram.id}-{thumbnail.version}-{thumbnail.content_hash[:16]}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(thumbnail.svg, content_type='image/svg+xml')
+        response['ETag'] = etag
+        response['Cache-Control'] = f"private, max-age={thumbnails.get_config()['CACHE_SECONDS']}"
+        # Previews are plain shapes; never let an SVG run script
+        response['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+        return response
+        
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': f'Failed to load diagram thumbnail: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@routers.read_from_replica
 def diagram_history(request, diagram_id):
     """Get version history for a diagram"""
     try:
-        diagram = Diagram.objects.get(id=diagram_id, is_active=True)
+        diagram = archive.ensure_hydrated(Diagram.objects.get(id=diagram_id, is_active=True))
         versions = DiagramVersion.objects.filter(diagram=diagram)
         
         version_list = [{
@@ -123,6 +230,70 @@ def diagram_history(request, diagram_id):
         return Response({'error': f'Failed to get diagram history: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+def diagram_diff(request, diagram_id):
+    """Structural diff between two versions of a diagram"""
+    try:
+        diagram = archive.ensure_hydrated(
+            Diagram.objects.defer('diagram_json').get(id=diagram_id, is_active=True)
+        )
+        try:
+            from_version = int(request.query_params['from'])
+            to_version = int(request.query_params.get('to', diagram.version))
+        except (KeyError, ValueError):
+            return Response({'error': "'from' (and optional 'to') must be version numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        diff = history.diff_versions(diagram, from_version, to_version)
+        if diff is None:
+            return Response({'error': 'Version not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response({
+            'success': True,
+            'diagram_id': diagram.id,
+            'from_version': from_version,
+            'to_version': to_version,
+            'diff': diff
+        }, status=status.HTTP_200_OK)
+        
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': f'Failed to diff diagram versions: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+def restore_diagram_version(request, diagram_id):
+    """Make a previous version current again"""
+    try:
+        try:
+            version_number = int(request.data.get('version'))
+        except (TypeError, ValueError):
+            return Response({'error': "'version' must be a version number"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        diagram = history.restore_version(diagram_id, version_number, request.data.get('comment'))
+        if diagram is None:
+            return Response({'error': 'Version not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        return Response({
+            'success': True,
+            'diagram': {
+                'id': diagram.id,
+                'title': diagram.title,
+                'version': diagram.version,
+                'restored_from': version_number,
+                'updated_at': diagram.updated_at
+            },
+            'message': f'Version {version_number} restored successfully'
+        }, status=status.HTTP_200_OK)
+        
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except storage.DuplicateElementError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({'error': f'Failed to restore diagram version: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['POST'])
 def create_new_diagram(request):
     """Create a new blank diagram"""
@@ -138,12 +309,11 @@ def create_new_diagram(request):
             'metadata': {'created': datetime.now().isoformat(), 'version': 1}
         }
         
-        diagram = Diagram.objects.create(
+        diagram = storage.save_document(Diagram(
             user=request.user if request.user.is_authenticated else None,
             title=title,
-            diagram_json=json.dumps(initial_data),
             version=1
-        )
+        ), initial_data)
         
         return Response({
             'success': True,
@@ -180,10 +350,11 @@ def delete_diagram(request, diagram_id):
 
 
 @api_view(['GET'])
+@routers.read_from_replica
 def export_diagram(request, diagram_id, format_type):
     """Export diagram in various formats"""
     try:
-        diagram = Diagram.objects.get(id=diagram_id, is_active=True)
+        diagram = Diagram.objects.defer('diagram_json').get(id=diagram_id, is_active=True)
         
         if format_type.lower() == 'json':
             return Response({
@@ -196,7 +367,7 @@ def export_diagram(request, diagram_id, format_type):
         elif format_type.lower() == 'xml':
             xml_data = f"""<?xml version="1.0" encoding="UTF-8"?>
 <diagram title="{diagram.title}" version="{diagram.version}">
-    <data>{diagram.diagram_json}</data>
+    <data>{diagram.get_diagram_json()}</data>
 </diagram>"""
             
             return Response({
@@ -215,11 +386,134 @@ def export_diagram(request, diagram_id, format_type):
         return Response({'error': f'Failed to export diagram: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+def diagram_elements(request, diagram_id):
+    """Fetch shapes and connections of a diagram by kind, type or id"""
+    try:
+        diagram = archive.ensure_hydrated(
+            Diagram.objects.defer('diagram_json').get(id=diagram_id, is_active=True)
+        )
+        kind = request.query_params.get('kind')
+        if kind and kind not in DiagramElement.KIND_KEYS:
+            return Response({'error': f'Unknown element kind: {kind}'}, status=status.HTTP_400_BAD_REQUEST)
+        ids = request.query_params.get('ids')
+        
+        elements = storage.get_elements(
+            diagram,
+            kind=kind,
+            element_type=request.query_params.get('type'),
+            element_ids=ids.split(',') if ids else None
+        )
+        
+        return Response({
+            'success': True,
+            'diagram_id': diagram.id,
+            'version': diagram.version,
+            'storage_mode': diagram.storage_mode,
+            'elements': elements
+        }, status=status.HTTP_200_OK)
+        
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': f'Failed to load diagram elements: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['PUT', 'PATCH', 'DELETE'])
+def diagram_element(request, diagram_id, kind, element_id):
+    """Replace, merge into or delete a single shape or connection"""
+    try:
+        if kind not in DiagramElement.KIND_KEYS:
+            return Response({'error': f'Unknown element kind: {kind}'}, status=status.HTTP_400_BAD_REQUEST)
+        diagram = archive.ensure_hydrated(
+            Diagram.objects.defer('diagram_json').get(id=diagram_id, is_active=True)
+        )
+        
+        if request.method == 'DELETE':
+            if not storage.delete_element(diagram, kind, element_id):
+                return Response({'error': 'Element not found'}, status=status.HTTP_404_NOT_FOUND)
+            return Response({
+                'success': True,
+                'message': 'Element deleted successfully'
+            }, status=status.HTTP_200_OK)
+        
+        element = request.data.get('data', request.data)
+        if not isinstance(element, dict):
+            return Response({'error': 'Element data must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if request.method == 'PATCH':
+            existing = storage.get_elements(diagram, kind=kind, element_ids=[element_id])
+            if not existing:
+                return Response({'error': 'Element not found'}, status=status.HTTP_404_NOT_FOUND)
+            element = {**existing[0]['data'], **element}
+        
+        element = storage.put_element(diagram, kind, element_id, dict(element))
+        
+        return Response({
+            'success': True,
+            'element': {'kind': kind, 'id': element_id, 'data': element},
+            'message': 'Element saved successfully'
+        }, status=status.HTTP_200_OK)
+        
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': f'Failed to update diagram element: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['POST'])
+def diagram_layout(request, diagram_id):
+    """Compute an automatic layout and return the new shape positions without saving"""
+    try:
+        diagram = Diagram.objects.defer('diagram_json').get(id=diagram_id, is_active=True)
+        document = diagram.get_diagram_data()
+        if not isinstance(document, dict):
+            return Response({'error': 'Diagram body is not a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        options = {}
+        if request.data.get('direction') is not None:
+            # Validated in layout_patch, which also rejects it for undirected algorithms
+            options['direction'] = request.data['direction']
+        try:
+            # Capped further by node count in layout_patch
+            iterations = max(int(request.data.get('iterations', 100)), 1)
+            seed = int(request.data.get('seed', 0))
+        except (TypeError, ValueError):
+            return Response({'error': "'iterations' and 'seed' must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            patch = layout.layout_patch(
+                document,
+                algorithm=request.data.get('algorithm', 'auto'),
+                iterations=iterations,
+                seed=seed,
+                **options
+            )
+        except layout.LayoutTooLarge as e:
+            return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'success': True,
+            'diagram_id': diagram.id,
+            'version': diagram.version,
+            'layout': patch
+        }, status=status.HTTP_200_OK)
+        
+    except Diagram.DoesNotExist:
+        return Response({'error': 'Diagram not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({'error': f'Failed to compute diagram layout: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 def health_check(request):
     """Health check endpoint"""
     return Response({
         'status': 'healthy',
         'service': 'Diagram Simulator API',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'cache': diagram_cache.get_stats(),
+        'read_replicas': routers.get_replicas()
     }, status=status.HTTP_200_OK)